@@ -7,7 +7,10 @@ import time
 
 from flask import Flask, jsonify, request
 from flask.logging import default_handler
+from datafunctions.database import get_pool
 from datafunctions.log.log import startLog, getLogFile, tailLogFile
+from datafunctions.metrics import read_snapshots, snapshot
+from datafunctions.model.similar import IndexUnavailableError, get_similar_jobs
 
 
 SCRAPER_NAME = './run_scrapers.py'
@@ -31,6 +34,10 @@ def index():
 		<html><head></head><body>
 			Health check: <a href="/health">/health</a>
 			<br>
+			Scraper and model metrics: <a href="/metrics">/metrics</a>
+			<br>
+			Similar jobs: <a href="/similar">/similar</a>
+			<br>
 			Start scrapers: <a href="/start">/start</a>
 			<br>
 			Kill scrapers: <a href="/kill">/kill</a>
@@ -86,6 +93,7 @@ def health():
 	outputs = {}
 	outputs['scrapers running'] = check_running(SCRAPER_NAME)
 	outputs['models running'] = check_running(MODEL_NAME)
+	outputs['database'] = check_database()
 	outputs['free'] = os.popen('free -h').read()
 	outputs['dstat'] = os.popen('dstat -cdlimnsty 1 0').read()
 	outputs['top'] = os.popen('top -bn1').read()
@@ -103,6 +111,70 @@ def health():
 	return r
 
 
+@application.route('/metrics', methods=['GET'])
+def metrics():
+	"""
+	Gets the latest metrics snapshot of each scraper and model process,
+		such as the scrapers' current request rate and backoff events.
+	"""
+
+	APP_LOG.info('/metrics called')
+	try:
+		snapshots = read_snapshots()
+		snapshots['application'] = snapshot()
+		return jsonify(snapshots)
+	except Exception as e:
+		APP_LOG.warn(f'Exception while reading metrics: {e}')
+		APP_LOG.warn(e, exc_info=True)
+		return jsonify({'error': f'Exception {type(e)} reading metrics: {e}'}), 500
+
+
+@application.route('/similar', methods=['GET', 'POST'])
+def similar():
+	"""
+	Finds the jobs most similar to a job or a description, by their lda17 topics.
+	"""
+
+	params = (request.get_json(silent=True) or {}) if request.method == 'POST' else request.args
+	job_id = params.get('job_id', None)
+	description = params.get('description', None)
+	if job_id is None and description is None:
+		return('''
+		<pre>
+			Parameters, as query parameters or a JSON body:
+				job_id: The job to find similar jobs to
+				description: A job description to find similar jobs to, instead of a job_id
+				k: Number of similar jobs to get
+					Defaults to 10, at most 100
+		</pre>
+		''')
+
+	start = time.monotonic()
+	try:
+		results = get_similar_jobs().similar(
+			job_id=int(job_id) if job_id is not None else None,
+			description=description,
+			k=int(params.get('k', 10)),
+		)
+	except ValueError as e:
+		return jsonify({'error': str(e)}), 400
+	except KeyError as e:
+		return jsonify({'error': e.args[0]}), 404
+	except (IndexUnavailableError, TimeoutError) as e:
+		APP_LOG.warn(f'Exception {type(e)} while finding similar jobs: {e}')
+		return jsonify({'error': str(e)}), 503
+	except Exception as e:
+		APP_LOG.warn(f'Exception {type(e)} while finding similar jobs: {e}')
+		APP_LOG.warn(e, exc_info=True)
+		return jsonify({'error': f'Exception {type(e)} finding similar jobs: {e}'}), 500
+
+	return jsonify({
+		'job_id': int(job_id) if job_id is not None else None,
+		'similar': [{'job_id': similar_job_id, 'distance': distance} for similar_job_id, distance in results],
+		'elapsed_ms': (time.monotonic() - start) * 1000,
+	})
+
+
 @application.route('/kill', methods=['GET', 'POST'])
 def kill():
 	"""
@@ -306,6 +378,26 @@ def check_running(pname):
 	return result == 0
 
 
+def check_database():
+	"""
+	Checks the database answers, with a connection borrowed from the app's pool.
+	"""
+
+	pool = get_pool()
+	start = time.monotonic()
+	try:
+		with pool.connection(timeout=5, statement_timeout=5) as db_conn:
+			curr = db_conn.cursor()
+			curr.execute('SELECT 1;')
+			curr.fetchone()
+			curr.close()
+		result = f'OK in {time.monotonic() - start:.3f} seconds'
+	except Exception as e:
+		APP_LOG.warn(f'Exception {type(e)} while checking database: {e}')
+		result = f'Failed: {e}'
+	return f'{result}\npool: {pool.stats()}'
+
+
 def start_and_disown(pname):
 	with open(os.devnull, 'r+b', 0) as DEVNULL:
 		subprocess.Popen(['nohup', sys.executable, pname],
@@ -0,0 +1,347 @@
+"""
+Database connections and setup helpers.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+from contextlib import contextmanager
+from decouple import config
+from os.path import dirname, join
+from typing import Optional
+
+from datafunctions import metrics
+
+DATABASE_LOG = logging.getLogger(__name__)
+
+SCHEMA_DIRECTORY = join(dirname(__file__), 'db', 'schema')
+
+
+def connect(**kwargs):
+	"""
+	Opens a new database connection configured from the DB_* settings.
+
+	Args:
+		**kwargs: Overrides for the psycopg2.connect parameters.
+
+	Returns:
+		The connection.
+	"""
+
+	params = {
+		'dbname': config("DB_DB"),
+		'user': config("DB_USER"),
+		'password': config("DB_PASSWORD"),
+		'host': config("DB_HOST"),
+		'port': config("DB_PORT"),
+	}
+	params.update(kwargs)
+	return psycopg2.connect(**params)
+
+
+def ensure_schema(db_conn, name: str) -> None:
+	"""
+	Runs one of the idempotent schema files in datafunctions/db/schema.
+
+	Args:
+		db_conn: Connection to the database.
+		name (str): Name of the schema file, without the .sql extension.
+	"""
+
+	DATABASE_LOG.info(f'Ensuring schema {name}...')
+	with open(join(SCHEMA_DIRECTORY, f'{name}.sql')) as f:
+		statements = f.read()
+	curr = db_conn.cursor()
+	try:
+		curr.execute(statements)
+		db_conn.commit()
+	except Exception:
+		db_conn.rollback()
+		raise
+	finally:
+		curr.close()
+	DATABASE_LOG.info(f'Schema {name} ensured.')
+
+
+class ConnectionPool:
+	"""
+	Bounded, thread-safe pool of database connections, opened as they are needed.
+
+	A borrower waits up to `timeout` seconds for a connection once `max_size` are lent out.
+		A connection is health-checked when it is borrowed after being idle for `check_after` seconds,
+		and replaced if it fails. Each checkout sets the connection's isolation level and statement timeout,
+		so a borrower never inherits another's settings. Work not committed when a connection
+		is returned is rolled back.
+
+	A process forked from one using the pool gets its own connections; the parent's are never touched.
+	"""
+
+	def __init__(
+			self,
+			max_size: int = 10,
+			timeout: float = 30.0,
+			isolation_level: int = psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED,
+			statement_timeout: float = 0.0,
+			check_after: float = 30.0,
+			**connect_kwargs
+	):
+		"""
+		Args:
+			max_size (int, optional): Maximum number of connections, lent out or idle. Defaults to 10.
+			timeout (float, optional): Seconds to wait for a connection. Defaults to 30.
+			isolation_level (int, optional): Default isolation level of a checkout,
+				one of the psycopg2.extensions.ISOLATION_LEVEL_* constants. Defaults to READ COMMITTED.
+			statement_timeout (float, optional): Default seconds a statement may run before the server cancels it.
+				0 for no limit. Defaults to 0.
+			check_after (float, optional): Seconds a connection can be idle before it is checked. Defaults to 30.
+			**connect_kwargs: Passed to `connect`.
+		"""
+
+		self.max_size = max(1, int(max_size))
+		self.timeout = timeout
+		self.isolation_level = isolation_level
+		self.statement_timeout = statement_timeout
+		self.check_after = check_after
+		self.connect_kwargs = connect_kwargs
+		self.closed = False
+		self.opened = 0
+		self.checkouts = 0
+		self.failed_checks = 0
+		self.wait_seconds = 0.0
+		self._lock = threading.Lock()
+		self._reset()
+
+	def _reset(self) -> None:
+		self.pid = os.getpid()
+		self.idle = []  # (connection, time it was returned)
+		self.lent = 0
+		self._settings = {}  # Connection: (isolation level, statement timeout) it is set to
+		self._slots = threading.BoundedSemaphore(self.max_size)
+
+	def _check_fork(self) -> None:
+		if self.pid == os.getpid():
+			return
+		with self._lock:
+			if self.pid == os.getpid():
+				return
+			# Closing, or garbage collecting, the parent's connections here would end the parent's sessions,
+			# so they are kept, unused, for the life of this process
+			_forked_connections.extend(conn for conn, _ in self.idle)
+			self._reset()
+
+	def getconn(self, timeout: Optional[float] = None, isolation_level: Optional[int] = None, statement_timeout: Optional[float] = None):
+		"""
+		Borrows a healthy connection, waiting for one to be returned if all are lent out.
+
+		Args:
+			timeout (float, optional): Seconds to wait. Defaults to the pool's timeout.
+			isolation_level (int, optional): Isolation level for this checkout. Defaults to the pool's.
+			statement_timeout (float, optional): Statement timeout for this checkout, in seconds. Defaults to the pool's.
+
+		Raises:
+			Exception: If no connection was available in time, or one could not be opened.
+
+		Returns:
+			The connection. It must be given back with `putconn`.
+		"""
+
+		self._check_fork()
+		timeout = self.timeout if timeout is None else timeout
+		start = time.monotonic()
+		if not self._slots.acquire(timeout=timeout):
+			raise Exception(f'No database connection available after {timeout} seconds.')
+		try:
+			conn = self._take_healthy()
+			try:
+				self._configure(
+					conn,
+					self.isolation_level if isolation_level is None else isolation_level,
+					self.statement_timeout if statement_timeout is None else statement_timeout,
+				)
+			except Exception:
+				self._discard(conn)
+				raise
+		except Exception:
+			self._slots.release()
+			raise
+		with self._lock:
+			self.lent += 1
+			self.checkouts += 1
+			self.wait_seconds += time.monotonic() - start
+		return conn
+
+	def putconn(self, conn, broken: bool = False) -> None:
+		"""
+		Gives a borrowed connection back, rolling back any open transaction.
+
+		Args:
+			conn: Connection from `getconn`.
+			broken (bool, optional): Whether the borrower knows the connection is unusable. Defaults to False.
+		"""
+
+		if self.pid != os.getpid():
+			# Borrowed before a fork; it belongs to the parent
+			return
+		try:
+			if not broken and not conn.closed:
+				try:
+					if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+						conn.rollback()
+				except Exception as e:
+					DATABASE_LOG.info(f'Exception {type(e)} while resetting returned connection: {e}')
+					broken = True
+			with self._lock:
+				self.lent -= 1
+				keep = not (broken or conn.closed or self.closed)
+				if keep:
+					self.idle.append((conn, time.monotonic()))
+			if not keep:
+				self._discard(conn)
+		finally:
+			self._slots.release()
+
+	@contextmanager
+	def connection(self, commit: bool = False, **kwargs):
+		"""
+		Borrows a connection for the duration of a `with` block.
+			A connection that raised a connection error is discarded rather than reused.
+			Work left uncommitted when the block ends is rolled back, unless `commit` is set.
+
+		Args:
+			commit (bool, optional): Whether to commit when the block ends without an exception,
+				as a `with psycopg2.connect(...)` block does. Defaults to False.
+			**kwargs: Passed to `getconn`.
+		"""
+
+		conn = self.getconn(**kwargs)
+		broken = False
+		try:
+			yield conn
+			if commit:
+				conn.commit()
+		except (psycopg2.OperationalError, psycopg2.InterfaceError):
+			broken = True
+			raise
+		finally:
+			self.putconn(conn, broken=broken)
+
+	def is_healthy(self, conn, idle_seconds: float) -> bool:
+		"""
+		Checks a connection is open and, if it has been idle a while, that the server answers.
+		"""
+
+		if conn.closed:
+			return False
+		if idle_seconds < self.check_after:
+			return True
+		try:
+			curr = conn.cursor()
+			curr.execute('SELECT 1;')
+			curr.fetchone()
+			curr.close()
+			conn.rollback()
+			return True
+		except Exception as e:
+			DATABASE_LOG.info(f'Health check of idle connection failed: {e}')
+			return False
+
+	def close(self) -> None:
+		"""
+		Closes every idle connection. Connections still lent out are closed when they are returned.
+		"""
+
+		self._check_fork()
+		with self._lock:
+			self.closed = True
+			idle = self.idle
+			self.idle = []
+		for conn, _ in idle:
+			self._discard(conn)
+
+	def stats(self) -> dict:
+		with self._lock:
+			return {
+				'max_size': self.max_size,
+				'lent': self.lent,
+				'idle': len(self.idle),
+				'opened': self.opened,
+				'checkouts': self.checkouts,
+				'failed_checks': self.failed_checks,
+				'mean_wait_seconds': round(self.wait_seconds / self.checkouts, 4) if self.checkouts else 0.0,
+			}
+
+	def _take_healthy(self):
+		while True:
+			with self._lock:
+				if self.closed:
+					raise Exception('Connection pool is closed.')
+				entry = self.idle.pop() if self.idle else None
+			if entry is None:
+				DATABASE_LOG.info('Opening pooled database connection...')
+				conn = connect(**self.connect_kwargs)
+				with self._lock:
+					self.opened += 1
+				return conn
+			conn, returned_at = entry
+			if self.is_healthy(conn, time.monotonic() - returned_at):
+				return conn
+			with self._lock:
+				self.failed_checks += 1
+			DATABASE_LOG.warn('Pooled database connection failed its health check, replacing it...')
+			self._discard(conn)
+
+	def _configure(self, conn, isolation_level: int, statement_timeout: float) -> None:
+		settings = (isolation_level, statement_timeout)
+		if conn.autocommit:
+			conn.autocommit = False
+		elif self._settings.get(conn) == settings:
+			return
+		conn.set_session(isolation_level=isolation_level)
+		curr = conn.cursor()
+		try:
+			curr.execute('SET statement_timeout = %(milliseconds)s;', {'milliseconds': int(statement_timeout * 1000)})
+		finally:
+			curr.close()
+		conn.commit()
+		self._settings[conn] = settings
+
+	def _discard(self, conn) -> None:
+		self._settings.pop(conn, None)
+		try:
+			conn.close()
+		except Exception as e:
+			DATABASE_LOG.info(f'Exception {type(e)} while closing pooled connection: {e}')
+
+	def __enter__(self):
+		return (self)
+
+	def __exit__(self, exc_type, exc_value, tb):
+		self.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_forked_connections = []
+
+
+def get_pool() -> ConnectionPool:
+	"""
+	Gets the process's shared connection pool, creating it on first use,
+		configured from the DB_* settings, DB_POOL_SIZE, DB_POOL_TIMEOUT and DB_STATEMENT_TIMEOUT.
+	"""
+
+	global _pool
+	with _pool_lock:
+		if _pool is None:
+			_pool = ConnectionPool(
+				max_size=config('DB_POOL_SIZE', default=10, cast=int),
+				timeout=config('DB_POOL_TIMEOUT', default=30.0, cast=float),
+				statement_timeout=config('DB_STATEMENT_TIMEOUT', default=0.0, cast=float),
+			)
+			metrics.register('database.pool', _pool.stats)
+	return _pool
@@ -0,0 +1,9 @@
+-- Jobs saved while a near-duplicate of another job was already stored (see retrieve/neardup.py),
+-- with the estimated Jaccard similarity of their descriptions.
+CREATE TABLE IF NOT EXISTS job_duplicates (
+	job_id INTEGER PRIMARY KEY REFERENCES job_listings(id),
+	duplicate_of INTEGER NOT NULL REFERENCES job_listings(id),
+	similarity REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS job_duplicates_duplicate_of_idx ON job_duplicates (duplicate_of);
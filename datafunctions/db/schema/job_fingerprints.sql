@@ -0,0 +1,5 @@
+-- Hash of a job's normalized title and description (see utils.content_fingerprint),
+-- so duplicate checks are an index lookup instead of a full-text comparison.
+-- Rows added before this column existed are filled in by `run_maintenance.py backfill-fingerprints`.
+ALTER TABLE job_descriptions ADD COLUMN IF NOT EXISTS fingerprint CHAR(40);
+CREATE INDEX IF NOT EXISTS job_descriptions_fingerprint_idx ON job_descriptions (fingerprint);
@@ -0,0 +1,9 @@
+-- Maps each job listing to the id it has on the site it was scraped from,
+-- so already-stored jobs can be skipped before their details are fetched.
+CREATE TABLE IF NOT EXISTS job_source_ids (
+	id SERIAL PRIMARY KEY,
+	job_id INTEGER NOT NULL REFERENCES job_listings(id),
+	source TEXT NOT NULL,
+	source_id TEXT NOT NULL,
+	UNIQUE (source, source_id)
+);
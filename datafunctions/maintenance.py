@@ -0,0 +1,175 @@
+"""
+One-off and periodic database maintenance tasks.
+"""
+
+import logging
+
+from psycopg2.extras import execute_values
+from typing import Optional
+
+from datafunctions.database import ensure_schema
+from datafunctions.retrieve.neardup import DEFAULT_INDEX_PATH, NearDuplicateIndex
+from datafunctions.retrieve.persist import BatchPersister
+from datafunctions.utils import content_fingerprint
+
+MAINTENANCE_LOG = logging.getLogger(__name__)
+
+
+def backfill_fingerprints(db_conn, batch_size: int = 1000) -> int:
+	"""
+	Fills in job_descriptions.fingerprint for rows stored before it existed.
+		Each batch is committed separately, so an interrupted backfill can simply be rerun.
+
+	Args:
+		db_conn: Connection to the database.
+		batch_size (int, optional): Rows fingerprinted per transaction. Defaults to 1000.
+
+	Returns:
+		int: Number of rows updated.
+	"""
+
+	missing_query = '''
+		SELECT job_descriptions.id, job_listings.title, job_descriptions.description
+		FROM job_descriptions
+		INNER JOIN job_listings
+		ON job_listings.id = job_descriptions.job_id
+		WHERE job_descriptions.fingerprint IS NULL
+		LIMIT %(limit)s;
+	'''
+
+	update_query = '''
+		UPDATE job_descriptions
+		SET fingerprint = v.fingerprint
+		FROM (VALUES %s) AS v(id, fingerprint)
+		WHERE job_descriptions.id = v.id;
+	'''
+
+	ensure_schema(db_conn, 'job_fingerprints')
+	MAINTENANCE_LOG.info('Backfilling job description fingerprints...')
+	updated = 0
+	while True:
+		curr = db_conn.cursor()
+		try:
+			curr.execute(missing_query, {'limit': batch_size})
+			rows = curr.fetchall()
+			if not rows:
+				db_conn.commit()
+				break
+			execute_values(
+				curr,
+				update_query,
+				[(row_id, content_fingerprint(title, description)) for row_id, title, description in rows],
+				template='(%s::integer, %s::char(40))',
+				page_size=len(rows),
+			)
+			db_conn.commit()
+		except Exception:
+			db_conn.rollback()
+			raise
+		finally:
+			curr.close()
+		updated += len(rows)
+		MAINTENANCE_LOG.info(f'Fingerprinted {updated} descriptions so far...')
+
+	MAINTENANCE_LOG.info(f'Done backfilling fingerprints, {updated} rows updated.')
+	return updated
+
+
+def index_near_duplicates(db_conn, index: Optional[NearDuplicateIndex] = None, batch_size: int = 1000) -> int:
+	"""
+	Adds every stored job description missing from the near-duplicate index to it,
+		e.g. jobs saved before the index was enabled. Descriptions are read and appended
+		a batch at a time, so an interrupted run can simply be rerun.
+
+	Args:
+		db_conn: Connection to the database.
+		index (NearDuplicateIndex, optional): Index to fill. Defaults to the scrapers' index file.
+		batch_size (int, optional): Descriptions read per query. Defaults to 1000.
+
+	Returns:
+		int: Number of descriptions indexed.
+	"""
+
+	ids_query = '''
+		SELECT DISTINCT job_id
+		FROM job_descriptions
+		ORDER BY job_id;
+	'''
+
+	descriptions_query = '''
+		SELECT DISTINCT ON (job_id) job_id, description
+		FROM job_descriptions
+		WHERE job_id = ANY(%(job_ids)s)
+		ORDER BY job_id, id;
+	'''
+
+	if index is None:
+		index = NearDuplicateIndex(DEFAULT_INDEX_PATH)
+	MAINTENANCE_LOG.info(f'Indexing job descriptions for near-duplicate detection, {len(index)} already indexed...')
+	curr = db_conn.cursor()
+	try:
+		curr.execute(ids_query)
+		missing = [row[0] for row in curr.fetchall() if row[0] not in index.signatures]
+		MAINTENANCE_LOG.info(f'{len(missing)} descriptions to index.')
+		indexed = 0
+		for start in range(0, len(missing), batch_size):
+			curr.execute(descriptions_query, {'job_ids': missing[start:start + batch_size]})
+			indexed += index.add_many((job_id, index.signature(description)) for job_id, description in curr.fetchall())
+			MAINTENANCE_LOG.info(f'Indexed {indexed} descriptions so far...')
+		db_conn.commit()
+	except Exception:
+		db_conn.rollback()
+		raise
+	finally:
+		curr.close()
+
+	MAINTENANCE_LOG.info(f'Done indexing descriptions, {indexed} added, {len(index)} indexed.')
+	return indexed
+
+
+def rebuild_from_cache(db_conn, scraper, batch_size: int = 50) -> int:
+	"""
+	Reparses every details document in a scraper's response cache and saves the jobs
+		not already stored, without any requests, e.g. to rebuild a database or to
+		pick up a change to parsing. Documents that fail to parse are logged and skipped.
+
+	Args:
+		db_conn: Connection to the database.
+		scraper: Scraper with a `response_cache`, whose `parse_details` converts its documents.
+		batch_size (int, optional): Results saved per transaction. Defaults to 50.
+
+	Raises:
+		ValueError: If the scraper has no response cache.
+
+	Returns:
+		int: Number of new job listings added.
+	"""
+
+	if scraper.response_cache is None:
+		raise ValueError(f'{scraper.source_name} scraper has no response cache to rebuild from.')
+	scraper.prepare(db_conn)
+	cache = scraper.response_cache
+	jobids = scraper.filter_known_jobids(db_conn, list(cache.keys()))
+	MAINTENANCE_LOG.info(f'Rebuilding {len(jobids)} {scraper.source_name} jobs from cached responses...')
+	persister = BatchPersister(
+		db_conn,
+		batch_size=batch_size,
+		dimension_cache=scraper.dimension_cache,
+		near_duplicates=scraper.near_duplicates,
+		near_duplicate_action=scraper.near_duplicate_action,
+	)
+	failed = 0
+	for jobid in jobids:
+		entry = cache.get(jobid)
+		if entry is None:
+			# Evicted since the keys were listed
+			continue
+		try:
+			persister.add(scraper.parse_details(jobid, entry.json()))
+		except Exception as e:
+			MAINTENANCE_LOG.warn(f'Exception {type(e)} while parsing cached response for {jobid}: {e}')
+			failed += 1
+	persister.flush()
+
+	MAINTENANCE_LOG.info(f'Done rebuilding from cached responses, {persister.rows_added} jobs added, {failed} responses failed to parse.')
+	return persister.rows_added
@@ -0,0 +1,142 @@
+"""
+Runtime metrics, shared between the scraper and model processes and the web app.
+
+Components register a function returning their current metrics under a name.
+	A process running a MetricsWriter periodically saves a snapshot of every registered
+	component to its own JSON file in METRICS_DIRECTORY, which the app's /metrics endpoint serves.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from typing import Callable, Dict
+
+METRICS_LOG = logging.getLogger(__name__)
+
+METRICS_DIRECTORY = os.path.join(os.path.dirname(__file__), 'db', 'metrics')
+
+_sources = {}
+_sources_lock = threading.Lock()
+
+
+def register(name: str, metrics_func: Callable[[], dict]) -> None:
+	"""
+	Registers a component's metrics, replacing any registered under the same name.
+
+	Args:
+		name (str): Name the metrics are reported under.
+		metrics_func (Callable[[], dict]): Function returning the component's current, JSON-serializable metrics.
+	"""
+
+	with _sources_lock:
+		_sources[name] = metrics_func
+
+
+def unregister(name: str) -> None:
+	with _sources_lock:
+		_sources.pop(name, None)
+
+
+def snapshot() -> Dict[str, dict]:
+	"""
+	Gets the current metrics of every registered component.
+		A component whose metrics cannot be read is reported with the error instead.
+
+	Returns:
+		Dict[str, dict]: Dict of component name: metrics, plus the snapshot's unix `time`.
+	"""
+
+	with _sources_lock:
+		sources = list(_sources.items())
+	result = {'time': time.time()}
+	for name, metrics_func in sources:
+		try:
+			result[name] = metrics_func()
+		except Exception as e:
+			METRICS_LOG.warn(f'Exception {type(e)} while reading metrics {name}: {e}')
+			result[name] = {'error': str(e)}
+	return result
+
+
+def write_snapshot(path: str) -> None:
+	"""
+	Writes a snapshot to `path`, replacing it atomically so readers never see a partial file.
+	"""
+
+	os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+	temp_path = f'{path}.{os.getpid()}.tmp'
+	with open(temp_path, 'w') as f:
+		json.dump(snapshot(), f)
+	os.replace(temp_path, path)
+
+
+def read_snapshots(directory: str = METRICS_DIRECTORY) -> Dict[str, dict]:
+	"""
+	Reads every process's latest snapshot.
+
+	Returns:
+		Dict[str, dict]: Dict of snapshot file name, without extension: snapshot.
+	"""
+
+	snapshots = {}
+	if not os.path.isdir(directory):
+		return snapshots
+	for filename in sorted(os.listdir(directory)):
+		if not filename.endswith('.json'):
+			continue
+		try:
+			with open(os.path.join(directory, filename)) as f:
+				snapshots[filename[:-len('.json')]] = json.load(f)
+		except Exception as e:
+			METRICS_LOG.warn(f'Exception {type(e)} while reading metrics file {filename}: {e}')
+	return snapshots
+
+
+class MetricsWriter:
+	"""
+	Writes a snapshot every `interval` seconds on a background thread, and once more when stopped.
+		Usable as a context manager.
+	"""
+
+	def __init__(self, name: str, interval: float = 10, directory: str = METRICS_DIRECTORY):
+		"""
+		Args:
+			name (str): Name of the snapshot file, usually the process's script name.
+			interval (float, optional): Seconds between snapshots. Defaults to 10.
+			directory (str, optional): Directory to write to. Defaults to METRICS_DIRECTORY.
+		"""
+
+		self.path = os.path.join(directory, f'{name}.json')
+		self.interval = interval
+		self._stop = threading.Event()
+		self._thread = None
+
+	def start(self) -> None:
+		self._thread = threading.Thread(target=self._run, name='metrics-writer', daemon=True)
+		self._thread.start()
+
+	def stop(self) -> None:
+		self._stop.set()
+		if self._thread is not None:
+			self._thread.join()
+		self._write()
+
+	def _write(self) -> None:
+		try:
+			write_snapshot(self.path)
+		except Exception as e:
+			METRICS_LOG.warn(f'Exception {type(e)} while writing metrics to {self.path}: {e}')
+
+	def _run(self) -> None:
+		while not self._stop.wait(self.interval):
+			self._write()
+
+	def __enter__(self):
+		self.start()
+		return (self)
+
+	def __exit__(self, exc_type, exc_value, tb):
+		self.stop()
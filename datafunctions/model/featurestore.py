@@ -0,0 +1,278 @@
+"""
+Append-only store of job feature vectors, memory-mapped from segment files.
+"""
+
+import json
+import logging
+import os
+import threading
+import uuid
+
+import numpy as np
+
+from typing import Dict, List, Optional, Tuple
+
+FEATURESTORE_LOG = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+
+_MANIFEST_VERSION = 1
+
+
+class StoreSegment:
+	"""
+	Fixed-capacity block of job ids, vectors and their squared norms, filled in order and never rewritten.
+		Only rows below `count` hold committed records.
+	"""
+
+	def __init__(self, job_ids: np.ndarray, vectors: np.ndarray, squared_norms: np.ndarray, count: int = 0, name: Optional[str] = None):
+		self.job_ids = job_ids
+		self.vectors = vectors
+		self.squared_norms = squared_norms
+		self.count = count
+		self.name = name
+
+	@classmethod
+	def in_memory(cls, capacity: int, dim: int):
+		return cls(
+			np.empty(capacity, dtype='<i8'),
+			np.empty((capacity, dim), dtype='<f4'),
+			np.empty(capacity, dtype='<f4'),
+		)
+
+	@classmethod
+	def mapped(cls, directory: str, name: str, capacity: int, dim: int, count: int = 0, writable: bool = False, create: bool = False):
+		"""
+		Memory-maps a segment's files, creating them at full size first if `create` is set.
+			The files are sparse until written, and never change size, so a map of them stays valid as they fill.
+		"""
+
+		arrays = []
+		for suffix, dtype, shape in (('ids', '<i8', (capacity,)), ('vectors', '<f4', (capacity, dim)), ('norms', '<f4', (capacity,))):
+			path = os.path.join(directory, f'{name}.{suffix}')
+			if create:
+				with open(path, 'wb') as f:
+					f.truncate(int(np.prod(shape)) * np.dtype(dtype).itemsize)
+			arrays.append(np.memmap(path, dtype=dtype, mode='r+' if writable else 'r', shape=shape))
+		return cls(*arrays, count=count, name=name)
+
+	@property
+	def capacity(self) -> int:
+		return len(self.job_ids)
+
+	def write(self, start: int, job_ids: np.ndarray, vectors: np.ndarray) -> None:
+		"""
+		Writes records from row `start` on, without committing them: `count` is left to the caller.
+		"""
+
+		end = start + len(job_ids)
+		self.job_ids[start:end] = job_ids
+		self.vectors[start:end] = vectors
+		self.squared_norms[start:end] = np.einsum('ij,ij->i', vectors, vectors)
+
+	def flush(self) -> None:
+		for array in (self.job_ids, self.vectors, self.squared_norms):
+			if isinstance(array, np.memmap):
+				array.flush()
+
+
+class FeatureStore:
+	"""
+	Thread-safe, append-only store of (job id, vector) records.
+
+	Records are kept in segments of `segment_size` rows, each a set of fixed-size files in `directory`
+		that are memory-mapped rather than read, so opening the store takes the same time however many
+		records it holds, and every process reading it shares one copy of the vectors through the page cache.
+		`manifest.json` lists the segments and how many of their rows are committed. It is replaced atomically
+		after the rows it commits are synced to disk, so a reader always sees a consistent snapshot,
+		and rows written by an append that crashed before replacing it are ignored and later overwritten.
+		It also holds a random id given to the store when it is created, so a reader can tell a store
+		that was deleted and created again, whose generations start over, from the one it opened.
+
+	Only one process may append to a store at a time. Others open it with `writable=False`,
+		and call `refresh` to see records appended since.
+		Without a `directory`, records are kept in memory only.
+	"""
+
+	def __init__(self, directory: Optional[str] = None, dim: int = 17, segment_size: int = 65536, writable: bool = True):
+		"""
+		Args:
+			directory (str, optional): Directory the store is kept in. Created if missing and writable.
+				Defaults to keeping records in memory only.
+			dim (int, optional): Length of the vectors. Defaults to 17.
+			segment_size (int, optional): Records per segment of a new store. An existing store keeps its own. Defaults to 65536.
+			writable (bool, optional): Whether records will be appended. Defaults to True.
+
+		Raises:
+			FileNotFoundError: If the store is read-only and there is none in `directory`.
+			ValueError: If the store in `directory` holds vectors of a different dim.
+		"""
+
+		self.directory = directory
+		self.dim = dim
+		self.segment_size = segment_size
+		self.writable = writable
+		self.segments = []
+		self.generation = 0
+		self.store_id = None
+		self._lock = threading.Lock()
+		if self.directory is None:
+			return
+
+		manifest = self._read_manifest()
+		if manifest is None:
+			if not self.writable:
+				raise FileNotFoundError(f'No feature store in {self.directory}')
+			os.makedirs(self.directory, exist_ok=True)
+			self.store_id = uuid.uuid4().hex
+			self._write_manifest([])
+			return
+		self.segment_size = manifest['segment_size']
+		self._load(manifest)
+		if self.store_id is None and self.writable:
+			# A store created before manifests held an id is given one
+			self.store_id = uuid.uuid4().hex
+			self._write_manifest([segment.count for segment in self.segments])
+
+	@property
+	def manifest_path(self) -> str:
+		return os.path.join(self.directory, MANIFEST_NAME)
+
+	def __len__(self) -> int:
+		with self._lock:
+			return sum(segment.count for segment in self.segments)
+
+	def append(self, job_ids: np.ndarray, vectors: np.ndarray) -> None:
+		"""
+		Appends records, committing them all at once.
+
+		Args:
+			job_ids (np.ndarray): Job id of each vector.
+			vectors (np.ndarray): (len(job_ids), dim) array of vectors.
+
+		Raises:
+			ValueError: If the store is read-only.
+		"""
+
+		if not self.writable:
+			raise ValueError(f'Feature store in {self.directory} is read-only.')
+		if not len(job_ids):
+			return
+		with self._lock:
+			counts = [segment.count for segment in self.segments]
+			start = 0
+			while start < len(job_ids):
+				if not self.segments or counts[-1] == self.segments[-1].capacity:
+					self.segments.append(self._new_segment())
+					counts.append(0)
+				segment = self.segments[-1]
+				end = start + min(len(job_ids) - start, segment.capacity - counts[-1])
+				segment.write(counts[-1], job_ids[start:end], vectors[start:end])
+				counts[-1] += end - start
+				start = end
+			if self.directory is not None:
+				for segment, count in zip(self.segments, counts):
+					if segment.count != count:
+						segment.flush()
+				self._write_manifest(counts)
+			# Readers in this process see the new rows only once they are committed
+			for segment, count in zip(self.segments, counts):
+				segment.count = count
+
+	def snapshot(self) -> List[Tuple[StoreSegment, int]]:
+		"""
+		Segments holding committed records, with how many they hold.
+			Rows below those counts are never written again, so they can be read without any lock.
+		"""
+
+		with self._lock:
+			return [(segment, segment.count) for segment in self.segments if segment.count]
+
+	def job_ids(self) -> np.ndarray:
+		return np.concatenate([segment.job_ids[:count] for segment, count in self.snapshot()] or [np.empty(0, dtype=np.int64)])
+
+	def refresh(self) -> int:
+		"""
+		Loads the records committed since the store was opened or last refreshed, for example by another process.
+			If the store has been deleted and created again since, every segment is mapped afresh.
+
+		Raises:
+			ValueError: If a store created again holds vectors of a different dim.
+
+		Returns:
+			int: Number of records loaded. All of them, if the store was created again.
+		"""
+
+		if self.directory is None:
+			return 0
+		manifest = self._read_manifest()
+		with self._lock:
+			if manifest is None:
+				return 0
+			replaced = manifest.get('store_id') != self.store_id
+			if not replaced and manifest['generation'] == self.generation:
+				return 0
+			before = 0 if replaced else sum(segment.count for segment in self.segments)
+			self._load(manifest)
+			loaded = sum(segment.count for segment in self.segments) - before
+		if replaced:
+			FEATURESTORE_LOG.info(f'Feature store in {self.directory} was created again, loaded its {loaded} records.')
+		elif loaded:
+			FEATURESTORE_LOG.info(f'Loaded {loaded} records from {self.directory}.')
+		return loaded
+
+	def _load(self, manifest: dict) -> None:
+		if manifest['dim'] != self.dim:
+			raise ValueError(f'{self.directory} holds vectors of dim={manifest["dim"]}, not dim={self.dim}')
+		if manifest.get('store_id') != self.store_id:
+			# Another store's segments, even where their names match, so none of the current maps hold its records
+			self.segments = []
+			self.segment_size = manifest['segment_size']
+			self.store_id = manifest.get('store_id')
+		for position, entry in enumerate(manifest['segments']):
+			if position == len(self.segments):
+				self.segments.append(StoreSegment.mapped(self.directory, entry['name'], self.segment_size, self.dim, writable=self.writable))
+			self.segments[position].count = entry['count']
+		self.generation = manifest['generation']
+
+	def _new_segment(self) -> StoreSegment:
+		if self.directory is None:
+			return StoreSegment.in_memory(self.segment_size, self.dim)
+		# A segment left by an append that was never committed is overwritten
+		return StoreSegment.mapped(self.directory, f'{len(self.segments):06d}', self.segment_size, self.dim, writable=True, create=True)
+
+	def _read_manifest(self) -> Optional[dict]:
+		try:
+			with open(self.manifest_path) as f:
+				manifest = json.load(f)
+		except FileNotFoundError:
+			return None
+		if manifest.get('version') != _MANIFEST_VERSION:
+			raise ValueError(f'{self.manifest_path} has unknown version {manifest.get("version")}')
+		return manifest
+
+	def _write_manifest(self, counts: List[int]) -> None:
+		manifest = {
+			'version': _MANIFEST_VERSION,
+			'dim': self.dim,
+			'segment_size': self.segment_size,
+			'store_id': self.store_id,
+			'generation': self.generation + 1,
+			'segments': [{'name': segment.name, 'count': count} for segment, count in zip(self.segments, counts)],
+		}
+		temp_path = f'{self.manifest_path}.{os.getpid()}.tmp'
+		with open(temp_path, 'w') as f:
+			json.dump(manifest, f)
+			f.flush()
+			os.fsync(f.fileno())
+		os.replace(temp_path, self.manifest_path)
+		self.generation = manifest['generation']
+
+	def stats(self) -> Dict[str, float]:
+		with self._lock:
+			return {
+				'records': sum(segment.count for segment in self.segments),
+				'segments': len(self.segments),
+				'segment_size': self.segment_size,
+				'generation': self.generation,
+			}
@@ -1,43 +1,218 @@
 import logging
+import os
+import shutil
+import threading
 import gensim
-import pickle
 import numpy
 
+from concurrent.futures import ProcessPoolExecutor
+from decouple import config
+from gensim.matutils import dirichlet_expectation
 from os.path import dirname, join
-from typing import Dict, List
-from sklearn.neighbors import KNeighborsClassifier
+from typing import Dict, List, Optional, Sequence, Tuple
 
+from datafunctions.model.featurestore import MANIFEST_NAME
 from datafunctions.model.modelfunctions import TopicModel
+from datafunctions.model.neighbors import DEFAULT_INDEX_DIRECTORY, NeighborIndex
 
 LDA_LOG = logging.getLogger(__name__)
 
+# gensim's get_document_topics drops topics less likely than this, even when asked for all of them
+MINIMUM_PROBABILITY = 1e-8
+
+
+def infer_topic_distributions(lda_model, bows: Sequence[List[Tuple[int, int]]], chunk_size: int = 64) -> numpy.ndarray:
+	'''
+	Infers the topic distributions of many bags of words at once.
+
+	Runs the same variational E-step as gensim's LdaModel.inference,
+		but updates every document of a chunk together with stacked matrix products instead of one at a time.
+		Documents stop being updated as they converge, as in gensim.
+
+	Args:
+		lda_model (gensim.models.LdaModel): Trained model.
+		bows (Sequence[List[Tuple[int, int]]]): Bags of words from the model's dictionary.
+		chunk_size (int, optional): Documents inferred together, bounding memory use. Defaults to 64.
+
+	Returns:
+		numpy.ndarray: (len(bows), num_topics) float32 matrix, row i the distribution of bows[i] and column k topic k.
+	'''
+
+	distributions = numpy.zeros((len(bows), lda_model.num_topics), dtype=numpy.float32)
+	# Documents of similar length are inferred together, so they need little padding
+	order = numpy.argsort([len(bow) for bow in bows], kind='stable')
+	for start in range(0, len(bows), chunk_size):
+		indices = order[start:start + chunk_size]
+		gamma = _infer_gamma(lda_model, [bows[index] for index in indices])
+		distributions[indices] = gamma / gamma.sum(axis=1, keepdims=True)
+	distributions[distributions < MINIMUM_PROBABILITY] = 0
+	return distributions
+
+
+def _infer_gamma(lda_model, bows: List[List[Tuple[int, int]]]) -> numpy.ndarray:
+	dtype = lda_model.dtype
+	epsilon = numpy.finfo(dtype).eps
+	alpha = lda_model.alpha.astype(dtype, copy=False)
+
+	# Each document's word ids and counts, padded to the longest document with count 0, which contributes nothing
+	length = max(len(bow) for bow in bows)
+	word_ids = numpy.zeros((len(bows), length), dtype=numpy.int64)
+	counts = numpy.zeros((len(bows), length), dtype=dtype)
+	for document, bow in enumerate(bows):
+		if bow:
+			word_ids[document, :len(bow)], counts[document, :len(bow)] = zip(*bow)
+	# (documents, topics, words)
+	beta = numpy.ascontiguousarray(lda_model.expElogbeta[:, word_ids].transpose(1, 0, 2), dtype=dtype)
+
+	gamma = lda_model.random_state.gamma(100., 1. / 100., (len(bows), lda_model.num_topics)).astype(dtype, copy=False)
+	active = numpy.arange(len(bows))  # Documents not converged yet
+	active_gamma = gamma
+	for _ in range(lda_model.iterations):
+		exp_elog_theta = numpy.exp(dirichlet_expectation(active_gamma))
+		phinorm = numpy.matmul(exp_elog_theta[:, None, :], beta)[:, 0, :] + epsilon
+		new_gamma = alpha + exp_elog_theta * numpy.matmul(beta, (counts / phinorm)[:, :, None])[:, :, 0]
+		converging = numpy.mean(numpy.abs(new_gamma - active_gamma), axis=1) >= lda_model.gamma_threshold
+		gamma[active] = new_gamma
+		if not converging.any():
+			break
+		if not converging.all():
+			active = active[converging]
+			beta = beta[converging]
+			counts = counts[converging]
+			new_gamma = new_gamma[converging]
+		active_gamma = new_gamma
+	return gamma
+
+
+def load_lda17(files_directory: str):
+	'''
+	Loads an lda17 model and its dictionary.
+		The model's arrays are memory-mapped read-only, so every process that loads them shares one copy.
+
+	Returns:
+		Tuple[gensim.models.LdaModel, gensim.corpora.Dictionary]: The model and dictionary.
+	'''
+
+	model = gensim.models.LdaModel.load(join(files_directory, 'model'), mmap='r')
+	id2word = gensim.corpora.Dictionary.load(join(files_directory, 'id2word'))
+	return model, id2word
+
+
+def score_descriptions(lda_model, id2word, descriptions: Sequence[str]) -> numpy.ndarray:
+	'''
+	Tokenizes and scores job descriptions.
+
+	Returns:
+		numpy.ndarray: (len(descriptions), 17) float32 matrix of topic scores, with column n stored as lda<n>.
+	'''
+
+	bows = [id2word.doc2bow(words) for words in LDA17Model.sentence_to_words(descriptions)]
+	# Scores have always been stored with topic n in lda<n-1>, and topic 0 in lda16
+	return numpy.roll(infer_topic_distributions(lda_model, bows), -1, axis=1)
+
+
+_worker_models = {}  # Files directory: model and dictionary loaded by a scoring process
+
+
+def _score_in_worker(files_directory: str, descriptions: List[str]) -> numpy.ndarray:
+	loaded = _worker_models.get(files_directory)
+	if loaded is None:
+		loaded = _worker_models[files_directory] = load_lda17(files_directory)
+	return score_descriptions(loaded[0], loaded[1], descriptions)
+
+
+class LDA17Scorer:
+	'''
+	Scores job descriptions with the lda17 model, in this process or fanned out to a pool of processes.
+
+	Each worker process loads the model memory-mapped on its first batch, so the workers and this process
+		share the model's pages instead of each holding a private copy.
+	'''
+
+	def __init__(self, files_directory: str, processes: int = 1, slices_per_process: int = 4):
+		'''
+		Args:
+			files_directory (str): Directory of the model files.
+			processes (int, optional): Scoring processes. 1 scores in this process. Defaults to 1.
+			slices_per_process (int, optional): Slices a batch is split into per process,
+				so a process that finishes early picks up more. Defaults to 4.
+		'''
+
+		self.files_directory = files_directory
+		self.processes = max(1, processes)
+		self.slices_per_process = slices_per_process
+		self.model, self.id2word = load_lda17(files_directory)
+		self._pool = None
+		self._pool_lock = threading.Lock()
+
+	@property
+	def pool(self) -> ProcessPoolExecutor:
+		with self._pool_lock:
+			if self._pool is None:
+				LDA_LOG.info(f'Starting scoring pool with {self.processes} processes...')
+				self._pool = ProcessPoolExecutor(max_workers=self.processes)
+			return self._pool
+
+	def score(self, descriptions: Sequence[str]) -> numpy.ndarray:
+		'''
+		Scores descriptions, splitting them into contiguous slices across the pool if there is one.
+
+		Returns:
+			numpy.ndarray: (len(descriptions), 17) float32 matrix of topic scores, in the order of `descriptions`.
+		'''
+
+		if self.processes == 1 or len(descriptions) < 2:
+			return score_descriptions(self.model, self.id2word, descriptions)
+		slice_size = -(-len(descriptions) // (self.processes * self.slices_per_process))
+		slices = [list(descriptions[start:start + slice_size]) for start in range(0, len(descriptions), slice_size)]
+		# map returns the slices' scores in order, so they stack back in the order of `descriptions`
+		return numpy.concatenate(list(self.pool.map(_score_in_worker, [self.files_directory] * len(slices), slices)))
+
+	def close(self) -> None:
+		'''
+		Shuts down the process pool, if one was started.
+		'''
+
+		with self._pool_lock:
+			if self._pool is not None:
+				self._pool.shutdown(wait=True)
+				self._pool = None
+
 
 class LDA17Model(TopicModel):
 	FILES_DIRECTORY = 'lda17_files'
+	NN_INDEX_DIRECTORY = join(DEFAULT_INDEX_DIRECTORY, 'lda17')
+
+	def __init__(self, db_conn, processes: Optional[int] = None):
+		'''
+		Args:
+			db_conn: Connection to the database.
+			processes (int, optional): Processes descriptions are scored in, 0 for one per core.
+				Defaults to the LDA17_PROCESSES setting, or 1, scoring in this process.
+		'''
 
-	def __init__(self, db_conn):
 		LDA_LOG.info('Loading lda17 model...')
-		self.model = gensim.models.LdaModel.load(
-			join(dirname(__file__), self.FILES_DIRECTORY, 'model')
-		)
-		self.id2word = gensim.corpora.Dictionary.load(
-			join(dirname(__file__), self.FILES_DIRECTORY, 'id2word')
+		if processes is None:
+			processes = config('LDA17_PROCESSES', default=1, cast=int)
+		self.scorer = LDA17Scorer(
+			join(dirname(__file__), self.FILES_DIRECTORY),
+			processes=processes if processes > 0 else (os.cpu_count() or 1),
 		)
+		self.model = self.scorer.model
+		self.id2word = self.scorer.id2word
 		self.nearest_neighbors = self.open_or_create_nn(db_conn)
 		LDA_LOG.info('Done loading model.')
 
 	def open_or_create_nn(self, db_conn):
-		try:
-			LDA_LOG.info('Trying to open NearestNeighbors from file...')
-			with open(
-					join(dirname(__file__), self.FILES_DIRECTORY, 'nearest_neighbors'),
-					'rb',
-			) as f:
-				return pickle.load(f)
-		except Exception as e:
-			LDA_LOG.info(f'Unable to open NearestNeighbors from file: {e}')
-			LDA_LOG.info('Attempting to recreate NearestNeighbors...')
-			return self.create_nn(db_conn)
+		if os.path.exists(join(self.NN_INDEX_DIRECTORY, MANIFEST_NAME)):
+			try:
+				LDA_LOG.info('Trying to open NearestNeighbors index from file...')
+				return NeighborIndex(self.NN_INDEX_DIRECTORY)
+			except Exception as e:
+				LDA_LOG.info(f'Unable to open NearestNeighbors index from file: {e}')
+				shutil.rmtree(self.NN_INDEX_DIRECTORY, ignore_errors=True)
+		LDA_LOG.info('Attempting to recreate NearestNeighbors...')
+		return self.create_nn(db_conn)
 
 	def create_nn(self, db_conn):
 		LDA_LOG.info('Creating NearestNeighbors...')
@@ -53,41 +228,25 @@ class LDA17Model(TopicModel):
 		db_conn.commit()
 		LDA_LOG.info('lda17_topics.in_nn flag reset to FALSE.')
 
-		nearest_neighbors = KNeighborsClassifier(n_neighbors=20)
-		LDA_LOG.info('Created empty KNeighborsClassifier.')
+		nearest_neighbors = NeighborIndex(self.NN_INDEX_DIRECTORY)
+		LDA_LOG.info('Created empty NearestNeighbors index.')
 
 		return nearest_neighbors
 
 	def train_nn(self, new_X, new_y):
-		if hasattr(self.nearest_neighbors, '_fit_X'):
-			old_X = self.nearest_neighbors._fit_X
-			old_y = self.nearest_neighbors._y
-			combined_X = numpy.vstack([old_X, new_X])
-			combined_y = numpy.hstack([old_y, new_y])
-			LDA_LOG.info(f'''
-				old_X.shape: {old_X.shape}
-				old_y.shape: {old_y.shape}
-				new_X.shape: {new_X.shape}
-				new_y.shape: {new_y.shape}
-				combined_X.shape: {combined_X.shape}
-				combined_y.shape: {combined_y.shape}
-			''')
-		else:
-			combined_X = new_X
-			combined_y = new_y
-		self.nearest_neighbors.fit(combined_X, combined_y)
-
-	def save_nn(self):
-		LDA_LOG.info('Saving NearestNeighbors...')
-		with open(
-				join(dirname(__file__), self.FILES_DIRECTORY, 'nearest_neighbors'),
-				'wb',
-		) as f:
-			return pickle.dump(self.nearest_neighbors, f)
-		LDA_LOG.info('NearestNeighbors saved.')
-
-	def save_and_flag_nn(self, db_conn, updated_job_ids):
-		LDA_LOG.info('Saving and flagging NearestNeighbors...')
+		# Appended to the index's store as they are added, leaving the vectors already indexed untouched
+		added = self.nearest_neighbors.add_many(new_y, new_X)
+		LDA_LOG.info(f'Added {added} jobs to NearestNeighbors, {len(self.nearest_neighbors)} indexed.')
+
+	def save_and_flag_nn(self, db_conn, updated_job_ids) -> bool:
+		'''
+		Flags jobs as added to NearestNeighbors.
+
+		Returns:
+			bool: Whether the flags were saved.
+		'''
+
+		LDA_LOG.info('Flagging jobs added to NearestNeighbors...')
 		flag_query = '''
 			UPDATE lda17_topics
 			SET in_nn = TRUE
@@ -99,8 +258,6 @@ class LDA17Model(TopicModel):
 		}
 
 		try:
-			LDA_LOG.info('Setting isolation level to READ COMMITTED')
-			db_conn.set_isolation_level(1)
 			LDA_LOG.info('Starting transactions...')
 			curr = db_conn.cursor()
 
@@ -112,27 +269,31 @@ class LDA17Model(TopicModel):
 
 			curr.close()
 
-			self.save_nn()
-
 			LDA_LOG.info('Committing changes...')
 			db_conn.commit()
 			LDA_LOG.info('Added result to database.')
+			return True
 
 		except Exception as e:
-			LDA_LOG.warn(f'Exception {type(e)} while saving lda17 scores: {e}')
+			LDA_LOG.warn(f'Exception {type(e)} while flagging NearestNeighbors jobs: {e}')
 			LDA_LOG.warn(e, exc_info=True)
 			curr.close()
+			db_conn.rollback()
+			return False
 
-	def populate_database(self, db_conn, per_iter_limit=500):
+	def populate_database(self, db_conn, per_iter_limit=None):
 		LDA_LOG.info('Populating database with lda17 scores...')
+		if per_iter_limit is None:
+			# Enough descriptions per batch to keep every scoring process busy
+			per_iter_limit = 500 * self.scorer.processes
 		while True:
 			job_descriptions = self.get_missing_descriptions(db_conn, limit=per_iter_limit)
 			LDA_LOG.info(f'Got {len(job_descriptions)} descriptions without lda17 scores...')
 			if len(job_descriptions) == 0:
 				break
 
-			job_scores = self.get_topic_scores(job_descriptions)
-			self.save_scores(db_conn, job_scores)
+			job_ids, scores = self.get_topic_scores(job_descriptions)
+			self.save_scores(db_conn, job_ids, scores)
 		LDA_LOG.info('Done populating database with lda17 scores.')
 
 		self.update_nn(db_conn)
@@ -147,11 +308,9 @@ class LDA17Model(TopicModel):
 			job_ids, topics = zip(*missing.items())
 			self.train_nn(numpy.array(topics), numpy.array(job_ids))
 
-			try:
-				self.save_and_flag_nn(db_conn, job_ids)
-			except Exception as e:
-				LDA_LOG.warn(f'Exception {type(e)} while saving and flagging NearestNeighbors: {e}')
-				LDA_LOG.warn(e, exc_info=True)
+			# Stop if flagging failed, or the same jobs would come back as missing forever
+			if not self.save_and_flag_nn(db_conn, job_ids):
+				break
 
 		LDA_LOG.info('Done updating NearestNeighbors.')
 
@@ -243,7 +402,11 @@ class LDA17Model(TopicModel):
 
 		return results
 
-	def save_scores(self, db_conn, job_scores: dict):
+	def save_scores(self, db_conn, job_ids: numpy.ndarray, scores: numpy.ndarray):
+		'''
+		Saves topic scores, as returned by `get_topic_scores`.
+		'''
+
 		LDA_LOG.info('Saving lda17 scores...')
 
 		save_scores_query = '''
@@ -251,15 +414,14 @@ class LDA17Model(TopicModel):
 			VALUES (%(job_id)s, %(lda0)s, %(lda1)s, %(lda2)s, %(lda3)s, %(lda4)s, %(lda5)s, %(lda6)s, %(lda7)s, %(lda8)s, %(lda9)s, %(lda10)s, %(lda11)s, %(lda12)s, %(lda13)s, %(lda14)s, %(lda15)s, %(lda16)s);
 		'''
 
+		# psycopg2 doesn't understand numpy types, so they become Python ints and floats here
 		params_list = []
-		for job_id, topic_scores in job_scores.items():
+		for job_id, topic_scores in zip(job_ids.tolist(), scores.tolist()):
 			params = {f'lda{n}': score for n, score in enumerate(topic_scores)}
 			params['job_id'] = job_id
 			params_list.append(params)
 
 		try:
-			LDA_LOG.info('Setting isolation level to READ COMMITTED')
-			db_conn.set_isolation_level(1)
 			LDA_LOG.info('Starting transactions...')
 			curr = db_conn.cursor()
 
@@ -278,44 +440,27 @@ class LDA17Model(TopicModel):
 			LDA_LOG.warn(f'Exception {type(e)} while saving lda17 scores: {e}')
 			LDA_LOG.warn(e, exc_info=True)
 			curr.close()
+			# Leave the connection usable for the next batch, rather than in an aborted transaction
+			db_conn.rollback()
 
-	def get_topic_scores(self, job_descriptions: Dict[int, str]) -> Dict[int, List[float]]:
+	def get_topic_scores(self, job_descriptions: Dict[int, str]) -> Tuple[numpy.ndarray, numpy.ndarray]:
 		'''
-		Gets the topic scores for one or more job descriptions
+		Gets the topic scores for one or more job descriptions, inferred in batches.
 
 		Args:
 			job_descriptions (dict): A dict of job_id: job_description
 
 		Returns:
-			dict: A dict of job_id: topic_scores (List[float])
+			Tuple[numpy.ndarray, numpy.ndarray]: The job ids in ascending order, and a (len(job_ids), 17) float32 matrix
+				of their topic scores, with column n stored as lda<n>.
 		'''
 
 		LDA_LOG.info(f'Getting lda17 topic scores for {len(job_descriptions)} descriptions...')
-		job_ids, descriptions = zip(*job_descriptions.items())
-		processed_descriptions = self.sentence_to_words(descriptions)
-		bows = [self.id2word.doc2bow(description) for description in processed_descriptions]
-		scores_list = []
-		for bow in bows:  # for Bag of Words in Bags of Wordses
-			topic_scores = [0 for _ in range(17)]
-			topics = self.model.get_document_topics(
-				bow,
-				minimum_probability=0,
-				minimum_phi_value=0
-			)
-			for topic_tuple in topics:
-				# Note that topic numbers are 1-indexed by gensim
-				# Hence why we assign to topic_tuple[0]-1
-				topic_scores[topic_tuple[0] - 1] = float(topic_tuple[1])
-				# We have to convert our numpy.float32 to Python floats
-				# Since psycopg2 doesn't understand numpy.
-			scores_list.append(topic_scores)
-
-		results = {}
-		for index, job_id in enumerate(job_ids):
-			results[job_id] = scores_list[index]
+		job_ids = numpy.array(sorted(job_descriptions), dtype=numpy.int64)
+		scores = self.scorer.score([job_descriptions[job_id] for job_id in job_ids.tolist()])
 
 		LDA_LOG.info('Got lda17 topic scores.')
-		return results
+		return job_ids, scores
 
 	@staticmethod
 	def sentence_to_words(sentences):
@@ -328,5 +473,6 @@ class LDA17Model(TopicModel):
 	def __exit__(self, exc_type, exc_value, tb):
 		LDA_LOG.info(f'__exit__ called, cleaning up...')
 		LDA_LOG.info(f'exc_type: {exc_type}')
+		self.scorer.close()
 		del self.model
 		del self.id2word
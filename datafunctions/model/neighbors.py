@@ -0,0 +1,239 @@
+"""
+Append-only exact nearest-neighbour index of topic vectors.
+"""
+
+import logging
+import os
+import threading
+
+import numpy as np
+
+from typing import Dict, Iterable, Optional, Tuple
+
+from datafunctions.model.featurestore import FeatureStore
+
+NEIGHBORS_LOG = logging.getLogger(__name__)
+
+DEFAULT_INDEX_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'db', 'neighbors')
+
+# Distances computed at once by a query, bounding its memory use
+_TILE_ENTRIES = 2 ** 20
+
+
+class NeighborIndex:
+	"""
+	Thread-safe, append-only index answering exact k-nearest-neighbour queries by Euclidean distance.
+
+	Vectors are kept in a FeatureStore, in segments that adding vectors only fills,
+		so existing vectors are never copied or refitted.
+		A query computes its distances to the segments with matrix products, for many query vectors at once,
+		keeping only the vectors nearer than the k nearest found so far.
+
+	If `directory` is given, the store is kept there and memory-mapped, so opening the index does not read it,
+		and processes opening it read-only share one copy of the vectors. `refresh` loads vectors added since,
+		for example by another process.
+	"""
+
+	def __init__(self, directory: Optional[str] = None, dim: int = 17, segment_size: int = 65536, query_block: int = 256, writable: bool = True):
+		"""
+		Args:
+			directory (str, optional): Directory the vectors are stored in. Defaults to keeping them in memory only.
+			dim (int, optional): Length of the vectors. Defaults to 17.
+			segment_size (int, optional): Vectors per segment of a new store. Defaults to 65536.
+			query_block (int, optional): Query vectors searched for at once. Defaults to 256.
+			writable (bool, optional): Whether vectors will be added. Defaults to True.
+
+		Raises:
+			FileNotFoundError: If the index is read-only and there is none in `directory`.
+			ValueError: If the store in `directory` holds vectors of a different dim.
+		"""
+
+		self.store = FeatureStore(directory, dim=dim, segment_size=segment_size, writable=writable)
+		self.directory = directory
+		self.dim = dim
+		self.query_block = query_block
+		# Built from the store when first needed, as reading every job id would make opening the index slow
+		self._positions = None
+		# Job ids added since the sorted ids in _positions were built
+		self._added = set()
+		self._lock = threading.Lock()
+
+	def __len__(self) -> int:
+		return len(self.store)
+
+	def __contains__(self, job_id: int) -> bool:
+		with self._lock:
+			return bool(self._known(np.array([job_id], dtype=np.int64))[0])
+
+	def _known(self, job_ids: np.ndarray) -> np.ndarray:
+		# Whether each job is indexed, from the sorted ids without rebuilding them for every add,
+		# unless more ids have been added since they were built than they hold
+		if self._positions is None or len(self._added) > len(self._positions[1]):
+			self._build_positions(self.store.snapshot())
+		sorted_ids = self._positions[1]
+		known = np.zeros(len(job_ids), dtype=bool)
+		if len(sorted_ids):
+			known = sorted_ids[np.minimum(np.searchsorted(sorted_ids, job_ids), len(sorted_ids) - 1)] == job_ids
+		if self._added:
+			known |= np.array([job_id in self._added for job_id in job_ids.tolist()], dtype=bool)
+		return known
+
+	def add_many(self, job_ids: Iterable[int], vectors) -> int:
+		"""
+		Indexes and stores vectors, committing them to the store at once.
+			Jobs already indexed, and repeats within the call, are skipped.
+
+		Args:
+			job_ids (Iterable[int]): Job id of each vector.
+			vectors: (len(job_ids), dim) array of vectors.
+
+		Raises:
+			ValueError: If the vectors are not dim long, there is not one per job id, or the index is read-only.
+
+		Returns:
+			int: Number of vectors added.
+		"""
+
+		job_ids = np.asarray(list(job_ids), dtype=np.int64)
+		vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim) if len(job_ids) else np.empty((0, self.dim), dtype=np.float32)
+		if len(vectors) != len(job_ids):
+			raise ValueError(f'Got {len(job_ids)} job ids for {len(vectors)} vectors.')
+		with self._lock:
+			# First occurrence of each job id, in the order given
+			first = np.sort(np.unique(job_ids, return_index=True)[1])
+			keep = first[~self._known(job_ids[first])]
+			if len(keep) != len(job_ids):
+				job_ids = job_ids[keep]
+				vectors = vectors[keep]
+			self.store.append(job_ids, vectors)
+			self._added.update(job_ids.tolist())
+		return len(job_ids)
+
+	def vectors(self, job_ids: Iterable[int]) -> Tuple[np.ndarray, np.ndarray]:
+		"""
+		Gets the indexed vectors of jobs.
+
+		Args:
+			job_ids (Iterable[int]): Jobs to get the vectors of.
+
+		Returns:
+			Tuple[np.ndarray, np.ndarray]: (len(job_ids), dim) float32 vectors, and whether each job is indexed.
+				The vectors of jobs that are not indexed are 0.
+		"""
+
+		job_ids = np.asarray(list(job_ids), dtype=np.int64)
+		segments, sorted_ids, segment_numbers, rows = self._position_lookup()
+		vectors = np.zeros((len(job_ids), self.dim), dtype=np.float32)
+		if not len(sorted_ids):
+			return vectors, np.zeros(len(job_ids), dtype=bool)
+		positions = np.minimum(np.searchsorted(sorted_ids, job_ids), len(sorted_ids) - 1)
+		found = sorted_ids[positions] == job_ids
+		for segment_number in np.unique(segment_numbers[positions[found]]).tolist():
+			matches = found & (segment_numbers[positions] == segment_number)
+			vectors[matches] = segments[segment_number].vectors[rows[positions[matches]]]
+		return vectors, found
+
+	def _position_lookup(self):
+		# Sorted job ids with the segment and row of each, rebuilt when vectors have been added since
+		with self._lock:
+			snapshot = self.store.snapshot()
+			if self._positions is None or self._positions[0] != snapshot:
+				self._build_positions(snapshot)
+			snapshot, sorted_ids, segment_numbers, rows = self._positions
+		return [segment for segment, _ in snapshot], sorted_ids, segment_numbers, rows
+
+	def _build_positions(self, snapshot) -> None:
+		job_ids = np.concatenate([segment.job_ids[:count] for segment, count in snapshot] or [np.empty(0, dtype=np.int64)])
+		order = np.argsort(job_ids, kind='stable')
+		segment_numbers = np.repeat(np.arange(len(snapshot)), [count for _, count in snapshot])
+		rows = np.concatenate([np.arange(count) for _, count in snapshot] or [np.empty(0, dtype=np.int64)])
+		self._positions = (snapshot, job_ids[order], segment_numbers[order], rows[order])
+		self._added = set()
+
+	def query(self, vectors, k: int = 20) -> Tuple[np.ndarray, np.ndarray]:
+		"""
+		Finds the k indexed vectors nearest each query vector.
+
+		Args:
+			vectors: (n, dim) array of query vectors, or a single vector.
+			k (int, optional): Neighbours per query vector. Defaults to 20.
+
+		Returns:
+			Tuple[np.ndarray, np.ndarray]: (n, k) int64 job ids and float32 distances, nearest first.
+				If fewer than k vectors are indexed, rows are padded with job id -1 at infinite distance.
+		"""
+
+		queries = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+		segments = self.store.snapshot()
+		job_ids = np.full((len(queries), k), -1, dtype=np.int64)
+		distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+		if not segments or k <= 0:
+			return job_ids, distances
+		for start in range(0, len(queries), self.query_block):
+			block = slice(start, start + self.query_block)
+			job_ids[block], distances[block] = self._query_block(queries[block], segments, k)
+		return job_ids, distances
+
+	def _query_block(self, queries: np.ndarray, segments, k: int) -> Tuple[np.ndarray, np.ndarray]:
+		# Distances are compared as |x|^2 - 2 q.x, which orders them like |q - x|^2 without computing |q|^2 for each pair
+		best_ids = np.full((len(queries), k), -1, dtype=np.int64)
+		best = np.full((len(queries), k), np.inf, dtype=np.float32)
+		worst_best = best[:, -1]
+		# Tiles of about a million distances stay in cache, which matters more here than the matrix product itself
+		tile_rows = max(1024, _TILE_ENTRIES // len(queries))
+		for segment, count in segments:
+			for start in range(0, count, tile_rows):
+				end = min(count, start + tile_rows)
+				scores = queries @ segment.vectors[start:end].T
+				scores *= -2
+				scores += segment.squared_norms[start:end]
+				if np.isinf(worst_best).any():
+					candidates = scores
+					candidate_ids = np.broadcast_to(segment.job_ids[start:end], scores.shape)
+				else:
+					# Only vectors nearer than a query's current k-th nearest can change its result
+					rows, columns = np.nonzero(scores < worst_best[:, None])
+					if not len(rows):
+						continue
+					per_row = np.bincount(rows, minlength=len(queries))
+					slots = np.arange(len(rows)) - (np.cumsum(per_row) - per_row)[rows]
+					candidates = np.full((len(queries), per_row.max()), np.inf, dtype=np.float32)
+					candidates[rows, slots] = scores[rows, columns]
+					candidate_ids = np.full(candidates.shape, -1, dtype=np.int64)
+					candidate_ids[rows, slots] = segment.job_ids[start + columns]
+				merged = np.concatenate([best, candidates], axis=1)
+				merged_ids = np.concatenate([best_ids, candidate_ids], axis=1)
+				positions = np.argpartition(merged, k - 1, axis=1)[:, :k]
+				best = np.take_along_axis(merged, positions, axis=1)
+				best_ids = np.take_along_axis(merged_ids, positions, axis=1)
+				worst_best = best.max(axis=1)
+		order = np.argsort(best, axis=1, kind='stable')
+		best_ids = np.take_along_axis(best_ids, order, axis=1)
+		# Rounding can take a squared distance a little below 0
+		squared = np.take_along_axis(best, order, axis=1) + np.einsum('ij,ij->i', queries, queries)[:, None]
+		return best_ids, np.sqrt(np.maximum(squared, 0))
+
+	def refresh(self) -> int:
+		"""
+		Loads vectors added to the store since it was opened or last refreshed,
+			or all of them if the store was created again.
+
+		Returns:
+			int: Number of vectors loaded.
+		"""
+
+		store_id = self.store.store_id
+		loaded = self.store.refresh()
+		if loaded or self.store.store_id != store_id:
+			with self._lock:
+				self._positions = None
+				self._added = set()
+		return loaded
+
+	def stats(self) -> Dict[str, float]:
+		stats = self.store.stats()
+		return {
+			'indexed': stats['records'],
+			'segments': stats['segments'],
+			'segment_size': stats['segment_size'],
+		}
@@ -0,0 +1,282 @@
+"""
+Similar-jobs lookups, answered from a resident lda17 model and nearest-neighbour index.
+"""
+
+import collections
+import logging
+import queue
+import threading
+import time
+
+import numpy as np
+
+from decouple import config
+from os.path import dirname, join
+from typing import List, Optional, Tuple
+
+from datafunctions import metrics
+from datafunctions.model.models.lda17 import LDA17Model, load_lda17, score_descriptions
+from datafunctions.model.neighbors import NeighborIndex
+
+SIMILAR_LOG = logging.getLogger(__name__)
+
+LDA17_FILES_DIRECTORY = join(dirname(__file__), 'models', LDA17Model.FILES_DIRECTORY)
+
+MAX_K = 100
+
+
+class IndexUnavailableError(Exception):
+	"""
+	Raised when the nearest-neighbour index has not been built yet.
+	"""
+
+
+class SimilarRequest:
+	"""
+	One lookup, waiting to be answered as part of a batch.
+	"""
+
+	def __init__(self, job_id: Optional[int], description: Optional[str], k: int):
+		self.job_id = job_id
+		self.description = description
+		self.k = k
+		self.submitted = time.monotonic()
+		self.done = threading.Event()
+		self.abandoned = False
+		self.result = None
+		self.error = None
+
+
+class SimilarJobs:
+	"""
+	Finds the jobs most similar to a job or a free-text description,
+		by the Euclidean distance between their lda17 topic vectors.
+
+	The model and index are loaded once and stay resident, read-only and memory-mapped,
+		and the index is refreshed every `refresh_interval` seconds to pick up jobs the models have added since.
+		Requests are queued for a batching thread, which answers up to `max_batch` of them at once,
+		waiting up to `max_wait` seconds after the first for others to join it:
+		their descriptions are scored together, and every vector is looked up in one index query.
+		A request not answered within its latency budget, `timeout` seconds, fails with a TimeoutError.
+	"""
+
+	def __init__(
+			self,
+			files_directory: str = LDA17_FILES_DIRECTORY,
+			index_directory: str = LDA17Model.NN_INDEX_DIRECTORY,
+			max_batch: int = 64,
+			max_wait: float = 0.002,
+			timeout: float = 1.0,
+			refresh_interval: float = 60.0,
+	):
+		"""
+		Args:
+			files_directory (str, optional): Directory of the lda17 model files.
+			index_directory (str, optional): Directory of the nearest-neighbour index the models maintain.
+			max_batch (int, optional): Most requests answered at once. Defaults to 64.
+			max_wait (float, optional): Seconds a batch waits for more requests after the first. Defaults to 0.002.
+			timeout (float, optional): Latency budget of a request, in seconds. Defaults to 1.
+			refresh_interval (float, optional): Seconds between checks for jobs added to the index. Defaults to 60.
+		"""
+
+		self.index_directory = index_directory
+		self.max_batch = max(1, max_batch)
+		self.max_wait = max_wait
+		self.timeout = timeout
+		self.refresh_interval = refresh_interval
+		self.model, self.id2word = load_lda17(files_directory)
+		self.index = None
+		self._refreshed_at = 0.0
+		self._open_index()
+
+		self.requests = 0
+		self.batches = 0
+		self.timeouts = 0
+		self.not_indexed = 0
+		self._latencies = collections.deque(maxlen=1000)
+		self._stats_lock = threading.Lock()
+		self._queue = queue.Queue()
+		self._last_batch_size = 0
+		self._warm()
+		self._thread = threading.Thread(target=self._run, name='similar-jobs', daemon=True)
+		self._thread.start()
+
+	def similar(self, job_id: Optional[int] = None, description: Optional[str] = None, k: int = 10, timeout: Optional[float] = None) -> List[Tuple[int, float]]:
+		"""
+		Finds the jobs most similar to a job, or to a description.
+
+		Args:
+			job_id (int, optional): Job to find similar jobs to. It is left out of its own results.
+			description (str, optional): Description to find similar jobs to, if no job_id is given.
+			k (int, optional): Number of similar jobs. Defaults to 10.
+			timeout (float, optional): Latency budget in seconds. Defaults to the instance's.
+
+		Raises:
+			ValueError: If not exactly one of job_id and description is given, or k is not between 1 and MAX_K.
+			KeyError: If the job is not indexed.
+			IndexUnavailableError: If the index has not been built yet.
+			TimeoutError: If the lookup was not answered within the budget.
+
+		Returns:
+			List[Tuple[int, float]]: (job id, distance) of the most similar jobs, nearest first.
+				Fewer than k if fewer jobs are indexed.
+		"""
+
+		if (job_id is None) == (description is None):
+			raise ValueError('Give exactly one of job_id and description.')
+		if not 1 <= k <= MAX_K:
+			raise ValueError(f'k must be between 1 and {MAX_K}, not {k}.')
+		request = SimilarRequest(job_id, description, k)
+		self._queue.put(request)
+		if not request.done.wait(self.timeout if timeout is None else timeout):
+			# The batching thread skips it if it has not got to it yet
+			request.abandoned = True
+			with self._stats_lock:
+				self.timeouts += 1
+			raise TimeoutError(f'Similar jobs not found within {self.timeout if timeout is None else timeout} seconds.')
+		if request.error is not None:
+			raise request.error
+		return request.result
+
+	def _run(self) -> None:
+		while True:
+			request = self._queue.get()
+			if request is None:
+				return
+			batch = [request]
+			# Waiting for company only pays off under concurrent load, so a lone client is answered at once
+			concurrent = self._last_batch_size > 1 or not self._queue.empty()
+			deadline = time.monotonic() + (self.max_wait if concurrent else 0.0)
+			while len(batch) < self.max_batch:
+				try:
+					request = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+				except queue.Empty:
+					break
+				if request is None:
+					self._queue.put(None)
+					break
+				batch.append(request)
+			self._last_batch_size = len(batch)
+			batch = [request for request in batch if not request.abandoned]
+			if not batch:
+				continue
+			try:
+				self._answer(batch)
+			except Exception as e:
+				SIMILAR_LOG.warn(f'Exception {type(e)} while finding similar jobs: {e}')
+				SIMILAR_LOG.warn(e, exc_info=True)
+				for request in batch:
+					if not request.done.is_set():
+						request.error = e
+						request.done.set()
+
+	def _answer(self, batch: List[SimilarRequest]) -> None:
+		if time.monotonic() - self._refreshed_at > self.refresh_interval:
+			self._refresh()
+		if self.index is None:
+			raise IndexUnavailableError(f'No nearest-neighbour index in {self.index_directory} yet.')
+
+		vectors = np.zeros((len(batch), self.index.dim), dtype=np.float32)
+		described = [position for position, request in enumerate(batch) if request.description is not None]
+		if described:
+			vectors[described] = score_descriptions(self.model, self.id2word, [batch[position].description for position in described])
+		by_job = [position for position, request in enumerate(batch) if request.job_id is not None]
+		found = np.ones(len(batch), dtype=bool)
+		if by_job:
+			vectors[by_job], found[by_job] = self.index.vectors([batch[position].job_id for position in by_job])
+
+		# One more neighbour than asked for, as a job is its own nearest
+		job_ids, distances = self.index.query(vectors, k=max(request.k for request in batch) + 1)
+		now = time.monotonic()
+		for position, request in enumerate(batch):
+			if not found[position]:
+				request.error = KeyError(f'Job {request.job_id} is not indexed.')
+			else:
+				request.result = [
+					(job_id, distance)
+					for job_id, distance in zip(job_ids[position].tolist(), distances[position].tolist())
+					if job_id != -1 and job_id != request.job_id
+				][:request.k]
+			request.done.set()
+		with self._stats_lock:
+			self.requests += len(batch)
+			self.batches += 1
+			self.not_indexed += int((~found).sum())
+			self._latencies.extend(now - request.submitted for request in batch)
+
+	def _open_index(self) -> None:
+		try:
+			self.index = NeighborIndex(self.index_directory, writable=False)
+			SIMILAR_LOG.info(f'Opened nearest-neighbour index of {len(self.index)} jobs.')
+		except FileNotFoundError:
+			SIMILAR_LOG.info(f'No nearest-neighbour index in {self.index_directory} yet.')
+		self._refreshed_at = time.monotonic()
+
+	def _refresh(self) -> None:
+		if self.index is None:
+			self._open_index()
+			return
+		try:
+			self.index.refresh()
+		except Exception as e:
+			SIMILAR_LOG.warn(f'Exception {type(e)} while refreshing nearest-neighbour index: {e}')
+		self._refreshed_at = time.monotonic()
+
+	def _warm(self) -> None:
+		# Touches the model's and index's memory-mapped pages, so the first requests do not wait on disk
+		score_descriptions(self.model, self.id2word, ['warm up'])
+		if self.index is not None:
+			self.index.query(np.zeros((1, self.index.dim), dtype=np.float32), k=1)
+
+	def stats(self) -> dict:
+		with self._stats_lock:
+			latencies = np.array(self._latencies)
+			stats = {
+				'requests': self.requests,
+				'batches': self.batches,
+				'mean_batch_size': self.requests / self.batches if self.batches else 0.0,
+				'timeouts': self.timeouts,
+				'not_indexed': self.not_indexed,
+				'budget_seconds': self.timeout,
+				'queued': self._queue.qsize(),
+				'indexed': len(self.index) if self.index is not None else 0,
+			}
+		for percentile in (50, 95, 99):
+			stats[f'p{percentile}_seconds'] = float(np.percentile(latencies, percentile)) if len(latencies) else None
+		return stats
+
+	def close(self) -> None:
+		self._queue.put(None)
+		self._thread.join()
+
+
+_similar_jobs = None
+_similar_jobs_lock = threading.Lock()
+
+
+def get_similar_jobs() -> SimilarJobs:
+	"""
+	Gets the process's resident SimilarJobs, loading it on first use,
+		configured from SIMILAR_MAX_BATCH, SIMILAR_MAX_WAIT_MS, SIMILAR_TIMEOUT and SIMILAR_REFRESH_SECONDS.
+	"""
+
+	global _similar_jobs
+	with _similar_jobs_lock:
+		if _similar_jobs is None:
+			_similar_jobs = SimilarJobs(
+				max_batch=config('SIMILAR_MAX_BATCH', default=64, cast=int),
+				max_wait=config('SIMILAR_MAX_WAIT_MS', default=2.0, cast=float) / 1000,
+				timeout=config('SIMILAR_TIMEOUT', default=1.0, cast=float),
+				refresh_interval=config('SIMILAR_REFRESH_SECONDS', default=60.0, cast=float),
+			)
+			metrics.register('similar', _similar_jobs.stats)
+	return _similar_jobs
+
+
+def similar_jobs(job_id: Optional[int] = None, description: Optional[str] = None, k: int = 10) -> List[Tuple[int, float]]:
+	"""
+	Finds the jobs most similar to a job or a description, with the process's resident SimilarJobs.
+		See SimilarJobs.similar.
+	"""
+
+	return get_similar_jobs().similar(job_id=job_id, description=description, k=k)
@@ -1,10 +1,22 @@
 
 import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
 
+from collections import OrderedDict, deque
+from decouple import config
+from multiprocessing.connection import wait
 from typing import Optional, Type, List
 
+from datafunctions.database import ensure_schema, get_pool
 from datafunctions.retrieve.retrievefunctions import DataRetriever
 from datafunctions.retrieve import retrievers
+from datafunctions.retrieve.cache import DimensionCache
+from datafunctions.retrieve.neardup import DEFAULT_INDEX_PATH, NearDuplicateIndex
+from datafunctions.retrieve.persist import BatchPersister
 from datafunctions.model.modelfunctions import TopicModel
 from datafunctions.model import models
 
@@ -12,41 +24,292 @@ from datafunctions.utils import descendants
 
 POPULATE_LOG = logging.getLogger(__name__)
 
+# Seconds a timed out retriever process has to close its retriever before it is killed
+TERMINATE_GRACE_SECONDS = 10.0
+
+
+def uses_get_data(retriever_class: Type[DataRetriever]) -> bool:
+	"""
+	Whether a retriever returns its data from get_data, rather than storing it itself with get_and_store_data.
+	"""
+
+	return getattr(retriever_class, "get_data", None) not in [None, DataRetriever.get_data]
+
+
+def retriever_summary(
+		retriever_class: Type[DataRetriever],
+		seconds: float = 0.0,
+		rows_added: int = 0,
+		results: Optional[List[dict]] = None,
+		error: Optional[str] = None,
+		jobs_failed: int = 0,
+) -> dict:
+	return {
+		'retriever': retriever_class.__name__,
+		'seconds': seconds,
+		'rows_added': rows_added,
+		'jobs_failed': jobs_failed,
+		'results': results,
+		'error': error,
+	}
+
+
+def run_retriever(retriever_class: Type[DataRetriever], db_conn=None) -> dict:
+	"""
+	Runs one retriever, catching and logging any failure.
+
+	Args:
+		retriever_class (Type[DataRetriever]): Class of the retriever.
+		db_conn (optional): Connection a storing retriever saves with. Defaults to borrowing one from the shared pool.
+
+	Returns:
+		dict: Summary of the run: the retriever's name, `seconds` taken, `rows_added` by a storing retriever
+			and the `jobs_failed` it could not retrieve or save, `results` returned by get_data, if the retriever has it, and the `error` if it failed.
+	"""
+
+	start = time.monotonic()
+	own_conn = None
+	rows_added = 0
+	jobs_failed = 0
+	results = None
+	error = None
+	try:
+		POPULATE_LOG.info(f'Instantiating retriever class: {retriever_class}')
+		with retriever_class() as r:
+			if uses_get_data(retriever_class):
+				results = r.get_data()
+				if isinstance(results, dict):
+					results = [results]
+				results = list(results)
+				POPULATE_LOG.info(f'Got {len(results)} results from {retriever_class}.')
+			else:
+				if db_conn is None:
+					own_conn = db_conn = get_pool().getconn()
+				POPULATE_LOG.info(f'Calling get_and_store_data on instance: {r}')
+				r.get_and_store_data(db_conn)
+				rows_added = r.rows_added
+				jobs_failed = r.jobs_failed
+				POPULATE_LOG.info(f'Done get_and_store_data on instance: {r}')
+	except Exception as e:
+		POPULATE_LOG.warning(f'Failure while running retriever {retriever_class}: {e}')
+		POPULATE_LOG.warning(e, exc_info=True)
+		error = f'{type(e).__name__}: {e}'
+	finally:
+		if own_conn is not None:
+			get_pool().putconn(own_conn)
+	return retriever_summary(retriever_class, time.monotonic() - start, rows_added, results, error, jobs_failed)
+
+
+def _run_retriever_worker(retriever_class: Type[DataRetriever], sender) -> None:
+	try:
+		summary = run_retriever(retriever_class)
+		try:
+			sender.send(summary)
+		except OSError:
+			# The populator stopped waiting for this retriever when it timed out
+			pass
+	finally:
+		sender.close()
+
+
+def _exit_on_signal(signum, frame) -> None:
+	# Unwinds the retriever's with block, so it closes its scraper and browser before the process exits
+	raise SystemExit(f'Terminated by signal {signum}')
+
+
+def _run_retriever_process(retriever_class: Type[DataRetriever], sender) -> None:
+	signal.signal(signal.SIGTERM, _exit_on_signal)
+	_run_retriever_worker(retriever_class, sender)
+
+
+def stop_process(process: multiprocessing.Process, grace: float = TERMINATE_GRACE_SECONDS) -> None:
+	"""
+	Sends a process SIGTERM, and kills it if it has not exited within `grace` seconds.
+	"""
+
+	process.terminate()
+	process.join(grace)
+	if process.is_alive():
+		POPULATE_LOG.warning(f'{process.name} did not exit within {grace} seconds of SIGTERM, killing it.')
+		os.kill(process.pid, signal.SIGKILL)
+		process.join()
+
 
 class Populator:
-	def __init__(self):
+	retriever_executors = ('thread', 'process')
+
+	def __init__(
+			self,
+			save_batch_size: int = 500,
+			retriever_workers: Optional[int] = None,
+			retriever_executor: Optional[str] = None,
+			retriever_timeout: Optional[float] = None,
+	):
+		"""
+		Args:
+			save_batch_size (int, optional): Results saved per transaction by `save_data`. Defaults to 500.
+			retriever_workers (int, optional): Retrievers run at once.
+				Defaults to the RETRIEVER_WORKERS setting, or 1, running them one after another.
+			retriever_executor (str, optional): 'thread' or 'process', what concurrent retrievers run in.
+				Defaults to the RETRIEVER_EXECUTOR setting, or 'thread'.
+			retriever_timeout (float, optional): Seconds a retriever may run, unless its class sets a `timeout`.
+				Defaults to the RETRIEVER_TIMEOUT setting, or 0, for no limit.
+
+		Raises:
+			ValueError: If retriever_executor is not a known executor.
+		"""
+
+		if retriever_workers is None:
+			retriever_workers = config('RETRIEVER_WORKERS', default=1, cast=int)
+		if retriever_executor is None:
+			retriever_executor = config('RETRIEVER_EXECUTOR', default='thread')
+		if retriever_executor not in self.retriever_executors:
+			raise ValueError(f'Unknown retriever_executor: {retriever_executor}')
+		if retriever_timeout is None:
+			retriever_timeout = config('RETRIEVER_TIMEOUT', default=0.0, cast=float)
+		self.save_batch_size = save_batch_size
+		self.retriever_workers = max(1, int(retriever_workers))
+		self.retriever_executor = retriever_executor
+		self.retriever_timeout = retriever_timeout
 		POPULATE_LOG.info('Populator instantiated.')
 
-	def retrieve_and_save_data(self, db_conn, retriever_classes: Optional[List[Type[DataRetriever]]] = None) -> None:
+	def retrieve_and_save_data(self, db_conn, retriever_classes: Optional[List[Type[DataRetriever]]] = None) -> List[dict]:
 		"""
 		Retrieves data from each DataRetriever provided, then saves it to the database.
 
 		Arguments:
 			retriever_classes (List[Type[DataRetriever]], optional): Classes of retriever_class to call.
 				Defaults to every retriever_class in datafunctions.retrieve.retrievers.
+
+		Returns:
+			List[dict]: Summary of each retriever's run, see `run_retriever`.
 		"""
 
 		if retriever_classes is None:
 			POPULATE_LOG.info('retriever_classes not passed, auto-populating.')
 			retriever_classes = descendants(DataRetriever)
 		POPULATE_LOG.info(f'retriever_classes: {str(retriever_classes)}')
-		retriever_classes_store = []
-		retriever_classes_get = []
-		for retriever_class in retriever_classes:
-			# If the retriever_class class has a get_data method, we'll use that
-			if getattr(retriever_class, "get_data", None) not in [None, DataRetriever.get_data]:
-				retriever_classes_get.append(retriever_class)
-			# Otherwise, we'll use the get_and_store_data method
-			else:
-				retriever_classes_store.append(retriever_class)
+		# If the retriever_class class has a get_data method, we'll use that,
+		# otherwise, we'll use the get_and_store_data method
+		retriever_classes_get = [retriever_class for retriever_class in retriever_classes if uses_get_data(retriever_class)]
+		retriever_classes_store = [retriever_class for retriever_class in retriever_classes if not uses_get_data(retriever_class)]
 		POPULATE_LOG.info(f'retriever_classes_get: {str(retriever_classes_get)}')
 		POPULATE_LOG.info(f'retriever_classes_store: {str(retriever_classes_store)}')
+		# Every retriever runs in the same sweep, so concurrent ones overlap whichever way they save
+		summaries = self.run_retrievers(db_conn, retriever_classes_get + retriever_classes_store)
 		if len(retriever_classes_get):
-			data = self.retrieve_data(retriever_classes_get)
+			data = [result for summary in summaries if summary['results'] for result in summary['results']]
 			data_deduplicated = self.deduplicate_data(data)
 			self.save_data(db_conn, data_deduplicated)
-		if len(retriever_classes_store):
-			self.get_and_store_data(db_conn, retriever_classes_store)
+		return summaries
+
+	def retriever_timeout_for(self, retriever_class: Type[DataRetriever]) -> Optional[float]:
+		timeout = getattr(retriever_class, 'timeout', None)
+		if timeout is None:
+			timeout = self.retriever_timeout
+		return timeout or None
+
+	def run_retrievers(self, db_conn, retriever_classes: List[Type[DataRetriever]]) -> List[dict]:
+		"""
+		Runs retrievers and logs a summary of their runs.
+
+		With one retriever worker and no timeouts, they run one after another, saving with `db_conn`.
+			Otherwise, they run concurrently in threads or processes, each saving with a connection borrowed from the shared pool.
+			Either way, a retriever that fails is logged and the others carry on.
+
+		Arguments:
+			db_conn: Connection to the database.
+			retriever_classes (List[Type[DataRetriever]]): retriever_class classes to call.
+
+		Returns:
+			List[dict]: Summary of each retriever's run, in the order of retriever_classes, see `run_retriever`.
+		"""
+
+		timeouts = [self.retriever_timeout_for(retriever_class) for retriever_class in retriever_classes]
+		if self.retriever_workers <= 1 and not any(timeouts):
+			summaries = [run_retriever(retriever_class, db_conn) for retriever_class in retriever_classes]
+		else:
+			summaries = self.run_retrievers_concurrently(retriever_classes, timeouts)
+		self.log_summaries(summaries)
+		return summaries
+
+	def run_retrievers_concurrently(self, retriever_classes: List[Type[DataRetriever]], timeouts: List[Optional[float]]) -> List[dict]:
+		"""
+		Runs up to `retriever_workers` retrievers at once, each in its own thread or process.
+			Each worker sends its summary back through a pipe of its own, so a worker that dies cannot affect the others'.
+
+		A retriever still running after its timeout is counted as failed. A process is sent SIGTERM then,
+			which closes its retriever, and is killed if it has not exited within TERMINATE_GRACE_SECONDS.
+			A thread cannot be stopped, so it is left running in the background, and its results are ignored.
+
+		Returns:
+			List[dict]: Summary of each retriever's run, in the order of retriever_classes.
+		"""
+
+		use_processes = self.retriever_executor == 'process'
+		pending = deque(range(len(retriever_classes)))
+		running = {}  # Index of running retriever: (worker, receiving end of its pipe, deadline)
+		summaries = [None] * len(retriever_classes)
+		POPULATE_LOG.info(f'Running {len(retriever_classes)} retrievers, {self.retriever_workers} at a time in {"processes" if use_processes else "threads"}...')
+		while pending or running:
+			while pending and len(running) < self.retriever_workers:
+				index = pending.popleft()
+				receiver, sender = multiprocessing.Pipe(duplex=False)
+				if use_processes:
+					# Not a daemon, as daemonic processes cannot start the processes a retriever may use, e.g. to convert descriptions
+					worker = multiprocessing.Process(
+						target=_run_retriever_process,
+						args=(retriever_classes[index], sender),
+						name=f'retriever-{retriever_classes[index].__name__}',
+					)
+				else:
+					worker = threading.Thread(
+						target=_run_retriever_worker,
+						args=(retriever_classes[index], sender),
+						name=f'retriever-{retriever_classes[index].__name__}',
+						daemon=True,
+					)
+				worker.start()
+				if use_processes:
+					# Only the child's copy is left open, so the pipe reads as closed once the child exits
+					sender.close()
+				running[index] = (worker, receiver, time.monotonic() + timeouts[index] if timeouts[index] else None)
+
+			wait([receiver for _, receiver, _ in running.values()], timeout=1.0)
+			now = time.monotonic()
+			for index, (worker, receiver, deadline) in list(running.items()):
+				retriever_class = retriever_classes[index]
+				if receiver.poll():
+					try:
+						summaries[index] = receiver.recv()
+					except EOFError:
+						worker.join()
+						POPULATE_LOG.warning(f'Retriever {retriever_class} exited without a result.')
+						summaries[index] = retriever_summary(retriever_class, error=f'Exited with code {getattr(worker, "exitcode", None)}')
+					else:
+						worker.join()
+				elif deadline is not None and now > deadline:
+					POPULATE_LOG.warning(f'Retriever {retriever_class} timed out after {timeouts[index]} seconds.')
+					if use_processes:
+						stop_process(worker)
+					summaries[index] = retriever_summary(retriever_class, timeouts[index], error=f'Timed out after {timeouts[index]} seconds')
+				else:
+					continue
+				receiver.close()
+				del running[index]
+		return summaries
+
+	def log_summaries(self, summaries: List[dict]) -> None:
+		for summary in summaries:
+			if summary['error'] is not None:
+				outcome = f'failed ({summary["error"]})'
+			elif summary['results'] is not None:
+				outcome = f'{len(summary["results"])} results'
+			else:
+				outcome = f'{summary["rows_added"]} rows added'
+			if summary['jobs_failed']:
+				outcome += f', {summary["jobs_failed"]} jobs failed'
+			POPULATE_LOG.info(f'Retriever {summary["retriever"]}: {summary["seconds"]:.1f} seconds, {outcome}.')
 
 	def model_and_save_topics(self, db_conn, model_classes: Optional[List[Type[TopicModel]]] = None) -> None:
 		"""
@@ -70,22 +333,21 @@ class Populator:
 					POPULATE_LOG.info(f'Done populate_database on instance: {m}')
 		POPULATE_LOG.info('model_and_save_topics done.')
 
-	def get_and_store_data(self, db_conn, retriever_class: List[Type[DataRetriever]]) -> None:
+	def get_and_store_data(self, db_conn, retriever_class: List[Type[DataRetriever]]) -> List[dict]:
 		"""
 		Retrieves data from each DataRetriever provided, and stores it in the database.
 
 		Arguments:
 			retriever_class (List[Type[DataRetriever]]): retriever_class classes to call.
+
+		Returns:
+			List[dict]: Summary of each retriever's run, see `run_retriever`.
 		"""
 
 		POPULATE_LOG.info('get_and_store_data called.')
-		for retriever_class in retriever_class:
-			POPULATE_LOG.info(f'Instantiating retriever class: {retriever_class}')
-			with retriever_class() as r:
-				POPULATE_LOG.info(f'Calling get_and_store_data on instance: {r}')
-				r.get_and_store_data(db_conn)
-				POPULATE_LOG.info(f'Done get_and_store_data on instance: {r}')
+		summaries = self.run_retrievers(db_conn, retriever_class)
 		POPULATE_LOG.info('get_and_store_data done.')
+		return summaries
 
 	def retrieve_data(self, retriever_class: List[Type[DataRetriever]]) -> List[dict]:
 		"""
@@ -95,13 +357,11 @@ class Populator:
 			retriever_class (List[Type[DataRetriever]]): retriever_class classes to call.
 
 		Returns:
-			list: The results of `retriever_class.get_data()` for each retriever_class.
+			list: The results of `retriever_class.get_data()` for every retriever_class, in one list.
 		"""
 
-		data = []
-		for retriever_class in retriever_class:
-			with retriever_class() as r:
-				data.append(r.get_data())
+		summaries = self.run_retrievers(None, retriever_class)
+		data = [result for summary in summaries if summary['results'] for result in summary['results']]
 
 		return (data)
 
@@ -113,19 +373,81 @@ class Populator:
 			That functionality is provided in `self.save_data()`.
 
 		Args:
-			data (List[dict]): A list of data dicts, returned from `self.get_data()`.
+			data (List[dict]): A list of data dicts, returned from `self.retrieve_data()`.
 
 		Returns:
 			List[dict]: A deduplicated version of the input list.
 		"""
 
-		raise NotImplementedError
+		# Two results are the same job if they share a source id, or any of BatchPersister's dedup keys
+		seen = set()
+		deduplicated = []
+		for result in data:
+			keys = BatchPersister.dedup_keys(result)
+			source_key = BatchPersister.source_key(result)
+			if source_key is not None:
+				keys.append(('source_id',) + source_key)
+			if any(key in seen for key in keys):
+				continue
+			seen.update(keys)
+			deduplicated.append(result)
+		POPULATE_LOG.info(f'Deduplicated {len(data)} results to {len(deduplicated)}.')
+		return deduplicated
 
-	def save_data(self, db_conn, data: List[dict]) -> None:
+	def save_data(self, db_conn, data: List[dict]) -> int:
 		"""
-		This function will save the data to the database.
+		Saves deduplicated results to the database, skipping jobs that are already stored.
+
+		Results whose source id is already recorded are dropped first, with one query per source.
+			A source id is only used with its source, as BatchPersister records it; results with only a source id are saved without one.
+			The rest are saved in batches by a BatchPersister, which matches each batch against
+			stored jobs with one set-based query and inserts only the new ones, with multi-row inserts.
+			Near-duplicates are handled as set by NEAR_DUPLICATE_THRESHOLD and NEAR_DUPLICATE_ACTION,
+			as for the scrapers.
+
+		Args:
+			db_conn: Connection to the database.
+			data (List[dict]): Results, as returned from `self.deduplicate_data()`.
 
-		Deduplication against the DB should occur here.
+		Returns:
+			int: Number of new job listings added.
 		"""
 
-		raise NotImplementedError
+		ensure_schema(db_conn, 'job_source_ids')
+		ensure_schema(db_conn, 'job_fingerprints')
+		ensure_schema(db_conn, 'job_duplicates')
+		dimension_cache = DimensionCache()
+		dimension_cache.warm(db_conn)
+		near_duplicates = None
+		near_duplicate_threshold = config('NEAR_DUPLICATE_THRESHOLD', default=0.0, cast=float)
+		if near_duplicate_threshold:
+			near_duplicates = NearDuplicateIndex(DEFAULT_INDEX_PATH, threshold=near_duplicate_threshold)
+		persister = BatchPersister(
+			db_conn,
+			batch_size=self.save_batch_size,
+			dimension_cache=dimension_cache,
+			near_duplicates=near_duplicates,
+			near_duplicate_action=config('NEAR_DUPLICATE_ACTION', default='tag'),
+		)
+
+		source_ids = OrderedDict()
+		missing_source = 0
+		for result in data:
+			source_key = BatchPersister.source_key(result)
+			if source_key is not None:
+				source_ids.setdefault(source_key[0], []).append(source_key[1])
+			elif result.get('source_id') is not None:
+				missing_source += 1
+		if missing_source:
+			POPULATE_LOG.warn(f'{missing_source} results have a source_id but no source, so their source ids are not recorded.')
+		known = set()
+		for source, ids in source_ids.items():
+			known.update((source, source_id) for source_id in persister.find_known_source_ids(source, ids))
+		new_data = [result for result in data if BatchPersister.source_key(result) not in known]
+		POPULATE_LOG.info(f'{len(data) - len(new_data)} results already stored by source id, saving {len(new_data)}...')
+
+		for result in new_data:
+			persister.add(result)
+		persister.flush()
+		POPULATE_LOG.info(f'Added {persister.rows_added} new job listings.')
+		return persister.rows_added
@@ -0,0 +1,182 @@
+"""
+In-process caches for values that are expensive to look up.
+"""
+
+import logging
+import threading
+
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+CACHE_LOG = logging.getLogger(__name__)
+
+
+class LRUCache:
+	"""
+	Thread-safe, size-bounded mapping that evicts the least recently used entry.
+	"""
+
+	def __init__(self, max_size: int = 10000):
+		"""
+		Args:
+			max_size (int, optional): Maximum number of entries kept. Defaults to 10000.
+		"""
+
+		self.max_size = max(1, int(max_size))
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self._data = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key: Hashable, default: Any = None) -> Any:
+		"""
+		Gets a value, marking it as recently used. Counts a hit or a miss.
+		"""
+
+		with self._lock:
+			try:
+				value = self._data[key]
+			except KeyError:
+				self.misses += 1
+				return default
+			self._data.move_to_end(key)
+			self.hits += 1
+			return value
+
+	def put(self, key: Hashable, value: Any) -> None:
+		"""
+		Sets a value, evicting the least recently used entry if the cache is full.
+		"""
+
+		with self._lock:
+			self._data[key] = value
+			self._data.move_to_end(key)
+			while len(self._data) > self.max_size:
+				self._data.popitem(last=False)
+				self.evictions += 1
+
+	def clear(self) -> None:
+		with self._lock:
+			self._data.clear()
+
+	def stats(self) -> dict:
+		"""
+		Returns:
+			dict: Size, capacity and hit/miss/eviction counters.
+		"""
+
+		with self._lock:
+			lookups = self.hits + self.misses
+			return {
+				'size': len(self._data),
+				'max_size': self.max_size,
+				'hits': self.hits,
+				'misses': self.misses,
+				'evictions': self.evictions,
+				'hit_rate': self.hits / lookups if lookups else 0.0,
+			}
+
+	def __len__(self):
+		return len(self._data)
+
+
+class DimensionCache:
+	"""
+	Caches company and location ids so repeat entities need no database round-trips.
+
+	Companies are keyed by normalized name and map to (company id, populated),
+		where populated means the stored company already has a description.
+		Locations are keyed by (city, state_province) and map to the location id.
+	"""
+
+	companies_warm_query = """
+		SELECT name, id, populated
+		FROM (
+			SELECT DISTINCT ON (name) name, id, description IS NOT NULL AS populated
+			FROM companies
+			ORDER BY name, description IS NULL, id
+		) AS c
+		ORDER BY id DESC
+		LIMIT %(limit)s;
+	"""
+
+	locations_warm_query = """
+		SELECT city, state_province, id
+		FROM (
+			SELECT DISTINCT ON (city, state_province) city, state_province, id
+			FROM locations
+			ORDER BY city, state_province, id
+		) AS l
+		ORDER BY id DESC
+		LIMIT %(limit)s;
+	"""
+
+	def __init__(self, max_companies: int = 20000, max_locations: int = 20000):
+		"""
+		Args:
+			max_companies (int, optional): Maximum number of companies cached. Defaults to 20000.
+			max_locations (int, optional): Maximum number of locations cached. Defaults to 20000.
+		"""
+
+		self.companies = LRUCache(max_companies)
+		self.locations = LRUCache(max_locations)
+
+	@staticmethod
+	def normalize_company(name: str) -> str:
+		"""
+		Collapses whitespace in a company name.
+			Case is kept, since the database matches company names exactly.
+		"""
+
+		return ' '.join((name or '').split())
+
+	def get_company(self, name: str) -> Optional[Tuple[int, bool]]:
+		return self.companies.get(self.normalize_company(name))
+
+	def put_company(self, name: str, company_id: int, populated: bool) -> None:
+		self.companies.put(self.normalize_company(name), (company_id, populated))
+
+	def get_location(self, city: str, state_province: str) -> Optional[int]:
+		return self.locations.get((city, state_province))
+
+	def put_location(self, city: str, state_province: str, location_id: int) -> None:
+		self.locations.put((city, state_province), location_id)
+
+	def warm(self, db_conn) -> None:
+		"""
+		Loads the most recently added companies and locations, up to each cache's size.
+
+		Args:
+			db_conn: Connection to the database.
+		"""
+
+		CACHE_LOG.info('Warming company and location cache...')
+		curr = None
+		try:
+			curr = db_conn.cursor()
+			curr.execute(self.companies_warm_query, {'limit': self.companies.max_size})
+			# Oldest first, so the newest entries end up most recently used
+			for name, company_id, populated in reversed(curr.fetchall()):
+				self.put_company(name, company_id, populated)
+			curr.execute(self.locations_warm_query, {'limit': self.locations.max_size})
+			for city, state_province, location_id in reversed(curr.fetchall()):
+				self.put_location(city, state_province, location_id)
+			curr.close()
+			db_conn.commit()
+			CACHE_LOG.info(f'Cache warmed with {len(self.companies)} companies and {len(self.locations)} locations.')
+		except Exception as e:
+			CACHE_LOG.warn(f'Exception {type(e)} while warming cache, continuing cold: {e}')
+			CACHE_LOG.warn(e, exc_info=True)
+			try:
+				if curr is not None:
+					curr.close()
+				db_conn.rollback()
+			except Exception as e2:
+				CACHE_LOG.warn(f'Exception {type(e2)} while rolling back, skipping: {e2}')
+
+	def stats(self) -> dict:
+		return {
+			'companies': self.companies.stats(),
+			'locations': self.locations.stats(),
+		}
@@ -0,0 +1,267 @@
+"""
+Append-only checkpoints of scraping progress, so an interrupted run can resume.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+
+from typing import Iterable, List
+
+CHECKPOINT_LOG = logging.getLogger(__name__)
+
+DEFAULT_CHECKPOINT_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'db', 'checkpoints')
+
+
+def read_records(path: str) -> List[List[str]]:
+	"""
+	Reads a checkpoint file's records, dropping a partly written last line left by a crash.
+		The file is truncated to its last complete line, so later appends start on a fresh line.
+
+	Args:
+		path (str): Checkpoint file.
+
+	Returns:
+		List[List[str]]: Each record's type and its value, if any.
+	"""
+
+	if not os.path.exists(path):
+		return []
+	with open(path, 'rb+') as f:
+		data = f.read()
+		complete = data.rfind(b'\n') + 1
+		if complete != len(data):
+			CHECKPOINT_LOG.warn(f'Dropping partial record at end of {path}')
+			f.truncate(complete)
+	return [line.split(' ', 1) for line in data[:complete].decode('utf-8').splitlines() if line]
+
+
+def append_records(path: str, records: Iterable[str]) -> None:
+	"""
+	Appends records to a checkpoint file in one write, and syncs it to disk.
+	"""
+
+	data = ''.join(f'{record}\n' for record in records)
+	if not data:
+		return
+	with open(path, 'a', encoding='utf-8') as f:
+		f.write(data)
+		f.flush()
+		os.fsync(f.fileno())
+
+
+class SearchCheckpoint:
+	"""
+	Progress of one title search: the jobids it found, how far paging got,
+		whether it finished, and which jobids have been saved.
+
+	Records are single lines, appended as progress is made:
+		`P <page> <jobid> ...` for the jobids found on a result page,
+		`S` once the search has finished, and
+		`D <jobid> ...` for jobids whose results have been committed, or that need no saving.
+	"""
+
+	def __init__(self, path: str, title: str):
+		"""
+		Args:
+			path (str): File the checkpoint is kept in. Existing records there are loaded.
+			title (str): Title searched for.
+		"""
+
+		self.path = path
+		self.title = title
+		self.jobids = []
+		self.done = set()
+		self.last_page = 0
+		self.complete = False
+		self._seen = set()
+		self._lock = threading.Lock()
+		for record in read_records(path):
+			kind, values = record[0], record[1].split() if len(record) > 1 else []
+			if kind == 'P':
+				self.last_page = max(self.last_page, int(values[0]))
+				self._add(values[1:])
+			elif kind == 'S':
+				self.complete = True
+			elif kind == 'D':
+				self.done.update(values)
+
+	def _add(self, jobids: Iterable[str]) -> List[str]:
+		added = [jobid for jobid in jobids if jobid not in self._seen]
+		self._seen.update(added)
+		self.jobids.extend(added)
+		return added
+
+	def add_page(self, page: int, jobids: List[str]) -> List[str]:
+		"""
+		Records the jobids found on a result page.
+
+		Args:
+			page (int): Number of the page, from 1.
+			jobids (List[str]): Jobids on the page.
+
+		Returns:
+			List[str]: The jobids not already recorded.
+		"""
+
+		with self._lock:
+			added = self._add(jobids)
+			self.last_page = max(self.last_page, page)
+			append_records(self.path, [' '.join(['P', str(page)] + added)])
+		return added
+
+	def mark_complete(self) -> None:
+		"""
+		Records that the search has found every jobid.
+		"""
+
+		with self._lock:
+			self.complete = True
+			append_records(self.path, ['S'])
+
+	def mark_done(self, jobids: Iterable[str]) -> None:
+		"""
+		Records that jobids need no more work.
+		"""
+
+		with self._lock:
+			new = [str(jobid) for jobid in jobids if jobid is not None and str(jobid) not in self.done]
+			if not new:
+				return
+			self.done.update(new)
+			append_records(self.path, [' '.join(['D'] + new)])
+
+	def pending(self) -> List[str]:
+		"""
+		Returns:
+			List[str]: Found jobids not yet done, in the order they were found.
+		"""
+
+		with self._lock:
+			return [jobid for jobid in self.jobids if jobid not in self.done]
+
+
+class ScrapeCheckpoint:
+	"""
+	Progress of a sweep of searches through a list of titles, for one site.
+
+	The sweep's file records the title order (`T <json list>`), each failed attempt at a title
+		(`F <title>`) and each title finished (`C <title>`), and every title has a SearchCheckpoint.
+		A run started while a sweep is unfinished carries on with that sweep's remaining titles,
+		and the checkpoints are removed once every title is finished.
+	"""
+
+	def __init__(self, source: str, directory: str = DEFAULT_CHECKPOINT_DIRECTORY, max_attempts: int = 3):
+		"""
+		Args:
+			source (str): Name of the site being scraped.
+			directory (str, optional): Directory checkpoints are kept in. Defaults to datafunctions/db/checkpoints.
+			max_attempts (int, optional): Times a title can fail before a resumed sweep skips it,
+				so a title that always fails cannot hold up every later sweep.
+				An interrupted run does not count as a failure. Defaults to 3.
+		"""
+
+		self.source = source
+		self.directory = os.path.join(directory, source)
+		self.max_attempts = max_attempts
+		self.sweep_path = os.path.join(self.directory, 'sweep.log')
+		self.titles = []
+		self.failures = {}
+		self.completed = set()
+		self.searches = {}
+		self._lock = threading.Lock()
+
+	def search_path(self, title: str) -> str:
+		return os.path.join(self.directory, f'{hashlib.sha1(title.encode("utf-8")).hexdigest()[:16]}.log')
+
+	def start_sweep(self, titles: List[str]) -> List[str]:
+		"""
+		Resumes the unfinished sweep, if there is one, or starts a new sweep of `titles`.
+
+		Args:
+			titles (List[str]): Titles for a new sweep, in the order to search them.
+
+		Returns:
+			List[str]: Titles still to search, in order.
+		"""
+
+		with self._lock:
+			self.titles = []
+			self.failures = {}
+			self.completed = set()
+			self.searches = {}
+			for record in read_records(self.sweep_path):
+				if record[0] == 'T':
+					self.titles = json.loads(record[1])
+				elif record[0] == 'F':
+					self.failures[record[1]] = self.failures.get(record[1], 0) + 1
+				elif record[0] == 'C':
+					self.completed.add(record[1])
+
+			if self.titles:
+				remaining = [
+					title for title in self.titles
+					if title not in self.completed and self.failures.get(title, 0) < self.max_attempts
+				]
+				CHECKPOINT_LOG.info(f'Resuming {self.source} sweep: {len(self.completed)} of {len(self.titles)} titles done, {len(remaining)} remaining.')
+				return remaining
+
+			os.makedirs(self.directory, exist_ok=True)
+			self.titles = list(titles)
+			append_records(self.sweep_path, [f'T {json.dumps(self.titles)}'])
+			CHECKPOINT_LOG.info(f'Starting {self.source} sweep of {len(self.titles)} titles.')
+			return list(self.titles)
+
+	def search(self, title: str) -> SearchCheckpoint:
+		"""
+		Gets a title's search checkpoint, loading any progress already recorded.
+		"""
+
+		with self._lock:
+			os.makedirs(self.directory, exist_ok=True)
+			if title not in self.searches:
+				self.searches[title] = SearchCheckpoint(self.search_path(title), title)
+			return self.searches[title]
+
+	def complete_title(self, title: str) -> None:
+		"""
+		Records that a title's jobs have all been saved.
+		"""
+
+		with self._lock:
+			self.completed.add(title)
+			append_records(self.sweep_path, [f'C {title}'])
+
+	def fail_title(self, title: str) -> None:
+		"""
+		Records that an attempt at a title failed.
+		"""
+
+		with self._lock:
+			self.failures[title] = self.failures.get(title, 0) + 1
+			append_records(self.sweep_path, [f'F {title}'])
+
+	def finish_sweep(self) -> bool:
+		"""
+		Removes the checkpoints if every title is done, or has failed too often.
+
+		Returns:
+			bool: True if the sweep was finished.
+		"""
+
+		with self._lock:
+			unfinished = [
+				title for title in self.titles
+				if title not in self.completed and self.failures.get(title, 0) < self.max_attempts
+			]
+			if unfinished:
+				CHECKPOINT_LOG.info(f'{self.source} sweep unfinished, {len(unfinished)} titles left for the next run.')
+				return False
+			shutil.rmtree(self.directory, ignore_errors=True)
+			self.titles = []
+			self.searches = {}
+			CHECKPOINT_LOG.info(f'{self.source} sweep finished, checkpoints removed.')
+			return True
@@ -0,0 +1,101 @@
+"""
+Deduplication state shared between concurrent scrapers.
+"""
+
+import logging
+import threading
+
+from typing import Hashable, Iterable, List, Optional
+
+DEDUP_LOG = logging.getLogger(__name__)
+
+
+class DedupView:
+	"""
+	Thread-safe record of which jobids and jobs have been claimed during a run.
+
+	Scrapers on separate database connections cannot see each other's uncommitted inserts,
+		so before fetching a jobid or inserting a job they claim it here.
+		A claim that fails means another scraper already has that job.
+
+	Claims only cover work in flight, and are released once it is committed or has failed,
+		so the view stays as small as the work in progress. From then on, the committed rows
+		are what keep other scrapers from repeating the work.
+	"""
+
+	def __init__(self):
+		self._jobids = set()
+		self._keys = set()
+		self._lock = threading.Lock()
+		self._released = threading.Condition(self._lock)
+
+	def claim_jobids(self, source: str, jobids: Iterable[str]) -> List[str]:
+		"""
+		Claims jobids for fetching.
+
+		Args:
+			source (str): Name of the site the jobids come from.
+			jobids (Iterable[str]): Jobids to claim.
+
+		Returns:
+			List[str]: The jobids that were not already claimed, in their original order.
+		"""
+
+		claimed = []
+		with self._lock:
+			for jobid in jobids:
+				if (source, jobid) not in self._jobids:
+					self._jobids.add((source, jobid))
+					claimed.append(jobid)
+		return claimed
+
+	def release_jobids(self, source: str, jobids: Iterable[str]) -> None:
+		"""
+		Releases jobids that have been saved, or could not be, so they can be claimed again.
+		"""
+
+		with self._lock:
+			self._jobids.difference_update((source, jobid) for jobid in jobids)
+
+	def claim(self, keys: Iterable[Hashable]) -> bool:
+		"""
+		Claims every dedup key of a job, or none of them.
+
+		Args:
+			keys (Iterable[Hashable]): The job's dedup keys.
+
+		Returns:
+			bool: True if the job was claimed, False if any key was already claimed.
+		"""
+
+		keys = list(keys)
+		with self._lock:
+			if any(key in self._keys for key in keys):
+				return False
+			self._keys.update(keys)
+		return True
+
+	def release(self, keys: Iterable[Hashable]) -> None:
+		"""
+		Releases keys once the rows they were claimed for are committed, or have been rolled back.
+		"""
+
+		with self._lock:
+			self._keys.difference_update(keys)
+			self._released.notify_all()
+
+	def wait_released(self, keys: Iterable[Hashable], timeout: Optional[float] = None) -> bool:
+		"""
+		Waits until none of the keys are claimed.
+
+		Args:
+			keys (Iterable[Hashable]): Keys to wait for.
+			timeout (float, optional): Most seconds to wait. Defaults to waiting for as long as it takes.
+
+		Returns:
+			bool: True if the keys were released, False if the wait timed out.
+		"""
+
+		keys = list(keys)
+		with self._lock:
+			return self._released.wait_for(lambda: not any(key in self._keys for key in keys), timeout)
@@ -0,0 +1,325 @@
+"""
+Pool of warm, health-checked WebDriver instances.
+"""
+
+import logging
+import threading
+import time
+
+from typing import Callable, Optional
+
+DRIVERPOOL_LOG = logging.getLogger(__name__)
+
+
+def process_rss_mb(pid: int) -> Optional[float]:
+	"""
+	Gets a process's resident set size from /proc.
+
+	Returns:
+		float: RSS in megabytes, or None if it cannot be read, e.g. on a system without /proc.
+	"""
+
+	try:
+		with open(f'/proc/{pid}/status') as f:
+			for line in f:
+				if line.startswith('VmRSS:'):
+					return int(line.split()[1]) / 1024
+	except (OSError, ValueError, IndexError):
+		pass
+	return None
+
+
+class PooledDriver:
+	"""
+	A driver checked out of a DriverPool, and how much it has been used.
+	"""
+
+	def __init__(self, driver):
+		self.driver = driver
+		self.pages = 0
+		self.created = time.monotonic()
+
+	@property
+	def process(self):
+		"""
+		The driver's browser process, or None if it is not known.
+		"""
+
+		service = getattr(self.driver, 'service', None)
+		return getattr(service, 'process', None)
+
+	@property
+	def pid(self) -> Optional[int]:
+		process = self.process
+		return process.pid if process is not None else None
+
+	def rss_mb(self) -> Optional[float]:
+		pid = self.pid
+		return process_rss_mb(pid) if pid is not None else None
+
+
+class DriverPool:
+	"""
+	Keeps up to `size` warm drivers, lending them out one caller at a time.
+
+	A driver is health-checked each time it is lent out, and replaced if it fails.
+		When it is returned, it is recycled if it has loaded `max_pages` pages
+		or its browser process uses more than `max_rss_mb`, and a replacement is started in the background.
+		Drivers are shut down with quit(), and if their process is still alive after that,
+		it is killed and reaped so crashed browsers do not pile up.
+	"""
+
+	def __init__(
+			self,
+			driver_factory: Callable,
+			size: int = 1,
+			max_pages: int = 200,
+			max_rss_mb: Optional[float] = 500,
+			quit_timeout: float = 10,
+	):
+		"""
+		Args:
+			driver_factory (Callable): Function creating a new, ready to use driver. It may raise on failure.
+			size (int, optional): Maximum number of drivers, lent out or idle. Defaults to 1.
+			max_pages (int, optional): Pages a driver loads before it is recycled. Defaults to 200.
+			max_rss_mb (float, optional): Browser memory use, in megabytes, above which a driver is recycled.
+				None disables the check. Defaults to 500.
+			quit_timeout (float, optional): Seconds to let quit() run before killing the process. Defaults to 10.
+		"""
+
+		self.driver_factory = driver_factory
+		self.size = max(1, int(size))
+		self.max_pages = max_pages
+		self.max_rss_mb = max_rss_mb
+		self.quit_timeout = quit_timeout
+		self.idle = []
+		self.closed = False
+		self.created = 0
+		self.recycled = 0
+		self.failed_checks = 0
+		self.killed = 0
+		self._count = 0  # Drivers idle, lent out or being created
+		self._slots = threading.Semaphore(self.size)
+		self._lock = threading.Lock()
+
+	def warm(self) -> None:
+		"""
+		Starts creating drivers in the background until the pool is full.
+		"""
+
+		with self._lock:
+			missing = self.size - self._count
+			self._count += max(0, missing)
+		for _ in range(missing):
+			threading.Thread(target=self._add_idle, name='driver-pool-warm', daemon=True).start()
+
+	def acquire(self, timeout: Optional[float] = None) -> PooledDriver:
+		"""
+		Borrows a healthy driver, waiting for one to be returned if all are lent out.
+
+		Args:
+			timeout (float, optional): Seconds to wait. Defaults to waiting indefinitely.
+
+		Raises:
+			Exception: If no driver could be borrowed in time, or a new driver could not be created.
+
+		Returns:
+			PooledDriver: The driver. It must be given back with `release`.
+		"""
+
+		if not self._slots.acquire(timeout=timeout):
+			raise Exception(f'No driver available after {timeout} seconds.')
+		try:
+			while True:
+				with self._lock:
+					if self.closed:
+						raise Exception('Driver pool is closed.')
+					pooled = self.idle.pop() if self.idle else None
+					if pooled is None and self._count < self.size:
+						self._count += 1
+						create = True
+					else:
+						create = False
+				if create:
+					return self._create()
+				if pooled is None:
+					# A warm-up is still creating this slot's driver
+					time.sleep(0.1)
+					continue
+				if self.is_healthy(pooled):
+					return pooled
+				with self._lock:
+					self.failed_checks += 1
+				DRIVERPOOL_LOG.warn(f'Driver {pooled.pid} failed its health check, replacing it...')
+				self._discard(pooled)
+				self.warm()
+		except Exception:
+			self._slots.release()
+			raise
+
+	def release(self, pooled: PooledDriver, broken: bool = False) -> None:
+		"""
+		Gives a borrowed driver back, recycling it if it is broken or worn out.
+
+		Args:
+			pooled (PooledDriver): Driver from `acquire`.
+			broken (bool, optional): Whether the borrower knows the driver is unusable. Defaults to False.
+		"""
+
+		try:
+			reason = 'broken' if broken else self.recycle_reason(pooled)
+			with self._lock:
+				closed = self.closed
+				if reason is None and not closed:
+					self.idle.append(pooled)
+					return
+				if reason is not None:
+					self.recycled += 1
+			if reason is not None:
+				DRIVERPOOL_LOG.info(f'Recycling driver {pooled.pid}: {reason}')
+			self._discard(pooled)
+			if not closed:
+				self.warm()
+		finally:
+			self._slots.release()
+
+	def replace(self, pooled: PooledDriver) -> Optional[PooledDriver]:
+		"""
+		Swaps a borrowed driver that stopped working for a fresh one, keeping the borrower's slot.
+
+		Returns:
+			PooledDriver: The new driver, or None if one could not be created.
+				In that case the slot is given back, and there is nothing to release.
+		"""
+
+		DRIVERPOOL_LOG.info(f'Replacing driver {pooled.pid}...')
+		with self._lock:
+			self.recycled += 1
+		self._discard(pooled)
+		with self._lock:
+			self._count += 1
+		try:
+			return self._create()
+		except Exception as e:
+			DRIVERPOOL_LOG.warn(f'Exception {type(e)} while replacing driver: {e}')
+			DRIVERPOOL_LOG.warn(e, exc_info=True)
+			self._slots.release()
+			return None
+
+	def is_healthy(self, pooled: PooledDriver) -> bool:
+		"""
+		Checks the browser process is alive and responds to a script.
+		"""
+
+		process = pooled.process
+		if process is not None and process.poll() is not None:
+			return False
+		try:
+			return pooled.driver.execute_script('return 1;') == 1
+		except Exception as e:
+			DRIVERPOOL_LOG.info(f'Health check of driver {pooled.pid} failed: {e}')
+			return False
+
+	def recycle_reason(self, pooled: PooledDriver) -> Optional[str]:
+		"""
+		Returns:
+			str: Why a returned driver should be recycled, or None if it can be reused.
+		"""
+
+		if self.max_pages and pooled.pages >= self.max_pages:
+			return f'{pooled.pages} pages loaded'
+		if self.max_rss_mb:
+			rss = pooled.rss_mb()
+			if rss is not None and rss > self.max_rss_mb:
+				return f'{rss:.0f} MB resident'
+		return None
+
+	def close(self) -> None:
+		"""
+		Shuts down every idle driver. Drivers still lent out are shut down when they are returned.
+		"""
+
+		with self._lock:
+			self.closed = True
+			idle = self.idle
+			self.idle = []
+		for pooled in idle:
+			self._discard(pooled)
+
+	def stats(self) -> dict:
+		with self._lock:
+			return {
+				'size': self.size,
+				'drivers': self._count,
+				'idle': len(self.idle),
+				'created': self.created,
+				'recycled': self.recycled,
+				'failed_checks': self.failed_checks,
+				'killed': self.killed,
+			}
+
+	def _create(self) -> PooledDriver:
+		try:
+			DRIVERPOOL_LOG.info('Creating pooled driver...')
+			pooled = PooledDriver(self.driver_factory())
+		except Exception:
+			with self._lock:
+				self._count -= 1
+			raise
+		with self._lock:
+			self.created += 1
+		DRIVERPOOL_LOG.info(f'Created driver {pooled.pid}.')
+		return pooled
+
+	def _add_idle(self) -> None:
+		try:
+			pooled = self._create()
+		except Exception as e:
+			DRIVERPOOL_LOG.warn(f'Exception {type(e)} while warming a driver: {e}')
+			DRIVERPOOL_LOG.warn(e, exc_info=True)
+			return
+		with self._lock:
+			closed = self.closed
+			if not closed:
+				self.idle.append(pooled)
+		if closed:
+			self._discard(pooled)
+
+	def _discard(self, pooled: PooledDriver) -> None:
+		with self._lock:
+			self._count -= 1
+		self.destroy(pooled)
+
+	def destroy(self, pooled: PooledDriver) -> None:
+		"""
+		Quits a driver, then kills and reaps its process if it is still running.
+		"""
+
+		process = pooled.process
+		quitter = threading.Thread(target=self._quit, args=(pooled,), name='driver-pool-quit', daemon=True)
+		quitter.start()
+		quitter.join(self.quit_timeout)
+		if process is None:
+			return
+		try:
+			if process.poll() is None:
+				DRIVERPOOL_LOG.warn(f'Driver process {process.pid} still running after quit, killing it...')
+				process.kill()
+				with self._lock:
+					self.killed += 1
+			process.wait(timeout=self.quit_timeout)
+		except Exception as e:
+			DRIVERPOOL_LOG.warn(f'Exception {type(e)} while killing driver process {process.pid}: {e}')
+			DRIVERPOOL_LOG.warn(e, exc_info=True)
+
+	def _quit(self, pooled: PooledDriver) -> None:
+		try:
+			pooled.driver.quit()
+		except Exception as e:
+			DRIVERPOOL_LOG.info(f'Exception {type(e)} while quitting driver {pooled.pid}: {e}')
+
+	def __enter__(self):
+		return (self)
+
+	def __exit__(self, exc_type, exc_value, tb):
+		self.close()
@@ -0,0 +1,99 @@
+"""
+Concurrent retrieval of per-job details.
+"""
+
+import asyncio
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Optional
+
+from datafunctions.retrieve.ratelimit import RateLimiter
+
+FETCHER_LOG = logging.getLogger(__name__)
+
+_END = object()  # Returned for the next jobid once there are no more
+
+
+class DetailsFetcher:
+	"""
+	Fetches details for many jobids at once.
+
+	An asyncio loop keeps up to `max_in_flight` fetches running, each started
+		only once the shared RateLimiter allows it.
+		The blocking `fetch_func` itself runs in a thread pool of the same size,
+		so any synchronous HTTP client can be used.
+	"""
+
+	def __init__(
+			self,
+			fetch_func: Callable[[str], dict],
+			max_in_flight: int = 8,
+			rate_limiter: Optional[RateLimiter] = None,
+	):
+		"""
+		Args:
+			fetch_func (Callable[[str], dict]): Function fetching and parsing the details for one jobid.
+			max_in_flight (int, optional): Maximum number of concurrent fetches. Defaults to 8.
+			rate_limiter (RateLimiter, optional): Limiter to acquire before each fetch. Defaults to no limit.
+		"""
+
+		self.fetch_func = fetch_func
+		self.max_in_flight = max(1, int(max_in_flight))
+		self.rate_limiter = rate_limiter
+
+	def stream(self, jobids: Iterable[str], callback: Callable[[str, Optional[dict], Optional[Exception]], None]) -> None:
+		"""
+		Fetches every jobid, calling `callback(jobid, result, exception)` as each one finishes.
+
+		The callback is called from a worker thread. `jobids` is consumed lazily, on a thread of its own,
+			so it may be a generator that blocks waiting for input without stalling fetches already running.
+
+		Args:
+			jobids (Iterable[str]): Jobids to fetch.
+			callback (Callable): Called once per jobid with either the result or the exception raised.
+		"""
+
+		loop = asyncio.new_event_loop()
+		executor = ThreadPoolExecutor(max_workers=self.max_in_flight)
+		input_executor = ThreadPoolExecutor(max_workers=1)
+		try:
+			loop.run_until_complete(self._run(loop, executor, input_executor, iter(jobids), callback))
+		finally:
+			executor.shutdown(wait=True)
+			input_executor.shutdown(wait=True)
+			loop.close()
+
+	async def _run(self, loop, executor, input_executor, jobids, callback):
+		semaphore = asyncio.Semaphore(self.max_in_flight)
+		tasks = set()
+		while True:
+			await semaphore.acquire()
+			# Getting the next jobid can block, e.g. on a pipeline queue, which must not block the loop
+			jobid = await loop.run_in_executor(input_executor, next, jobids, _END)
+			if jobid is _END:
+				semaphore.release()
+				break
+			task = asyncio.ensure_future(self._fetch_one(loop, executor, semaphore, jobid, callback))
+			tasks.add(task)
+			task.add_done_callback(tasks.discard)
+		if tasks:
+			await asyncio.wait(tasks)
+
+	async def _fetch_one(self, loop, executor, semaphore, jobid, callback):
+		try:
+			if self.rate_limiter is not None:
+				await self.rate_limiter.acquire_async()
+			await loop.run_in_executor(executor, self._fetch_and_deliver, jobid, callback)
+		finally:
+			semaphore.release()
+
+	def _fetch_and_deliver(self, jobid, callback):
+		try:
+			result = self.fetch_func(jobid)
+		except Exception as e:
+			FETCHER_LOG.warn(f'Exception {type(e)} while fetching jobid {jobid}: {e}')
+			FETCHER_LOG.warn(e, exc_info=True)
+			callback(jobid, None, e)
+			return
+		callback(jobid, result, None)
@@ -0,0 +1,304 @@
+"""
+MinHash/LSH index of job descriptions, for finding near-duplicate listings.
+"""
+
+import fcntl
+import logging
+import os
+import re
+import threading
+import zlib
+
+import numpy as np
+
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+NEARDUP_LOG = logging.getLogger(__name__)
+
+DEFAULT_INDEX_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'db', 'neardup', 'descriptions.minhash')
+
+WORD_PATTERN = re.compile(r'\w+')
+
+# Multipliers combining consecutive word hashes into one shingle hash
+_SHINGLE_MULTIPLIERS = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93, 0xFF51AFD7ED558CCD, 0xC4CEB9FE1A85EC53, 0x94D049BB133111EB, 0xBF58476D1CE4E5B9], dtype=np.uint64)
+
+_HEADER_MAGIC = b'MHLSH001'
+
+
+def shingle_hashes(text: str, size: int = 5) -> np.ndarray:
+	"""
+	Hashes every run of `size` consecutive words in a text, ignoring case and punctuation.
+
+	Args:
+		text (str): Text to shingle.
+		size (int, optional): Words per shingle, at most 8. Defaults to 5.
+
+	Returns:
+		np.ndarray: Unique uint64 shingle hashes. Texts shorter than `size` words give one shingle,
+			and texts without words give none.
+	"""
+
+	words = WORD_PATTERN.findall((text or '').lower())
+	if not words:
+		return np.empty(0, dtype=np.uint64)
+	word_hashes = np.fromiter((zlib.crc32(word.encode('utf-8')) for word in words), dtype=np.uint64, count=len(words))
+	size = min(size, len(words))
+	count = len(words) - size + 1
+	shingles = np.zeros(count, dtype=np.uint64)
+	for offset in range(size):
+		# uint64 arithmetic wraps, which is what we want here
+		shingles += word_hashes[offset:offset + count] * _SHINGLE_MULTIPLIERS[offset]
+	return np.unique(shingles)
+
+
+def choose_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+	"""
+	Picks an LSH banding whose collision curve rises around `threshold`.
+		Two documents with Jaccard similarity s share at least one band with probability
+		1 - (1 - s^rows)^bands, which is steepest near (1 / bands)^(1 / rows).
+
+	Args:
+		threshold (float): Target Jaccard similarity, between 0 and 1.
+		num_perm (int): Length of the signatures.
+
+	Returns:
+		Tuple[int, int]: Number of bands and rows per band.
+	"""
+
+	best = None
+	for rows in range(1, num_perm + 1):
+		if num_perm % rows:
+			continue
+		bands = num_perm // rows
+		# Err towards the low side so few true matches are missed; candidates are verified anyway
+		midpoint = (1 / bands) ** (1 / rows)
+		distance = abs(midpoint - threshold) + (0.05 if midpoint > threshold else 0)
+		if best is None or distance < best[0]:
+			best = (distance, bands, rows)
+	return best[1], best[2]
+
+
+class MinHasher:
+	"""
+	Computes MinHash signatures of shingle sets with multiply-shift hash functions.
+	"""
+
+	def __init__(self, num_perm: int = 128, seed: int = 1):
+		"""
+		Args:
+			num_perm (int, optional): Number of hash functions, i.e. signature length. Defaults to 128.
+			seed (int, optional): Seed for the hash functions. Signatures are only comparable
+				between hashers with the same seed and num_perm. Defaults to 1.
+		"""
+
+		self.num_perm = num_perm
+		self.seed = seed
+		generator = np.random.RandomState(seed)
+		self.multipliers = generator.randint(1, 2 ** 63 - 1, size=num_perm, dtype=np.int64).astype(np.uint64) * np.uint64(2) + np.uint64(1)
+		self.offsets = generator.randint(0, 2 ** 63 - 1, size=num_perm, dtype=np.int64).astype(np.uint64)
+
+	def signature(self, shingles: np.ndarray) -> Optional[np.ndarray]:
+		"""
+		Args:
+			shingles (np.ndarray): uint64 shingle hashes, as from `shingle_hashes`.
+
+		Returns:
+			np.ndarray: uint32 signature of length num_perm, or None for an empty set.
+		"""
+
+		if not len(shingles):
+			return None
+		hashed = (shingles[:, None] * self.multipliers[None, :] + self.offsets[None, :]) >> np.uint64(32)
+		return hashed.min(axis=0).astype(np.uint32)
+
+
+def similarity(signature_a: np.ndarray, signature_b: np.ndarray) -> float:
+	"""
+	Estimates the Jaccard similarity of two shingle sets from their signatures.
+	"""
+
+	return float(np.mean(signature_a == signature_b))
+
+
+class NearDuplicateIndex:
+	"""
+	Thread-safe MinHash/LSH index of job description signatures.
+
+	Each signature is split into bands, and each band is hashed into a bucket,
+		so a query only compares against the jobs sharing a bucket with it
+		rather than scanning the corpus. Candidates are then checked against `threshold`
+		using their full signatures.
+
+	If `path` is given, signatures are kept in an append-only file there.
+		Opening the index loads the file, `refresh` loads records appended since,
+		for example by another process, and a partly written last record from a crash is ignored.
+		Appends hold an exclusive `flock` on the file, so several processes may add to it at once.
+	"""
+
+	def __init__(
+			self,
+			path: Optional[str] = None,
+			threshold: float = 0.8,
+			num_perm: int = 128,
+			shingle_size: int = 5,
+			seed: int = 1,
+	):
+		"""
+		Args:
+			path (str, optional): File the signatures are stored in. Defaults to keeping them in memory only.
+			threshold (float, optional): Estimated Jaccard similarity above which two descriptions
+				are near-duplicates. Defaults to 0.8.
+			num_perm (int, optional): Signature length. Defaults to 128.
+			shingle_size (int, optional): Words per shingle. Defaults to 5.
+			seed (int, optional): Hash function seed. Defaults to 1.
+
+		Raises:
+			ValueError: If the file at `path` was written with a different num_perm or seed.
+		"""
+
+		self.path = path
+		self.threshold = threshold
+		self.shingle_size = shingle_size
+		self.hasher = MinHasher(num_perm=num_perm, seed=seed)
+		self.bands, self.rows = choose_bands(threshold, num_perm)
+		self.record_dtype = np.dtype([('job_id', '<i8'), ('signature', '<u4', (num_perm,))])
+		self.header = _HEADER_MAGIC + np.array([num_perm, seed], dtype='<i8').tobytes()
+		self.buckets = [defaultdict(list) for _ in range(self.bands)]
+		self.signatures = {}
+		self._offset = 0
+		self._lock = threading.Lock()
+		if self.path is not None:
+			self.refresh()
+
+	def __len__(self) -> int:
+		return len(self.signatures)
+
+	def signature(self, text: str) -> Optional[np.ndarray]:
+		"""
+		Computes the signature of a description, or None if it has no words.
+		"""
+
+		return self.hasher.signature(shingle_hashes(text, self.shingle_size))
+
+	def band_keys(self, signature: np.ndarray) -> List[bytes]:
+		return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+	def query(self, signature: Optional[np.ndarray], exclude: Optional[int] = None) -> List[Tuple[int, float]]:
+		"""
+		Finds indexed jobs similar to a signature.
+
+		Args:
+			signature (np.ndarray): Signature to look up. None matches nothing.
+			exclude (int, optional): Job id to leave out of the results.
+
+		Returns:
+			List[Tuple[int, float]]: (job id, estimated similarity) pairs at or above the threshold, most similar first.
+		"""
+
+		if signature is None:
+			return []
+		with self._lock:
+			candidates = set()
+			for bucket, key in zip(self.buckets, self.band_keys(signature)):
+				candidates.update(bucket.get(key, ()))
+			candidates.discard(exclude)
+			matches = [(job_id, similarity(signature, self.signatures[job_id])) for job_id in candidates]
+		matches = [(job_id, score) for job_id, score in matches if score >= self.threshold]
+		matches.sort(key=lambda match: (-match[1], match[0]))
+		return matches
+
+	def add(self, job_id: int, signature: Optional[np.ndarray]) -> None:
+		"""
+		Indexes and stores one signature. Jobs already indexed, and empty signatures, are skipped.
+		"""
+
+		self.add_many([(job_id, signature)])
+
+	def add_many(self, items: Iterable[Tuple[int, Optional[np.ndarray]]]) -> int:
+		"""
+		Indexes and stores many signatures, appending them to the file in one write.
+
+		Returns:
+			int: Number of signatures added.
+		"""
+
+		with self._lock:
+			records = []
+			for job_id, signature in items:
+				if signature is None or job_id in self.signatures:
+					continue
+				self._insert(int(job_id), signature)
+				records.append((int(job_id), signature))
+			if records and self.path is not None:
+				self._append(np.array(records, dtype=self.record_dtype))
+		return len(records)
+
+	def refresh(self) -> int:
+		"""
+		Loads records appended to the file since it was last read.
+
+		Returns:
+			int: Number of signatures loaded.
+		"""
+
+		if self.path is None or not os.path.exists(self.path):
+			return 0
+		with self._lock:
+			with open(self.path, 'rb') as f:
+				if self._offset == 0:
+					self._check_header(f.read(len(self.header)))
+					self._offset = len(self.header)
+				f.seek(self._offset)
+				data = f.read()
+			count = len(data) // self.record_dtype.itemsize
+			records = np.frombuffer(data, dtype=self.record_dtype, count=count)
+			for job_id, signature in zip(records['job_id'].tolist(), records['signature']):
+				if job_id not in self.signatures:
+					self._insert(job_id, signature)
+			self._offset += count * self.record_dtype.itemsize
+		if count:
+			NEARDUP_LOG.info(f'Loaded {count} signatures from {self.path}, {len(self.signatures)} indexed.')
+		return count
+
+	def _check_header(self, header: bytes) -> None:
+		if header != self.header:
+			raise ValueError(f'{self.path} was not written by an index with num_perm={self.hasher.num_perm}, seed={self.hasher.seed}')
+
+	def _insert(self, job_id: int, signature: np.ndarray) -> None:
+		signature = np.array(signature, dtype=np.uint32)
+		self.signatures[job_id] = signature
+		for bucket, key in zip(self.buckets, self.band_keys(signature)):
+			bucket[key].append(job_id)
+
+	def _append(self, records: np.ndarray) -> None:
+		os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+		with open(self.path, 'ab') as f:
+			# Other processes may append to the file too, so the end of it is only known once it is locked.
+			# The lock is released when the file is closed
+			fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+			end = f.seek(0, os.SEEK_END)
+			if end == 0:
+				f.write(self.header)
+				self._offset = len(self.header)
+			else:
+				# Drop a partial record left by an interrupted write before appending after it
+				complete = len(self.header) + (end - len(self.header)) // self.record_dtype.itemsize * self.record_dtype.itemsize
+				if complete != end:
+					f.truncate(complete)
+			f.write(records.tobytes())
+			f.flush()
+			os.fsync(f.fileno())
+			if self._offset + records.nbytes == f.tell():
+				self._offset += records.nbytes
+
+	def stats(self) -> Dict[str, float]:
+		with self._lock:
+			bucket_count = sum(len(bucket) for bucket in self.buckets)
+			return {
+				'indexed': len(self.signatures),
+				'bands': self.bands,
+				'rows': self.rows,
+				'threshold': self.threshold,
+				'mean_bucket_size': round(len(self.signatures) * self.bands / bucket_count, 3) if bucket_count else 0.0,
+			}
@@ -0,0 +1,120 @@
+"""
+HTML to text conversion for job and company descriptions.
+"""
+
+import hashlib
+import logging
+import re
+import threading
+
+import html2text
+
+from concurrent.futures import ProcessPoolExecutor
+from datafunctions.retrieve.cache import LRUCache
+
+NORMALIZE_LOG = logging.getLogger(__name__)
+
+NEWLINES_PATTERN = re.compile(r'\n+')
+BLANK_LINES_PATTERN = re.compile(r'\n\n(\s+\n)+')
+
+_local = threading.local()
+
+
+def _get_converter() -> html2text.HTML2Text:
+	# HTML2Text keeps parser state, so each thread (and process) gets its own
+	converter = getattr(_local, 'converter', None)
+	if converter is None:
+		converter = html2text.HTML2Text()
+		# converter.ignore_links = True
+		# converter.ignore_images = True
+		# converter.ignore_emphasis = True
+		# converter.ignore_anchors = True
+		converter.body_width = 0
+		_local.converter = converter
+	return converter
+
+
+def html_to_text(html: str) -> str:
+	"""
+	Converts description HTML to markdown-ish text with single blank lines between paragraphs.
+
+	Args:
+		html (str): Description HTML. Bare newlines are treated as line breaks.
+
+	Returns:
+		str: The stripped text.
+	"""
+
+	text = _get_converter().handle((html or '').replace('\n', '<br />'))
+	return BLANK_LINES_PATTERN.sub('\n\n', NEWLINES_PATTERN.sub('\n\n', text)).strip()
+
+
+class DescriptionNormalizer:
+	"""
+	Converts job and company descriptions to text.
+
+	Company descriptions repeat across thousands of jobs, so their conversions are memoized
+		by a hash of the HTML in a bounded LRUCache.
+		If `processes` is set, large documents are converted in a process pool,
+		taking the CPU work off the scraper's threads. Each call waits for its conversion,
+		so callers need at least `processes` threads to keep the pool busy.
+	"""
+
+	def __init__(self, company_cache_size: int = 5000, processes: int = 0, offload_min_length: int = 2000):
+		"""
+		Args:
+			company_cache_size (int, optional): Maximum company descriptions memoized. Defaults to 5000.
+			processes (int, optional): Size of the conversion process pool. Defaults to 0, converting in-thread.
+			offload_min_length (int, optional): Minimum HTML length sent to the pool by `normalize`. Defaults to 2000.
+		"""
+
+		self.company_cache = LRUCache(company_cache_size)
+		self.processes = processes
+		self.offload_min_length = offload_min_length
+		self._pool = None
+		self._pool_lock = threading.Lock()
+
+	@property
+	def pool(self) -> ProcessPoolExecutor:
+		with self._pool_lock:
+			if self._pool is None:
+				NORMALIZE_LOG.info(f'Starting conversion pool with {self.processes} processes...')
+				self._pool = ProcessPoolExecutor(max_workers=self.processes)
+			return self._pool
+
+	def normalize(self, html: str) -> str:
+		"""
+		Converts one job description to text.
+		"""
+
+		if self.processes and len(html or '') >= self.offload_min_length:
+			return self.pool.submit(html_to_text, html).result()
+		return html_to_text(html)
+
+	def normalize_company(self, html: str) -> str:
+		"""
+		Converts one company description to text, reusing earlier conversions of the same HTML.
+		"""
+
+		key = hashlib.sha1((html or '').encode('utf-8')).digest()
+		text = self.company_cache.get(key)
+		if text is None:
+			text = self.normalize(html)
+			self.company_cache.put(key, text)
+		return text
+
+	def stats(self) -> dict:
+		return {
+			'company_cache': self.company_cache.stats(),
+			'processes': self.processes,
+		}
+
+	def close(self) -> None:
+		"""
+		Shuts down the process pool, if one was started.
+		"""
+
+		with self._pool_lock:
+			if self._pool is not None:
+				self._pool.shutdown(wait=True)
+				self._pool = None
@@ -0,0 +1,791 @@
+"""
+Batched persistence of scraped job results.
+"""
+
+import logging
+
+import numpy as np
+
+from psycopg2.extras import execute_values
+from typing import Callable, Dict, List, Optional, Tuple
+
+from datafunctions.retrieve.cache import DimensionCache
+from datafunctions.retrieve.dedup import DedupView
+from datafunctions.retrieve.neardup import NearDuplicateIndex, similarity
+from datafunctions.utils import content_fingerprint
+
+PERSIST_LOG = logging.getLogger(__name__)
+
+# Seconds a persister waits for another to finish adding a company or location it also needs
+CLAIM_TIMEOUT_SECONDS = 60.0
+
+
+class BatchPersister:
+	"""
+	Buffers job results and saves them to the database a batch at a time.
+
+	Each result is a dict shaped like `MonsterScraper.get_details_json` returns.
+		Companies and locations are resolved with set-based queries, rows are inserted with
+		multi-row `execute_values`, and each batch is committed (or rolled back) as one transaction.
+
+	A job is considered already stored if a listing exists with the same apply link,
+		the same title at the same company, or the same content fingerprint
+		(see `utils.content_fingerprint`), which is stored alongside each description.
+		Results matching an earlier result in the same batch are skipped the same way.
+
+	Results carrying `source` and `source_id` keys have that id recorded in job_source_ids
+		against the job they were saved as, or matched to, so later runs can skip them early.
+		A `source_id` without a `source` is ignored (see `source_key`).
+
+	If a DedupView is given, new jobs are claimed in it before they are inserted,
+		so persisters on other connections never insert the same job concurrently.
+		New companies and locations are claimed the same way, and a persister that finds one claimed
+		waits for the other to commit, then selects it rather than adding it again.
+		The claims are released once the batch is committed or rolled back.
+
+	If a DimensionCache is given, cached companies and locations are not queried,
+		and the cache is updated with the batch's ids once the batch is committed.
+
+	If a NearDuplicateIndex is given, new results whose description is a near-duplicate
+		of a stored one, or of an earlier result in the batch, are either merged into that job
+		like an exact duplicate, or saved and tagged in job_duplicates, depending on `near_duplicate_action`.
+		Saved descriptions are added to the index once the batch is committed.
+	"""
+
+	near_duplicate_actions = ('tag', 'merge')
+
+	companies_select_query = """
+		SELECT DISTINCT ON (name) name, id, description IS NOT NULL
+		FROM companies
+		WHERE name = ANY(%(names)s)
+		ORDER BY name, description IS NULL, id;
+	"""
+
+	companies_insert_query = """
+		INSERT INTO companies(name, description, logo_url)
+		VALUES %s
+		RETURNING name, id;
+	"""
+
+	companies_update_query = """
+		UPDATE companies
+		SET logo_url = v.logo_url,
+			description = v.description
+		FROM (VALUES %s) AS v(id, description, logo_url)
+		WHERE companies.id = v.id;
+	"""
+
+	locations_select_query = """
+		SELECT DISTINCT ON (locations.city, locations.state_province)
+			locations.city, locations.state_province, locations.id
+		FROM locations
+		INNER JOIN (VALUES %s) AS v(city, state_province)
+		ON locations.city = v.city
+			AND locations.state_province = v.state_province
+		ORDER BY locations.city, locations.state_province, locations.id;
+	"""
+
+	locations_insert_query = """
+		INSERT INTO locations(city, state_province, country)
+		VALUES %s
+		RETURNING city, state_province, id;
+	"""
+
+	# Link matches take precedence over title/company matches, which take precedence over
+	# fingerprint matches, as in the original per-job checks.
+	jobs_exist_query = """
+		SELECT v.idx, COALESCE(
+			(
+				SELECT job_links.job_id
+				FROM job_links
+				WHERE job_links.external_url = v.external_url
+				LIMIT 1
+			),
+			(
+				SELECT job_listings.id
+				FROM job_listings
+				INNER JOIN job_companies
+				ON job_companies.job_id = job_listings.id
+				INNER JOIN companies
+				ON job_companies.company_id = companies.id
+				WHERE job_listings.title = v.title
+					AND companies.name = v.company_name
+				LIMIT 1
+			),
+			(
+				SELECT job_descriptions.job_id
+				FROM job_descriptions
+				WHERE job_descriptions.fingerprint = v.fingerprint
+				LIMIT 1
+			)
+		)
+		FROM (VALUES %s) AS v(idx, title, fingerprint, company_name, external_url);
+	"""
+
+	job_listings_query = """
+		INSERT INTO job_listings(title, post_date_utc)
+		VALUES %s
+		RETURNING id;
+	"""
+
+	job_descriptions_query = """
+		INSERT INTO job_descriptions(job_id, description, fingerprint)
+		VALUES %s;
+	"""
+
+	job_links_query = """
+		INSERT INTO job_links(job_id, external_url)
+		VALUES %s;
+	"""
+
+	job_companies_query = """
+		INSERT INTO job_companies(job_id, company_id)
+		VALUES %s;
+	"""
+
+	job_locations_query = """
+		INSERT INTO job_locations(job_id, location_id)
+		VALUES %s;
+	"""
+
+	job_source_ids_query = """
+		INSERT INTO job_source_ids(job_id, source, source_id)
+		VALUES %s
+		ON CONFLICT (source, source_id) DO NOTHING;
+	"""
+
+	existing_job_ids_query = """
+		SELECT id
+		FROM job_listings
+		WHERE id = ANY(%(job_ids)s);
+	"""
+
+	job_duplicates_query = """
+		INSERT INTO job_duplicates(job_id, duplicate_of, similarity)
+		VALUES %s
+		ON CONFLICT (job_id) DO NOTHING;
+	"""
+
+	known_source_ids_query = """
+		SELECT source_id
+		FROM job_source_ids
+		WHERE source = %(source)s
+			AND source_id = ANY(%(source_ids)s);
+	"""
+
+	def __init__(
+			self,
+			db_conn,
+			batch_size: int = 50,
+			dimension_cache: Optional[DimensionCache] = None,
+			dedup_view: Optional[DedupView] = None,
+			near_duplicates: Optional[NearDuplicateIndex] = None,
+			near_duplicate_action: str = 'tag',
+			on_commit: Optional[Callable[[List[dict]], None]] = None,
+	):
+		"""
+		Args:
+			db_conn: Connection to the database.
+			batch_size (int, optional): Number of results buffered before they are saved. Defaults to 50.
+			dimension_cache (DimensionCache, optional): Cache of company and location ids.
+			dedup_view (DedupView, optional): Claims shared with persisters on other connections.
+			near_duplicates (NearDuplicateIndex, optional): Index of stored descriptions to check new results against.
+			near_duplicate_action (str, optional): 'tag' to save near-duplicates and record them in job_duplicates,
+				or 'merge' to treat them as the job they duplicate. Defaults to 'tag'.
+			on_commit (Callable, optional): Called once a batch has been committed, with its results
+				that were inserted or matched to a stored job. Results skipped because another persister
+				had claimed them are left out, as their job may yet be rolled back.
+
+		Raises:
+			ValueError: If near_duplicate_action is not a known action.
+		"""
+
+		if near_duplicate_action not in self.near_duplicate_actions:
+			raise ValueError(f'Unknown near_duplicate_action: {near_duplicate_action}')
+		self.db_conn = db_conn
+		self.batch_size = max(1, int(batch_size))
+		self.dimension_cache = dimension_cache
+		self.dedup_view = dedup_view
+		self.near_duplicates = near_duplicates
+		self.near_duplicate_action = near_duplicate_action
+		self.on_commit = on_commit
+		self.buffer = []
+		self.rows_added = 0
+		self.rows_failed = 0
+		self._pending_companies = {}
+		self._pending_locations = {}
+		self._claimed_keys = []
+		self._pending_signatures = []
+
+	def add(self, result: dict) -> None:
+		"""
+		Buffers a result, saving the buffer once it is full.
+		"""
+
+		self.buffer.append(result)
+		if len(self.buffer) >= self.batch_size:
+			self.flush()
+
+	def flush(self) -> int:
+		"""
+		Saves and clears the buffer.
+
+		Returns:
+			int: Number of new job listings added.
+		"""
+
+		if not self.buffer:
+			return 0
+		results = self.buffer
+		self.buffer = []
+		return self.save_batch(results)
+
+	def save_batch(self, results: List[dict]) -> int:
+		"""
+		Saves a batch of results in one transaction.
+			On failure, only this batch is rolled back, and its results are counted in `rows_failed`.
+
+		Args:
+			results (List[dict]): Results to save.
+
+		Returns:
+			int: Number of new job listings added.
+		"""
+
+		PERSIST_LOG.info(f'Saving batch of {len(results)} results...')
+		batch_size = len(results)
+		curr = None
+		self._pending_companies = {}
+		self._pending_locations = {}
+		self._claimed_keys = []
+		self._pending_signatures = []
+		try:
+			curr = self.db_conn.cursor()
+
+			results, duplicates = self.deduplicate_batch(results)
+			company_ids = self.resolve_companies(curr, results)
+			location_ids = self.resolve_locations(curr, results)
+			job_ids = self.find_existing_jobs(curr, results)
+			new_indices = [index for index in range(len(results)) if index not in job_ids]
+			signatures, stored_matches, batch_matches = self.find_near_duplicates(curr, results, new_indices)
+			if self.near_duplicate_action == 'merge':
+				job_ids.update({index: job_id for index, (job_id, _) in stored_matches.items()})
+				duplicates.extend((kept_index, results[index]) for index, (kept_index, _) in batch_matches.items())
+				new_indices = [index for index in new_indices if index not in stored_matches and index not in batch_matches]
+			new_indices = self.claim_new_jobs(results, new_indices)
+			new_results = [results[index] for index in new_indices]
+			PERSIST_LOG.info(f'{len(results) - len(new_results)} results already stored, adding {len(new_results)}...')
+			if new_results:
+				new_job_ids = self.insert_jobs(curr, new_results, company_ids, location_ids)
+				job_ids.update(zip(new_indices, new_job_ids))
+				self._pending_signatures = [(job_ids[index], signatures.get(index)) for index in new_indices]
+			if self.near_duplicate_action == 'tag':
+				self.tag_near_duplicates(curr, job_ids, new_indices, stored_matches, batch_matches)
+			# Results claimed by another scraper have no job id yet, so their source ids are left for a later run
+			saved = (
+				[(job_ids[index], result) for index, result in enumerate(results) if index in job_ids]
+				+ [(job_ids[index], result) for index, result in duplicates if index in job_ids]
+			)
+			self.insert_source_ids(curr, saved)
+
+			curr.close()
+			PERSIST_LOG.info('Committing changes...')
+			self.db_conn.commit()
+			PERSIST_LOG.info('Saved batch.')
+			# The committed rows now keep other persisters from adding these jobs again
+			if self.dedup_view is not None:
+				self.dedup_view.release(self._claimed_keys)
+			self.update_cache()
+			self.update_near_duplicates()
+
+		except Exception as e:
+			PERSIST_LOG.warn(f'Exception {type(e)} while saving batch: {e}')
+			PERSIST_LOG.warn(e, exc_info=True)
+
+			PERSIST_LOG.info('Attempting to close cursor...')
+			try:
+				if curr is not None:
+					curr.close()
+			except Exception as e2:
+				PERSIST_LOG.warn(f'Exception {type(e2)} while closing cursor, skipping: {e2}')
+
+			PERSIST_LOG.info('Attempting to rollback transaction...')
+			try:
+				self.db_conn.rollback()
+			except Exception as e2:
+				PERSIST_LOG.warn(f'Exception {type(e2)} while rolling back, skipping: {e2}')
+			if self.dedup_view is not None:
+				self.dedup_view.release(self._claimed_keys)
+			self.rows_failed += batch_size
+			return 0
+
+		self.rows_added += len(new_results)
+		if self.on_commit is not None:
+			self.on_commit([result for _, result in saved])
+		return len(new_results)
+
+	@staticmethod
+	def fingerprint(result: dict) -> str:
+		"""
+		Gets the result's content fingerprint, computing it on first use.
+		"""
+
+		if 'fingerprint' not in result:
+			result['fingerprint'] = content_fingerprint(result['title'], result['description'])
+		return result['fingerprint']
+
+	@staticmethod
+	def dedup_keys(result: dict) -> List[tuple]:
+		"""
+		Keys under which two results count as the same job.
+		"""
+
+		keys = [
+			('fingerprint', BatchPersister.fingerprint(result)),
+			('title_company', result['title'], result['company_name']),
+		]
+		if result['inner_link'] is not None:
+			keys.append(('link', result['inner_link']))
+		return keys
+
+	@staticmethod
+	def source_key(result: dict) -> Optional[Tuple[str, str]]:
+		"""
+		The (source, source id) a result is recorded under in job_source_ids,
+			or None if it lacks either, as a source id means nothing without the site it is from.
+		"""
+
+		if result.get('source') is None or result.get('source_id') is None:
+			return None
+		return (result['source'], str(result['source_id']))
+
+	def deduplicate_batch(self, results: List[dict]) -> Tuple[List[dict], List[Tuple[int, dict]]]:
+		"""
+		Drops results that match an earlier result in the same batch.
+
+		Returns:
+			List[dict]: The remaining results.
+			List[Tuple[int, dict]]: Each dropped result, with the index of the remaining result it matched.
+		"""
+
+		seen = {}
+		deduplicated = []
+		duplicates = []
+		for result in results:
+			keys = self.dedup_keys(result)
+			matches = [seen[key] for key in keys if key in seen]
+			if matches:
+				PERSIST_LOG.info(f'Job listing for {result["title"]} duplicated within batch, skipping.')
+				duplicates.append((matches[0], result))
+				continue
+			for key in keys:
+				seen[key] = len(deduplicated)
+			deduplicated.append(result)
+		return deduplicated, duplicates
+
+	def find_near_duplicates(
+			self,
+			curr,
+			results: List[dict],
+			indices: List[int],
+	) -> Tuple[Dict[int, np.ndarray], Dict[int, Tuple[int, float]], Dict[int, Tuple[int, float]]]:
+		"""
+		Looks up near-duplicates of the results at `indices`, which are not stored yet.
+			Matches in the index are only used if the job still exists in the database.
+
+		Returns:
+			Dict[int, np.ndarray]: Dict of index: description signature.
+			Dict[int, Tuple[int, float]]: Dict of index: (stored job id, similarity) for the best stored match.
+			Dict[int, Tuple[int, float]]: Dict of index: (earlier index, similarity) for results
+				matching an earlier result in the batch instead.
+		"""
+
+		if self.near_duplicates is None or not indices:
+			return {}, {}, {}
+
+		signatures = {}
+		for index in indices:
+			signature = self.near_duplicates.signature(results[index]['description'])
+			if signature is not None:
+				signatures[index] = signature
+		candidates = {index: self.near_duplicates.query(signature) for index, signature in signatures.items()}
+
+		candidate_job_ids = sorted({job_id for matches in candidates.values() for job_id, _ in matches})
+		existing = set()
+		if candidate_job_ids:
+			curr.execute(self.existing_job_ids_query, {'job_ids': candidate_job_ids})
+			existing = {row[0] for row in curr.fetchall()}
+
+		stored_matches = {}
+		batch_matches = {}
+		kept = []
+		for index in indices:
+			if index not in signatures:
+				continue
+			matches = [match for match in candidates[index] if match[0] in existing]
+			if matches:
+				stored_matches[index] = matches[0]
+				continue
+			scores = [(similarity(signatures[index], signatures[earlier]), earlier) for earlier in kept]
+			best = max(scores, default=None)
+			if best is not None and best[0] >= self.near_duplicates.threshold:
+				batch_matches[index] = (best[1], best[0])
+				continue
+			kept.append(index)
+
+		if stored_matches or batch_matches:
+			PERSIST_LOG.info(f'{len(stored_matches) + len(batch_matches)} results are near-duplicates, action: {self.near_duplicate_action}')
+		return signatures, stored_matches, batch_matches
+
+	def tag_near_duplicates(
+			self,
+			curr,
+			job_ids: Dict[int, int],
+			new_indices: List[int],
+			stored_matches: Dict[int, Tuple[int, float]],
+			batch_matches: Dict[int, Tuple[int, float]],
+	) -> None:
+		"""
+		Records which newly inserted jobs are near-duplicates, and of which job.
+		"""
+
+		rows = []
+		for index in new_indices:
+			if index in stored_matches:
+				duplicate_of, score = stored_matches[index]
+			elif index in batch_matches and batch_matches[index][0] in job_ids:
+				duplicate_of, score = job_ids[batch_matches[index][0]], batch_matches[index][1]
+			else:
+				continue
+			rows.append((job_ids[index], duplicate_of, score))
+		if rows:
+			execute_values(curr, self.job_duplicates_query, rows)
+
+	def claim_new_jobs(self, results: List[dict], new_indices: List[int]) -> List[int]:
+		"""
+		Claims new results in the shared dedup view, dropping any another persister has claimed.
+
+		Returns:
+			List[int]: The indices that were claimed.
+		"""
+
+		if self.dedup_view is None:
+			return new_indices
+		claimed = []
+		for index in new_indices:
+			keys = self.dedup_keys(results[index])
+			if self.dedup_view.claim(keys):
+				self._claimed_keys.extend(keys)
+				claimed.append(index)
+			else:
+				PERSIST_LOG.info(f'Job listing for {results[index]["title"]} claimed by another scraper, skipping.')
+		return claimed
+
+	def resolve_companies(self, curr, results: List[dict]) -> Dict[str, int]:
+		"""
+		Gets the id of every company in `results`, adding missing companies
+			and filling in the description and logo of incomplete ones.
+
+		Returns:
+			Dict[str, int]: Dict of company name: company id
+		"""
+
+		first_results = {}
+		for result in results:
+			first_results.setdefault(result['company_name'], result)
+
+		company_ids = {}
+		unpopulated = []
+		uncached = []
+		for name in first_results:
+			cached = self.dimension_cache.get_company(name) if self.dimension_cache is not None else None
+			if cached is None:
+				uncached.append(name)
+				continue
+			company_id, populated = cached
+			company_ids[name] = company_id
+			if not populated:
+				unpopulated.append(company_id)
+
+		if uncached:
+			self.select_companies(curr, uncached, company_ids, unpopulated)
+
+		missing = [name for name in first_results if name not in company_ids]
+		while missing and not self.claim_dimensions([('company', name) for name in missing]):
+			self.select_companies(curr, missing, company_ids, unpopulated)
+			missing = [name for name in missing if name not in company_ids]
+
+		if unpopulated:
+			names = {company_id: name for name, company_id in company_ids.items()}
+			execute_values(
+				curr,
+				self.companies_update_query,
+				[
+					(
+						company_id,
+						first_results[names[company_id]]['company_description'],
+						first_results[names[company_id]]['company_logo_url'],
+					)
+					for company_id in unpopulated
+				],
+				template='(%s::integer, %s::text, %s::text)',
+			)
+
+		if missing:
+			PERSIST_LOG.info(f'Adding {len(missing)} companies...')
+			inserted = execute_values(
+				curr,
+				self.companies_insert_query,
+				[
+					(
+						name,
+						first_results[name]['company_description'],
+						first_results[name]['company_logo_url'],
+					)
+					for name in missing
+				],
+				fetch=True,
+			)
+			company_ids.update(dict(inserted))
+
+		# Every company is populated once this batch commits
+		self._pending_companies = company_ids
+		return company_ids
+
+	def select_companies(self, curr, names: List[str], company_ids: Dict[str, int], unpopulated: List[int]) -> None:
+		"""
+		Looks up stored companies by name, adding their ids to `company_ids`,
+			and the ids of those without a description to `unpopulated`.
+		"""
+
+		curr.execute(self.companies_select_query, {'names': names})
+		for name, company_id, populated in curr.fetchall():
+			company_ids[name] = company_id
+			if not populated:
+				unpopulated.append(company_id)
+				PERSIST_LOG.info(f'Company {name} not complete in DB, populating...')
+
+	def resolve_locations(self, curr, results: List[dict]) -> Dict[Tuple[str, str], int]:
+		"""
+		Gets the id of every location in `results`, adding missing locations.
+
+		Returns:
+			Dict[Tuple[str, str], int]: Dict of (city, state_province): location id
+		"""
+
+		countries = {}
+		for result in results:
+			countries.setdefault((result['city'], result['state_province']), result['country'])
+
+		location_ids = {}
+		if self.dimension_cache is not None:
+			for city, state_province in countries:
+				location_id = self.dimension_cache.get_location(city, state_province)
+				if location_id is not None:
+					location_ids[(city, state_province)] = location_id
+
+		uncached = [key for key in countries if key not in location_ids]
+		if uncached:
+			self.select_locations(curr, uncached, location_ids)
+
+		missing = [key for key in countries if key not in location_ids]
+		while missing and not self.claim_dimensions([('location',) + key for key in missing]):
+			self.select_locations(curr, missing, location_ids)
+			missing = [key for key in missing if key not in location_ids]
+
+		if missing:
+			PERSIST_LOG.info(f'Adding {len(missing)} locations...')
+			inserted = execute_values(
+				curr,
+				self.locations_insert_query,
+				[(city, state_province, countries[(city, state_province)]) for city, state_province in missing],
+				fetch=True,
+			)
+			location_ids.update({(city, state_province): location_id for city, state_province, location_id in inserted})
+
+		self._pending_locations = location_ids
+		return location_ids
+
+	def select_locations(self, curr, keys: List[Tuple[str, str]], location_ids: Dict[Tuple[str, str], int]) -> None:
+		"""
+		Looks up stored locations by (city, state_province), adding their ids to `location_ids`.
+		"""
+
+		found = execute_values(
+			curr,
+			self.locations_select_query,
+			keys,
+			template='(%s::text, %s::text)',
+			page_size=len(keys),
+			fetch=True,
+		)
+		location_ids.update({(city, state_province): location_id for city, state_province, location_id in found})
+
+	def claim_dimensions(self, keys: List[tuple]) -> bool:
+		"""
+		Claims the keys of the companies or locations a batch is about to add, all of them or none,
+			so two persisters never add the same one.
+			If another persister holds any of them, waits for it to commit or roll back instead.
+			All or none means a persister never waits while holding keys another is waiting for.
+
+		Raises:
+			TimeoutError: If the keys were not released within CLAIM_TIMEOUT_SECONDS.
+
+		Returns:
+			bool: True if the keys were claimed, or there is no DedupView.
+				False once the other persister is done, when they should be looked up again.
+		"""
+
+		if self.dedup_view is None:
+			return True
+		if self.dedup_view.claim(keys):
+			self._claimed_keys.extend(keys)
+			return True
+		PERSIST_LOG.info('Another scraper is adding some of the same companies or locations, waiting for it...')
+		if not self.dedup_view.wait_released(keys, CLAIM_TIMEOUT_SECONDS):
+			raise TimeoutError(f'Companies or locations still claimed by another scraper after {CLAIM_TIMEOUT_SECONDS} seconds.')
+		return False
+
+	def insert_source_ids(self, curr, saved: List[Tuple[int, dict]]) -> None:
+		"""
+		Records the source ids of saved results.
+
+		Args:
+			curr: Cursor to execute with.
+			saved (List[Tuple[int, dict]]): Pairs of job id and the result saved as, or matched to, that job.
+		"""
+
+		rows = [
+			(job_id,) + self.source_key(result)
+			for job_id, result in saved
+			if self.source_key(result) is not None
+		]
+		if rows:
+			execute_values(curr, self.job_source_ids_query, rows)
+
+	def find_known_source_ids(self, source: str, source_ids: List[str]) -> set:
+		"""
+		Finds which source ids are already recorded, in one query.
+
+		Args:
+			source (str): Name of the site the ids come from.
+			source_ids (List[str]): Ids to check.
+
+		Returns:
+			set: The subset of `source_ids` already stored.
+		"""
+
+		if not source_ids:
+			return set()
+		curr = self.db_conn.cursor()
+		try:
+			curr.execute(
+				self.known_source_ids_query,
+				{
+					'source': source,
+					'source_ids': [str(source_id) for source_id in source_ids],
+				}
+			)
+			known = {row[0] for row in curr.fetchall()}
+			self.db_conn.commit()
+		finally:
+			curr.close()
+		return known
+
+	def update_cache(self) -> None:
+		"""
+		Records the ids resolved by the last committed batch in the dimension cache.
+		"""
+
+		if self.dimension_cache is None:
+			return
+		for name, company_id in self._pending_companies.items():
+			self.dimension_cache.put_company(name, company_id, True)
+		for (city, state_province), location_id in self._pending_locations.items():
+			self.dimension_cache.put_location(city, state_province, location_id)
+
+	def update_near_duplicates(self) -> None:
+		"""
+		Adds the descriptions saved by the last committed batch to the near-duplicate index.
+		"""
+
+		if self.near_duplicates is None or not self._pending_signatures:
+			return
+		try:
+			self.near_duplicates.add_many(self._pending_signatures)
+		except Exception as e:
+			# The jobs are saved; they can be indexed later with run_maintenance.py index-near-duplicates
+			PERSIST_LOG.warn(f'Exception {type(e)} while updating near-duplicate index: {e}')
+			PERSIST_LOG.warn(e, exc_info=True)
+		self._pending_signatures = []
+
+	def find_existing_jobs(self, curr, results: List[dict]) -> Dict[int, int]:
+		"""
+		Finds which results are already stored.
+
+		Returns:
+			Dict[int, int]: Dict of index into `results`: existing job id
+		"""
+
+		found = execute_values(
+			curr,
+			self.jobs_exist_query,
+			[
+				(index, result['title'], self.fingerprint(result), result['company_name'], result['inner_link'])
+				for index, result in enumerate(results)
+			],
+			template='(%s::integer, %s::text, %s::char(40), %s::text, %s::text)',
+			page_size=len(results),
+			fetch=True,
+		)
+		return {index: job_id for index, job_id in found if job_id is not None}
+
+	def insert_jobs(self, curr, results: List[dict], company_ids: Dict[str, int], location_ids: Dict[Tuple[str, str], int]) -> List[int]:
+		"""
+		Inserts new job listings and their descriptions, links, companies and locations.
+
+		Returns:
+			List[int]: The new job ids, in the same order as `results`.
+		"""
+
+		# A single multi-row INSERT ... RETURNING gives ids back in VALUES order,
+		# so page_size must cover the whole batch.
+		job_ids = [
+			row[0] for row in execute_values(
+				curr,
+				self.job_listings_query,
+				[(result['title'], result['timestamp']) for result in results],
+				template='(%s, to_timestamp(%s))',
+				page_size=len(results),
+				fetch=True,
+			)
+		]
+
+		execute_values(
+			curr,
+			self.job_companies_query,
+			[(job_id, company_ids[result['company_name']]) for job_id, result in zip(job_ids, results)],
+		)
+		execute_values(
+			curr,
+			self.job_locations_query,
+			[(job_id, location_ids[(result['city'], result['state_province'])]) for job_id, result in zip(job_ids, results)],
+		)
+		execute_values(
+			curr,
+			self.job_descriptions_query,
+			[(job_id, result['description'], self.fingerprint(result)) for job_id, result in zip(job_ids, results)],
+		)
+		execute_values(
+			curr,
+			self.job_links_query,
+			[(job_id, result['inner_link']) for job_id, result in zip(job_ids, results)],
+		)
+
+		return job_ids
+
+	def __enter__(self):
+		return (self)
+
+	def __exit__(self, exc_type, exc_value, tb):
+		self.flush()
@@ -0,0 +1,221 @@
+"""
+Staged, bounded-queue processing pipelines.
+"""
+
+import logging
+import queue
+import threading
+import time
+
+from collections import deque
+from typing import Callable, Iterable, Iterator, List, Optional
+
+PIPELINE_LOG = logging.getLogger(__name__)
+
+_DONE = object()  # Sentinel telling a stage worker its input is exhausted
+
+
+class Stage:
+	"""
+	One step of a Pipeline.
+
+	A stage either maps items with `func` on `workers` threads, or hands its whole input
+		iterator to `stream(items, emit)`, which calls `emit(result)` for each output
+		and manages its own concurrency.
+		Results of None are dropped. Output is put on the next stage's bounded queue,
+		so a slow stage blocks the stages before it instead of buffering without limit.
+	"""
+
+	def __init__(
+			self,
+			name: str,
+			func: Optional[Callable] = None,
+			workers: int = 1,
+			queue_size: int = 100,
+			stream: Optional[Callable[[Iterator, Callable], None]] = None,
+			on_finish: Optional[Callable[[], None]] = None,
+	):
+		"""
+		Args:
+			name (str): Name used in logs and stats.
+			func (Callable, optional): Function mapping one input item to one output item.
+			workers (int, optional): Threads running `func`. Defaults to 1.
+			queue_size (int, optional): Capacity of the stage's input queue. Defaults to 100.
+			stream (Callable, optional): Used instead of `func`; see above.
+			on_finish (Callable, optional): Called once every item has passed through the stage.
+		"""
+
+		self.name = name
+		self.func = func
+		self.stream = stream
+		self.workers = max(1, int(workers))
+		self.queue = queue.Queue(maxsize=max(1, int(queue_size)))
+		self.on_finish = on_finish
+		self.processed = 0
+		self.errors = 0
+		self.busy_seconds = 0.0
+		self.latencies = deque(maxlen=10000)  # Most recent per-item durations, in seconds
+		self._lock = threading.Lock()
+
+	def record(self, seconds: float, error: bool = False) -> None:
+		with self._lock:
+			if error:
+				self.errors += 1
+			else:
+				self.processed += 1
+			self.busy_seconds += seconds
+			self.latencies.append(seconds)
+
+	def timed(self, func: Callable) -> Callable:
+		"""
+		Wraps `func` so each call is recorded in this stage's stats.
+		"""
+
+		def wrapper(*args, **kwargs):
+			start = time.monotonic()
+			try:
+				result = func(*args, **kwargs)
+			except Exception:
+				self.record(time.monotonic() - start, error=True)
+				raise
+			self.record(time.monotonic() - start)
+			return result
+
+		return wrapper
+
+	def stats(self, elapsed: float) -> dict:
+		"""
+		Args:
+			elapsed (float): Seconds the pipeline has been running.
+
+		Returns:
+			dict: Queue depth, item counts, throughput and busy time for the stage.
+		"""
+
+		with self._lock:
+			return {
+				'queue_depth': self.queue.qsize(),
+				'queue_size': self.queue.maxsize,
+				'workers': 1 if self.stream is not None else self.workers,
+				'processed': self.processed,
+				'errors': self.errors,
+				'per_second': self.processed / elapsed if elapsed > 0 else 0.0,
+				'busy_seconds': round(self.busy_seconds, 3),
+			}
+
+
+class Pipeline:
+	"""
+	Runs items through a sequence of Stages, each on its own threads.
+	"""
+
+	def __init__(self, name: str, stages: List[Stage], log_interval: float = 30):
+		"""
+		Args:
+			name (str): Name used in logs.
+			stages (List[Stage]): Stages, in order.
+			log_interval (float, optional): Seconds between stats log lines while running. Defaults to 30.
+		"""
+
+		self.name = name
+		self.stages = stages
+		self.log_interval = log_interval
+		self.start_time = None
+
+	def stats(self) -> dict:
+		"""
+		Returns:
+			dict: Dict of stage name: stage stats.
+		"""
+
+		elapsed = time.monotonic() - self.start_time if self.start_time is not None else 0.0
+		return {stage.name: stage.stats(elapsed) for stage in self.stages}
+
+	def run(self, items: Iterable) -> dict:
+		"""
+		Feeds `items` through every stage and waits for them all to finish.
+			`items` is consumed lazily, at the pace the first stage accepts it.
+
+		Args:
+			items (Iterable): Input to the first stage.
+
+		Returns:
+			dict: Final stats, as from `self.stats()`.
+		"""
+
+		self.start_time = time.monotonic()
+		threads = []
+		for index, stage in enumerate(self.stages):
+			output = self.stages[index + 1].queue if index + 1 < len(self.stages) else None
+			target = self._stream if stage.stream is not None else self._work
+			count = 1 if stage.stream is not None else stage.workers
+			stage_threads = [
+				threading.Thread(target=target, args=(stage, output), name=f'{self.name}-{stage.name}-{n}', daemon=True)
+				for n in range(count)
+			]
+			for thread in stage_threads:
+				thread.start()
+			threads.append(stage_threads)
+
+		stop_monitor = threading.Event()
+		monitor = threading.Thread(target=self._monitor, args=(stop_monitor,), daemon=True)
+		monitor.start()
+
+		try:
+			for item in items:
+				self.stages[0].queue.put(item)
+		finally:
+			# Shut stages down in order, so each one drains before the next is told to stop
+			for stage, stage_threads in zip(self.stages, threads):
+				for _ in stage_threads:
+					stage.queue.put(_DONE)
+				for thread in stage_threads:
+					thread.join()
+				if stage.on_finish is not None:
+					stage.on_finish()
+			stop_monitor.set()
+			monitor.join()
+
+		stats = self.stats()
+		PIPELINE_LOG.info(f'Pipeline {self.name} finished: {stats}')
+		return stats
+
+	def _work(self, stage: Stage, output: Optional[queue.Queue]) -> None:
+		func = stage.timed(stage.func)
+		while True:
+			item = stage.queue.get()
+			if item is _DONE:
+				return
+			try:
+				result = func(item)
+			except Exception as e:
+				PIPELINE_LOG.warn(f'Exception {type(e)} in stage {stage.name}: {e}')
+				PIPELINE_LOG.warn(e, exc_info=True)
+				continue
+			if output is not None and result is not None:
+				output.put(result)
+
+	def _stream(self, stage: Stage, output: Optional[queue.Queue]) -> None:
+		def items():
+			while True:
+				item = stage.queue.get()
+				if item is _DONE:
+					return
+				yield item
+
+		def emit(result):
+			if output is not None and result is not None:
+				output.put(result)
+
+		try:
+			stage.stream(items(), emit)
+		except Exception as e:
+			PIPELINE_LOG.warn(f'Exception {type(e)} in stage {stage.name}: {e}')
+			PIPELINE_LOG.warn(e, exc_info=True)
+			# Keep draining so upstream stages are not blocked forever
+			for _ in items():
+				pass
+
+	def _monitor(self, stop: threading.Event) -> None:
+		while not stop.wait(self.log_interval):
+			PIPELINE_LOG.info(f'Pipeline {self.name} stats: {self.stats()}')
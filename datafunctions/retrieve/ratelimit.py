@@ -0,0 +1,222 @@
+"""
+Request pacing shared between fetchers.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+
+from collections import deque
+from typing import Optional
+
+RATELIMIT_LOG = logging.getLogger(__name__)
+
+# Statuses meaning the server wants us to slow down
+THROTTLE_STATUSES = frozenset([429, 503])
+
+
+class RateLimiter:
+	"""
+	Thread-safe token bucket limiting how many requests per second are started.
+
+	A single instance may be shared between threads and event loops;
+		every caller reserves a slot under one lock, so the limit is global.
+	"""
+
+	def __init__(self, rate: Optional[float], burst: int = 1):
+		"""
+		Args:
+			rate (float, optional): Requests per second. None or 0 disables limiting.
+			burst (int, optional): Number of requests that may start back-to-back. Defaults to 1.
+		"""
+
+		self.rate = rate
+		self.burst = max(1, int(burst))
+		self._next_time = 0.0
+		self._lock = threading.Lock()
+
+	def reserve(self) -> float:
+		"""
+		Reserves the next request slot.
+
+		Returns:
+			float: Number of seconds the caller must wait before starting its request.
+		"""
+
+		if not self.rate:
+			return 0.0
+		interval = 1.0 / self.rate
+		with self._lock:
+			now = time.monotonic()
+			self._next_time = max(self._next_time, now - (self.burst - 1) * interval)
+			wait_time = max(0.0, self._next_time - now)
+			self._next_time += interval
+		return wait_time
+
+	def acquire(self) -> None:
+		"""
+		Blocks the calling thread until a request may start.
+		"""
+
+		wait_time = self.reserve()
+		if wait_time > 0:
+			time.sleep(wait_time)
+
+	async def acquire_async(self) -> None:
+		"""
+		Waits in the running event loop until a request may start.
+		"""
+
+		wait_time = self.reserve()
+		if wait_time > 0:
+			await asyncio.sleep(wait_time)
+
+	def record(self, latency: Optional[float] = None, status: Optional[int] = None, error: bool = False, retry_after: Optional[float] = None) -> None:
+		"""
+		Records the outcome of a request. A fixed-rate limiter ignores it.
+		"""
+
+		pass
+
+	def metrics(self) -> dict:
+		return {'rate': self.rate}
+
+
+class AdaptiveRateLimiter(RateLimiter):
+	"""
+	RateLimiter whose rate follows what the server tolerates, by additive increase, multiplicative decrease.
+
+	Callers report each request's outcome with `record`. Until the first backoff, the rate starts slow
+		and grows by `slow_start` of itself per success, doubling every few seconds, to find the site's limit quickly.
+		After that, successes raise the rate by about `increase` requests per second
+		for every second of traffic. The rate is cut by
+		`decrease_factor` when the server throttles (429 or 503), when the error rate over
+		the last `window` requests passes `error_threshold`, or when the average latency passes
+		`latency_target`. Cuts are at most one per `cooldown` seconds, or per average latency if longer,
+		so a burst of failures from requests already in flight only counts once.
+		A Retry-After also pauses every request until it has passed.
+	"""
+
+	def __init__(
+			self,
+			rate: float,
+			min_rate: float = 0.1,
+			max_rate: float = 20.0,
+			burst: int = 1,
+			increase: float = 0.5,
+			slow_start: float = 0.25,
+			decrease_factor: float = 0.5,
+			latency_target: float = 5.0,
+			error_threshold: float = 0.2,
+			window: int = 50,
+			cooldown: float = 1.0,
+	):
+		"""
+		Args:
+			rate (float): Starting requests per second.
+			min_rate (float, optional): Lowest rate it will back off to. Defaults to 0.1.
+			max_rate (float, optional): Highest rate it will speed up to. Defaults to 20.0.
+			burst (int, optional): See RateLimiter. Defaults to 1.
+			increase (float, optional): Requests per second added per second of successes. Defaults to 0.5.
+			slow_start (float, optional): Requests per second added per success before the first backoff. Defaults to 0.25.
+			decrease_factor (float, optional): Multiplier applied to the rate on backoff. Defaults to 0.5.
+			latency_target (float, optional): Average latency, in seconds, above which it backs off. Defaults to 5.0.
+			error_threshold (float, optional): Fraction of failed recent requests above which it backs off. Defaults to 0.2.
+			window (int, optional): Number of recent requests the error rate is measured over. Defaults to 50.
+			cooldown (float, optional): Minimum seconds between backoffs. Defaults to 1.0.
+		"""
+
+		super().__init__(min(max(rate, min_rate), max_rate), burst=burst)
+		self.min_rate = min_rate
+		self.max_rate = max_rate
+		self.increase = increase
+		self.slow_start = slow_start
+		self.decrease_factor = decrease_factor
+		self.latency_target = latency_target
+		self.error_threshold = error_threshold
+		self.cooldown = cooldown
+		self.outcomes = deque(maxlen=max(1, int(window)))  # True for each recent failed request
+		self.latency = None  # Exponentially weighted average, in seconds
+		self.requests = 0
+		self.errors = 0
+		self.throttled = 0
+		self.backoffs = 0
+		self.pauses = 0
+		self.backoff_events = deque(maxlen=100)
+		self._last_backoff = float('-inf')
+
+	def record(self, latency: Optional[float] = None, status: Optional[int] = None, error: bool = False, retry_after: Optional[float] = None) -> None:
+		"""
+		Records the outcome of a request and adjusts the rate.
+
+		Args:
+			latency (float, optional): Seconds the request took.
+			status (int, optional): HTTP status of the response, if one was received.
+			error (bool, optional): Whether the request failed without a response, e.g. timed out. Defaults to False.
+			retry_after (float, optional): Seconds the server asked us to wait.
+		"""
+
+		throttled = status in THROTTLE_STATUSES
+		failed = error or throttled or (status is not None and status >= 500)
+		with self._lock:
+			now = time.monotonic()
+			self.requests += 1
+			self.outcomes.append(failed)
+			if latency is not None:
+				self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+
+			reason = None
+			if throttled:
+				self.throttled += 1
+				reason = f'status {status}'
+			elif failed:
+				self.errors += 1
+				if len(self.outcomes) >= min(10, self.outcomes.maxlen) and self.error_rate() > self.error_threshold:
+					reason = 'error rate'
+			elif self.latency is not None and self.latency > self.latency_target:
+				reason = 'latency'
+			elif self.backoffs == 0:
+				self.rate = min(self.max_rate, self.rate + self.slow_start)
+			else:
+				self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+			if reason is not None and now - self._last_backoff >= max(self.cooldown, self.latency or 0.0):
+				self._backoff(now, reason)
+			if retry_after:
+				self.pauses += 1
+				self._next_time = max(self._next_time, now + retry_after)
+
+	def _backoff(self, now: float, reason: str) -> None:
+		old_rate = self.rate
+		self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+		self.backoffs += 1
+		self._last_backoff = now
+		self.backoff_events.append({'time': time.time(), 'reason': reason, 'from_rate': round(old_rate, 3), 'to_rate': round(self.rate, 3)})
+		RATELIMIT_LOG.info(f'Backing off from {old_rate:.3f} to {self.rate:.3f} requests per second ({reason})')
+
+	def error_rate(self) -> float:
+		return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+	def metrics(self) -> dict:
+		"""
+		Returns:
+			dict: Current rate and its bounds, request and backoff counts, average latency,
+				recent error rate, and the most recent backoff events.
+		"""
+
+		with self._lock:
+			return {
+				'rate': round(self.rate, 3),
+				'slow_start': self.backoffs == 0,
+				'min_rate': self.min_rate,
+				'max_rate': self.max_rate,
+				'requests': self.requests,
+				'errors': self.errors,
+				'throttled': self.throttled,
+				'backoffs': self.backoffs,
+				'pauses': self.pauses,
+				'latency': round(self.latency, 4) if self.latency is not None else None,
+				'error_rate': round(self.error_rate(), 3),
+				'recent_backoffs': list(self.backoff_events)[-10:],
+			}
@@ -0,0 +1,348 @@
+"""
+Local replay of recorded Monster responses, for measuring the scraper without the real site.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from datafunctions.retrieve.retrievers.monster import MonsterSearchPageParser
+from datafunctions.retrieve.session import get_response
+
+REPLAY_LOG = logging.getLogger(__name__)
+
+SEARCH_PATH = '/jobs/search/'
+DETAILS_PATH = '/v2/job/pure-json-view'
+
+# Served for result pages past the end of a recording, so paging stops there
+EMPTY_SEARCH_PAGE = b'<html><body><div id="SearchResults"></div></body></html>'
+
+
+def title_slug(title: str) -> str:
+	"""
+	File-safe name for a search title, unique even if two titles differ only in punctuation.
+	"""
+
+	readable = re.sub(r'[^a-z0-9]+', '-', title.lower()).strip('-')
+	return f'{readable}-{hashlib.sha1(title.encode("utf-8")).hexdigest()[:8]}'
+
+
+class ReplayFixtures:
+	"""
+	A directory of recorded responses.
+
+	Search result pages are kept as `search/<title slug>/<page>.html`
+		and details documents as `details/<jobid>.json`, exactly as the site sent them.
+		`titles.json` lists the titles searched for.
+	"""
+
+	def __init__(self, directory: str):
+		self.directory = directory
+
+	def titles(self) -> List[str]:
+		try:
+			with open(os.path.join(self.directory, 'titles.json')) as f:
+				return json.load(f)
+		except FileNotFoundError:
+			return []
+
+	def add_titles(self, titles: List[str]) -> None:
+		known = self.titles()
+		self._save(os.path.join(self.directory, 'titles.json'), json.dumps(known + [title for title in titles if title not in known]).encode('utf-8'))
+
+	def search_path(self, title: str, page: int) -> str:
+		return os.path.join(self.directory, 'search', title_slug(title), f'{page}.html')
+
+	def details_path(self, jobid: str) -> str:
+		return os.path.join(self.directory, 'details', f'{jobid}.json')
+
+	def save_search_page(self, title: str, page: int, body: bytes) -> None:
+		self._save(self.search_path(title, page), body)
+
+	def save_details(self, jobid: str, body: bytes) -> None:
+		self._save(self.details_path(jobid), body)
+
+	def search_page(self, title: str, page: int) -> Optional[bytes]:
+		return self._load(self.search_path(title, page))
+
+	def details(self, jobid: str) -> Optional[bytes]:
+		# Jobids come from request URLs, so anything that is not a plain name is not a recorded jobid
+		if not jobid or os.path.basename(jobid) != jobid or jobid.startswith('.'):
+			return None
+		return self._load(self.details_path(jobid))
+
+	def details_count(self) -> int:
+		directory = os.path.join(self.directory, 'details')
+		return len(os.listdir(directory)) if os.path.isdir(directory) else 0
+
+	@staticmethod
+	def _save(path: str, body: bytes) -> None:
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		with open(path, 'wb') as f:
+			f.write(body)
+
+	@staticmethod
+	def _load(path: str) -> Optional[bytes]:
+		try:
+			with open(path, 'rb') as f:
+				return f.read()
+		except FileNotFoundError:
+			return None
+
+
+def record_fixtures(fixtures: ReplayFixtures, scraper, titles: List[str], max_pages: int = 5) -> int:
+	"""
+	Records the search pages and details documents of real searches, through a scraper's
+		session and rate limiter. Only the first `max_pages` result pages of each title are kept,
+		so a replay of them ends where the recording did.
+
+	Args:
+		fixtures (ReplayFixtures): Where to save the responses.
+		scraper (MonsterScraper): Scraper whose URLs, session and rate limiter are used.
+		titles (List[str]): Titles to search for.
+		max_pages (int, optional): Result pages recorded per title. Defaults to 5.
+
+	Returns:
+		int: Number of details documents recorded.
+	"""
+
+	fixtures.add_titles(titles)
+	recorded = 0
+	for title in titles:
+		seen = set()
+		for page in range(1, max_pages + 1):
+			scraper.rate_limiter.acquire()
+			url = scraper.build_search_url(job_title=title, page=page)
+			body = get_response(scraper.session, url, timeout=scraper.request_timeout, rate_limiter=scraper.rate_limiter).content
+			fixtures.save_search_page(title, page, body)
+			parser = MonsterSearchPageParser()
+			parser.feed(body.decode('utf-8', errors='replace'))
+			parser.close()
+			new_jobids = [jobid for jobid in parser.jobids if jobid not in seen]
+			seen.update(new_jobids)
+			for jobid in new_jobids:
+				if fixtures.details(jobid) is not None:
+					continue
+				try:
+					scraper.rate_limiter.acquire()
+					response = get_response(
+						scraper.session,
+						scraper.build_details_url(jobid),
+						timeout=scraper.request_timeout,
+						rate_limiter=scraper.rate_limiter,
+					)
+				except Exception as e:
+					REPLAY_LOG.warn(f'Exception {type(e)} while recording details for {jobid}: {e}')
+					continue
+				fixtures.save_details(jobid, response.content)
+				recorded += 1
+			if not new_jobids or not parser.has_more:
+				break
+		REPLAY_LOG.info(f'Recorded {title}: {len(seen)} jobids.')
+	return recorded
+
+
+def generate_fixtures(
+		fixtures: ReplayFixtures,
+		titles: List[str],
+		jobs_per_title: int = 100,
+		jobs_per_page: int = 25,
+		description_words: int = 400,
+		seed: int = 0,
+) -> int:
+	"""
+	Writes synthetic responses shaped like the site's, for when no recording is at hand.
+		Like the site, each result page repeats the cards of the pages before it.
+
+	Args:
+		fixtures (ReplayFixtures): Where to save the responses.
+		titles (List[str]): Titles to generate searches for.
+		jobs_per_title (int, optional): Jobs found by each search. Defaults to 100.
+		jobs_per_page (int, optional): New jobs per result page. Defaults to 25.
+		description_words (int, optional): Mean length of a job description. Defaults to 400.
+		seed (int, optional): Random seed, so the same arguments give the same fixtures. Defaults to 0.
+
+	Returns:
+		int: Number of details documents written.
+	"""
+
+	fixtures.add_titles(titles)
+	generator = random.Random(seed)
+	vocabulary = [f'word{n}' for n in range(5000)]
+	# Every job of a title is at a different company, so none are duplicates, but companies recur across titles
+	companies = [f'Company {n}' for n in range(max(1, jobs_per_title))]
+	cities = [('Austin', 'TX'), ('Denver', 'CO'), ('Seattle', 'WA'), ('Boston', 'MA'), ('Chicago', 'IL')]
+	written = 0
+	for title_number, title in enumerate(titles):
+		jobids = [f'{title_number:04d}{n:06d}' for n in range(jobs_per_title)]
+		pages = max(1, -(-len(jobids) // jobs_per_page))
+		for page in range(1, pages + 1):
+			cards = ''.join(
+				f'<section class="card-content" data-jobid="{jobid}"><h2>{title}</h2></section>'
+				for jobid in jobids[:page * jobs_per_page]
+			)
+			more = '<a id="loadMoreJobs" href="#">Load more jobs</a>' if page < pages else ''
+			fixtures.save_search_page(title, page, f'<html><body><div id="SearchResults">{cards}</div>{more}</body></html>'.encode('utf-8'))
+		for job_number, jobid in enumerate(jobids):
+			company = companies[job_number]
+			city, region = generator.choice(cities)
+			paragraphs = [
+				' '.join(generator.choice(vocabulary) for _ in range(generator.randint(20, 80)))
+				for _ in range(max(1, generator.randint(description_words // 2, description_words * 3 // 2) // 50))
+			]
+			document = {
+				'jobDescription': ''.join(f'<p>{paragraph}</p>' for paragraph in paragraphs),
+				'companyInfo': {
+					'name': company,
+					'companyHeader': f'{title} at {company}',
+					'description': f'<p>{company} is hiring.</p>',
+					'logo': {'src': f'https://example.com/logos/{title_slug(company)}.png'},
+				},
+				'isCustomApplyOnlineJob': False,
+				'submitButtonUrl': f'https://example.com/apply/{jobid}',
+				'jobLocationCountry': 'US',
+				'jobLocationRegion': region,
+				'jobLocationCity': city,
+			}
+			fixtures.save_details(jobid, json.dumps(document).encode('utf-8'))
+			written += 1
+	return written
+
+
+class ReplayServer(ThreadingMixIn, HTTPServer):
+	"""
+	Local HTTP server answering Monster search and details requests from ReplayFixtures.
+
+	Every response is delayed by `latency` seconds, plus up to `jitter` more,
+		and a random `error_rate` fraction of requests fail with `error_status` instead.
+		Result pages that were not recorded are served empty, and other requests
+		for anything not recorded get a 404.
+		Point a scraper at it with its `search_base_url` and `details_base_url`.
+	"""
+
+	daemon_threads = True
+
+	def __init__(
+			self,
+			fixtures: ReplayFixtures,
+			latency: float = 0.0,
+			jitter: float = 0.0,
+			error_rate: float = 0.0,
+			error_status: int = 503,
+			seed: Optional[int] = None,
+	):
+		"""
+		Args:
+			fixtures (ReplayFixtures): Responses to serve.
+			latency (float, optional): Seconds every response is delayed. Defaults to 0.
+			jitter (float, optional): Maximum random extra delay, in seconds. Defaults to 0.
+			error_rate (float, optional): Fraction of requests that fail. Defaults to 0.
+			error_status (int, optional): Status of failed requests. Defaults to 503.
+			seed (int, optional): Random seed for jitter and errors.
+		"""
+
+		super().__init__(('127.0.0.1', 0), ReplayHandler)
+		self.fixtures = fixtures
+		self.latency = latency
+		self.jitter = jitter
+		self.error_rate = error_rate
+		self.error_status = error_status
+		self.random = random.Random(seed)
+		self.counts = {'search': 0, 'details': 0, 'errors': 0, 'missing': 0}
+		self.lock = threading.Lock()
+		self._thread = None
+
+	@property
+	def url(self) -> str:
+		return f'http://127.0.0.1:{self.server_port}'
+
+	@property
+	def search_base_url(self) -> str:
+		return f'{self.url}{SEARCH_PATH}'
+
+	@property
+	def details_base_url(self) -> str:
+		return f'{self.url}{DETAILS_PATH}'
+
+	def start(self) -> None:
+		self._thread = threading.Thread(target=self.serve_forever, name='replay-server', daemon=True)
+		self._thread.start()
+
+	def stop(self) -> None:
+		self.shutdown()
+		self.server_close()
+		if self._thread is not None:
+			self._thread.join()
+
+	def count(self, kind: str) -> None:
+		with self.lock:
+			self.counts[kind] += 1
+
+	def delay(self) -> float:
+		with self.lock:
+			return self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+	def should_fail(self) -> bool:
+		with self.lock:
+			return self.error_rate > 0 and self.random.random() < self.error_rate
+
+	def __enter__(self):
+		self.start()
+		return (self)
+
+	def __exit__(self, exc_type, exc_value, tb):
+		self.stop()
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+	def do_GET(self):
+		url = urlparse(self.path)
+		params = parse_qs(url.query)
+		body = None
+		if url.path == SEARCH_PATH:
+			kind = 'search'
+			try:
+				page = int(params.get('page', ['1'])[0])
+			except ValueError:
+				page = 0
+			body = self.server.fixtures.search_page(params.get('q', [''])[0], page) or EMPTY_SEARCH_PAGE
+			content_type = 'text/html; charset=utf-8'
+		elif url.path == DETAILS_PATH:
+			kind = 'details'
+			body = self.server.fixtures.details(params.get('jobid', [''])[0])
+			content_type = 'application/json'
+		else:
+			kind = 'missing'
+
+		time.sleep(self.server.delay())
+		if self.server.should_fail():
+			self.server.count('errors')
+			self.send_response(self.server.error_status)
+			self.send_header('Content-Length', '0')
+			self.end_headers()
+			return
+		if body is None:
+			self.server.count('missing')
+			self.send_response(404)
+			self.send_header('Content-Length', '0')
+			self.end_headers()
+			return
+		self.server.count(kind)
+		self.send_response(200)
+		self.send_header('Content-Type', content_type)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
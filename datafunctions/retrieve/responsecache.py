@@ -0,0 +1,244 @@
+"""
+On-disk cache of raw HTTP response payloads.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from typing import Iterator, Optional
+
+import requests
+
+from datafunctions.retrieve.ratelimit import RateLimiter
+from datafunctions.retrieve.session import get_response
+
+RESPONSECACHE_LOG = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'db', 'responses')
+
+
+class CachedResponse:
+	"""
+	A cached payload and the validators the server sent with it.
+	"""
+
+	def __init__(self, key: str, payload: bytes, etag: Optional[str], last_modified: Optional[str], fetched_at: float):
+		self.key = key
+		self.payload = payload
+		self.etag = etag
+		self.last_modified = last_modified
+		self.fetched_at = fetched_at
+
+	def json(self):
+		return json.loads(self.payload.decode('utf-8'))
+
+	def conditional_headers(self) -> dict:
+		"""
+		Headers asking the server to answer 304 Not Modified if the payload is unchanged.
+		"""
+
+		headers = {}
+		if self.etag:
+			headers['If-None-Match'] = self.etag
+		if self.last_modified:
+			headers['If-Modified-Since'] = self.last_modified
+		return headers
+
+
+class ResponseCache:
+	"""
+	Thread-safe SQLite store of zlib-compressed response payloads, keyed by e.g. jobid.
+
+	Entries younger than `ttl` are used without a request. Older ones are revalidated
+		with a conditional request when the server sent an ETag or Last-Modified,
+		so an unchanged document costs a 304 rather than a download.
+		Once the compressed payloads pass `max_bytes`, the least recently used entries are evicted.
+		In `offline` mode no requests are made at all, and stale entries are served as they are.
+	"""
+
+	def __init__(self, path: str, ttl: Optional[float] = 7 * 24 * 3600, max_bytes: int = 1024 ** 3, offline: bool = False):
+		"""
+		Args:
+			path (str): SQLite file the cache is kept in. Created if missing.
+			ttl (float, optional): Seconds an entry is used without revalidation. None never revalidates. Defaults to a week.
+			max_bytes (int, optional): Total compressed size above which entries are evicted. Defaults to 1 GiB.
+			offline (bool, optional): Whether to serve only from the cache. Defaults to False.
+		"""
+
+		self.path = path
+		self.ttl = ttl
+		self.max_bytes = max_bytes
+		self.offline = offline
+		self.hits = 0
+		self.misses = 0
+		self.revalidated = 0
+		self.evictions = 0
+		self._lock = threading.Lock()
+
+		os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+		# One connection, used by every thread in turn under the lock
+		self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+		with self._lock:
+			conn = self.conn
+			conn.execute('PRAGMA journal_mode=WAL;')
+			conn.execute('PRAGMA synchronous=NORMAL;')
+			conn.execute('''
+				CREATE TABLE IF NOT EXISTS responses (
+					key TEXT PRIMARY KEY,
+					payload BLOB NOT NULL,
+					size INTEGER NOT NULL,
+					etag TEXT,
+					last_modified TEXT,
+					fetched_at REAL NOT NULL,
+					accessed_at REAL NOT NULL
+				);
+			''')
+			conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at_idx ON responses (accessed_at);')
+			conn.commit()
+			self.total_bytes = conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses;').fetchone()[0]
+
+	def get(self, key: str) -> Optional[CachedResponse]:
+		"""
+		Gets an entry, fresh or not, marking it as recently used.
+		"""
+
+		with self._lock:
+			conn = self.conn
+			row = conn.execute(
+				'SELECT payload, etag, last_modified, fetched_at FROM responses WHERE key = ?;',
+				(key,),
+			).fetchone()
+			if row is None:
+				return None
+			conn.execute('UPDATE responses SET accessed_at = ? WHERE key = ?;', (time.time(), key))
+			conn.commit()
+		payload, etag, last_modified, fetched_at = row
+		return CachedResponse(key, zlib.decompress(payload), etag, last_modified, fetched_at)
+
+	def is_fresh(self, entry: CachedResponse) -> bool:
+		return self.ttl is None or time.time() - entry.fetched_at < self.ttl
+
+	def put(self, key: str, payload: bytes, etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+		"""
+		Stores a payload, evicting the least recently used entries if the cache is over its size cap.
+		"""
+
+		compressed = zlib.compress(payload, 6)
+		now = time.time()
+		with self._lock:
+			conn = self.conn
+			old = conn.execute('SELECT size FROM responses WHERE key = ?;', (key,)).fetchone()
+			conn.execute(
+				'INSERT OR REPLACE INTO responses(key, payload, size, etag, last_modified, fetched_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?);',
+				(key, sqlite3.Binary(compressed), len(compressed), etag, last_modified, now, now),
+			)
+			self.total_bytes += len(compressed) - (old[0] if old is not None else 0)
+			if self.max_bytes and self.total_bytes > self.max_bytes:
+				self._evict(conn)
+			conn.commit()
+
+	def touch(self, key: str) -> None:
+		"""
+		Marks an entry as just fetched, after the server confirmed it is unchanged.
+		"""
+
+		now = time.time()
+		with self._lock:
+			conn = self.conn
+			conn.execute('UPDATE responses SET fetched_at = ?, accessed_at = ? WHERE key = ?;', (now, now, key))
+			conn.commit()
+
+	def _evict(self, conn: sqlite3.Connection) -> None:
+		# Evict down to 90% of the cap, so a full cache does not evict on every put
+		target = self.max_bytes * 0.9
+		evicted = 0
+		for key, size in conn.execute('SELECT key, size FROM responses ORDER BY accessed_at;').fetchall():
+			if self.total_bytes <= target:
+				break
+			conn.execute('DELETE FROM responses WHERE key = ?;', (key,))
+			self.total_bytes -= size
+			evicted += 1
+		self.evictions += evicted
+		RESPONSECACHE_LOG.info(f'Evicted {evicted} cached responses, {self.total_bytes} bytes cached.')
+
+	def keys(self) -> Iterator[str]:
+		"""
+		Yields every cached key, least recently fetched first.
+		"""
+
+		with self._lock:
+			conn = self.conn
+			keys = [row[0] for row in conn.execute('SELECT key FROM responses ORDER BY fetched_at;').fetchall()]
+		return iter(keys)
+
+	def get_json(self, session: requests.Session, key: str, url: str, rate_limiter: Optional[RateLimiter] = None, **kwargs):
+		"""
+		Gets and decodes a JSON document through the cache.
+
+		Args:
+			session (requests.Session): Session to send any request with.
+			key (str): Cache key of the document.
+			url (str): URL to get it from.
+			rate_limiter (RateLimiter, optional): Limiter to acquire before a request, and record its outcome in.
+				Documents served from the cache are not rate limited.
+			**kwargs: Passed to `session.get_response`.
+
+		Raises:
+			Exception: In offline mode, if the document is not cached.
+			ValueError: If a fetched document is not valid JSON. It is not cached.
+
+		Returns:
+			The decoded document.
+		"""
+
+		entry = self.get(key)
+		if entry is not None and (self.offline or self.is_fresh(entry)):
+			with self._lock:
+				self.hits += 1
+			return entry.json()
+		if self.offline:
+			with self._lock:
+				self.misses += 1
+			raise Exception(f'{key} is not cached, and the response cache is offline.')
+
+		headers = entry.conditional_headers() if entry is not None else {}
+		if rate_limiter is not None:
+			rate_limiter.acquire()
+		response = get_response(session, url, headers=headers, rate_limiter=rate_limiter, **kwargs)
+		if response.status_code == 304 and entry is not None:
+			RESPONSECACHE_LOG.info(f'{key} not modified, using cached response.')
+			with self._lock:
+				self.revalidated += 1
+			self.touch(key)
+			return entry.json()
+
+		with self._lock:
+			self.misses += 1
+		try:
+			data = response.json()
+		except ValueError as e:
+			RESPONSECACHE_LOG.warn(f'Invalid JSON from {url}, not caching: {e}')
+			raise
+		self.put(key, response.content, etag=response.headers.get('ETag'), last_modified=response.headers.get('Last-Modified'))
+		return data
+
+	def stats(self) -> dict:
+		with self._lock:
+			return {
+				'bytes': self.total_bytes,
+				'max_bytes': self.max_bytes,
+				'hits': self.hits,
+				'misses': self.misses,
+				'revalidated': self.revalidated,
+				'evictions': self.evictions,
+				'offline': self.offline,
+			}
+
+	def close(self) -> None:
+		with self._lock:
+			self.conn.close()
@@ -1,12 +1,20 @@
 
-from typing import Optional
+from typing import List, Optional
 
 
 class DataRetriever:
 	"""
 	ABC for data retrieval classes.
+
+	A retriever implementing get_and_store_data counts the job listings it adds in `rows_added`,
+		and the jobs it found but failed to retrieve or save in `jobs_failed`.
+		`timeout`, in seconds, overrides the Populator's limit on how long the retriever may run.
 	"""
 
+	rows_added = 0
+	jobs_failed = 0
+	timeout: Optional[float] = None
+
 	def get_and_store_data(self, db_connection, db_callback: Optional[callable] = None, **kwargs) -> None:
 		"""
 		Method for getting data and storing it to a database.
@@ -23,16 +31,20 @@ class DataRetriever:
 
 		raise NotImplementedError(f'{self.__class__.__name__} has not implemented get_and_store_data.')
 
-	def get_data(self) -> dict:
+	def get_data(self) -> List[dict]:
 		"""
 		Method for getting data.
 		Every DataRetriever *must* implement either this or get_and_store_data.
+		The Populator deduplicates and saves the results, so the DataRetriever need not.
 
 		Raises:
 			NotImplementedError: If the DataRetriever has not implemented this method.
 
 		Returns:
-			dict: The data retrieved.
+			List[dict]: The jobs retrieved, each with the keys BatchPersister saves:
+				title, description, company_name, company_description, company_logo_url,
+				inner_link, city, state_province, country and a unix timestamp,
+				plus optionally source and source_id, so the job is skipped when seen again.
 		"""
 
 		raise NotImplementedError(f'{self.__class__.__name__} has not implemented get_data.')
@@ -6,14 +6,15 @@ import logging
 import time
 import psycopg2
 import random
-import requests
 import datetime
-import html2text
-import re
+import queue
+import threading
 
+from collections import OrderedDict
 from decouple import config
-from typing import Optional, List
+from typing import Iterator, Optional, List
 
+from html.parser import HTMLParser
 from urllib.parse import urlencode
 from selenium import webdriver
 from selenium.webdriver.common.by import By
@@ -23,7 +24,22 @@ from selenium.webdriver.support.expected_conditions import presence_of_element_l
 from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
 from selenium.common.exceptions import WebDriverException
 
+from concurrent.futures import ThreadPoolExecutor
+from datafunctions import metrics
+from datafunctions.database import ConnectionPool, ensure_schema, get_pool
 from datafunctions.retrieve.retrievefunctions import DataRetriever
+from datafunctions.retrieve.cache import DimensionCache
+from datafunctions.retrieve.checkpoint import ScrapeCheckpoint, SearchCheckpoint
+from datafunctions.retrieve.dedup import DedupView
+from datafunctions.retrieve.driverpool import DriverPool, PooledDriver
+from datafunctions.retrieve.fetcher import DetailsFetcher
+from datafunctions.retrieve.neardup import DEFAULT_INDEX_PATH, NearDuplicateIndex
+from datafunctions.retrieve.normalize import DescriptionNormalizer
+from datafunctions.retrieve.persist import BatchPersister
+from datafunctions.retrieve.pipeline import Pipeline, Stage
+from datafunctions.retrieve.ratelimit import AdaptiveRateLimiter, RateLimiter
+from datafunctions.retrieve.responsecache import DEFAULT_CACHE_DIRECTORY, ResponseCache
+from datafunctions.retrieve.session import build_session, get_json, get_response
 from datafunctions.utils import titlecase
 
 # logging.basicConfig(stream=sys.stdout, level=logging.INFO)
@@ -33,48 +49,215 @@ curpath = os.path.dirname(os.path.abspath(__file__))
 PHANTOMJSPATH = os.path.join(curpath, '../webdrivers/phantomjs-2.1.1-linux-x86_64/bin/phantomjs')
 
 
+class MonsterSearchPageParser(HTMLParser):
+	"""
+	Collects jobids from the result cards of a Monster search page.
+
+	Matches the same cards as the browser backend's XPath: elements with a `card-content`
+		class that are not `apas-ad` adverts. Also notes whether the page has a "load more" button.
+	"""
+
+	def __init__(self):
+		super().__init__()
+		self.jobids = []
+		self.has_more = False
+
+	def handle_starttag(self, tag, attrs):
+		attrs = dict(attrs)
+		if attrs.get('id') == 'loadMoreJobs':
+			self.has_more = True
+		classes = (attrs.get('class') or '').split()
+		if 'card-content' in classes and 'apas-ad' not in classes and attrs.get('data-jobid'):
+			self.jobids.append(attrs['data-jobid'])
+
+
 class MonsterScraper(DataRetriever):
 	default_title_list = ['Data Analyst', 'Web Engineer', 'Software Engineer', 'UI Engineer', 'Backend Engineer', 'Machine Learning Engineer', 'Frontend Engineer', 'Support Engineer', 'Full-stack Engineer', 'QA Engineer', 'Web Developer', 'Software Developer', 'UI Developer', 'Backend Developer', 'Machine Learning Developer', 'Frontend Developer', 'Support Developer', 'Full-stack Developer', 'QA Developer', 'Developer']
 	search_base_url = 'https://www.monster.com/jobs/search/'
 	details_base_url = 'https://job-openings.monster.com/v2/job/pure-json-view'
+	source_name = 'monster'
+
+	def __init__(
+			self,
+			max_wait=5,
+			max_in_flight=8,
+			requests_per_second=2.0,
+			rate_limiter: Optional[RateLimiter] = None,
+			adaptive_rate: Optional[bool] = None,
+			max_requests_per_second: Optional[float] = None,
+			persist_batch_size=50,
+			dimension_cache: Optional[DimensionCache] = None,
+			search_backend='browser',
+			search_base_url: Optional[str] = None,
+			details_base_url: Optional[str] = None,
+			max_search_pages=100,
+			dedup_view: Optional[DedupView] = None,
+			convert_workers=2,
+			queue_size=100,
+			convert_processes=0,
+			normalizer: Optional[DescriptionNormalizer] = None,
+			near_duplicates: Optional[NearDuplicateIndex] = None,
+			near_duplicate_threshold: Optional[float] = None,
+			near_duplicate_action: Optional[str] = None,
+			checkpoint: Optional[ScrapeCheckpoint] = None,
+			driver_pool: Optional[DriverPool] = None,
+			response_cache: Optional[ResponseCache] = None,
+			connection_pool: Optional[ConnectionPool] = None,
+	):
+		"""
+		Args:
+			max_wait (int, optional): Seconds to wait for search page elements. Defaults to 5.
+			max_in_flight (int, optional): Maximum concurrent details requests. Defaults to 8.
+			requests_per_second (float, optional): Global limit on requests to the site, or the starting limit
+				if the rate is adaptive. Defaults to 2.0.
+			rate_limiter (RateLimiter, optional): Limiter to share with other scrapers.
+				Overrides the other rate arguments when passed.
+			adaptive_rate (bool, optional): Whether the limit adapts to throttling, errors and latency,
+				see AdaptiveRateLimiter. Defaults to the SCRAPER_ADAPTIVE_RATE setting, or True.
+			max_requests_per_second (float, optional): Highest rate an adaptive limit may reach.
+				Defaults to the SCRAPER_MAX_REQUESTS_PER_SECOND setting, or 10.
+			persist_batch_size (int, optional): Number of results saved per transaction. Defaults to 50.
+			dimension_cache (DimensionCache, optional): Company and location id cache to share with other scrapers.
+			search_backend (str, optional): 'browser' to page through searches in PhantomJS,
+				or 'http' to request result pages directly without a browser. Defaults to 'browser'.
+			search_base_url (str, optional): Overrides the class's search_base_url, e.g. for a local fixture server.
+			details_base_url (str, optional): Overrides the class's details_base_url.
+			max_search_pages (int, optional): Maximum result pages requested by the 'http' backend. Defaults to 100.
+			dedup_view (DedupView, optional): Jobid and job claims to share with other scrapers.
+			convert_workers (int, optional): Threads converting details to results. Defaults to 2,
+				raised to the normalizer's process count so every conversion process can be kept busy.
+			queue_size (int, optional): Capacity of the queues between fetching, converting and saving. Defaults to 100.
+			convert_processes (int, optional): Processes large descriptions are converted in. Defaults to 0, converting in-thread.
+			normalizer (DescriptionNormalizer, optional): Description converter to share with other scrapers.
+				Overrides convert_processes when passed.
+			near_duplicates (NearDuplicateIndex, optional): Near-duplicate index to share with other scrapers.
+			near_duplicate_threshold (float, optional): Similarity above which descriptions are near-duplicates.
+				Defaults to the NEAR_DUPLICATE_THRESHOLD setting, or 0, which disables near-duplicate detection.
+				Ignored if near_duplicates is passed.
+			near_duplicate_action (str, optional): 'tag' or 'merge', see BatchPersister.
+				Defaults to the NEAR_DUPLICATE_ACTION setting, or 'tag'.
+			checkpoint (ScrapeCheckpoint, optional): Progress checkpoint to record searches and saved jobids in.
+				If not passed, `get_and_store_data` opens one unless the SCRAPER_CHECKPOINTS setting is false.
+			driver_pool (DriverPool, optional): Pool of browser drivers to share with other scrapers.
+				If not passed, one is created when the 'browser' backend first needs it,
+				configured by the SCRAPER_DRIVER_POOL_SIZE, SCRAPER_DRIVER_MAX_PAGES and SCRAPER_DRIVER_MAX_RSS_MB settings.
+			response_cache (ResponseCache, optional): Cache of details documents to share with other scrapers.
+				If not passed, one is opened if the SCRAPER_RESPONSE_CACHE setting is true, configured by the
+				SCRAPER_RESPONSE_CACHE_TTL_HOURS, SCRAPER_RESPONSE_CACHE_MAX_MB and SCRAPER_OFFLINE settings.
+			connection_pool (ConnectionPool, optional): Pool title workers borrow database connections from.
+				Defaults to the shared pool.
+		"""
+
+		if search_backend not in ('browser', 'http'):
+			raise ValueError(f'Unknown search_backend: {search_backend}')
+		self.search_backend = search_backend
+		if search_base_url is not None:
+			self.search_base_url = search_base_url
+		if details_base_url is not None:
+			self.details_base_url = details_base_url
+		self.max_search_pages = max_search_pages
 
-	def __init__(self, max_wait=5):
 		self.driver = None
-		self.html_converter = html2text.HTML2Text()
-		# self.html_converter.ignore_links = True
-		# self.html_converter.ignore_images = True
-		# self.html_converter.ignore_emphasis = True
-		# self.html_converter.ignore_anchors = True
-		self.html_converter.body_width = 0
-		self.get_info_delay = 2  # Number of seconds to wait between requests to get info
+		self.pooled_driver = None
+		self.driver_pool = driver_pool
+		self._owns_driver_pool = False
+		if normalizer is None:
+			normalizer = DescriptionNormalizer(processes=convert_processes)
+			self._owns_normalizer = True
+		else:
+			self._owns_normalizer = False
+		self.normalizer = normalizer
+		if rate_limiter is None:
+			if adaptive_rate is None:
+				adaptive_rate = config('SCRAPER_ADAPTIVE_RATE', default=True, cast=bool)
+			if max_requests_per_second is None:
+				max_requests_per_second = config('SCRAPER_MAX_REQUESTS_PER_SECOND', default=10.0, cast=float)
+			if adaptive_rate and requests_per_second:
+				rate_limiter = AdaptiveRateLimiter(requests_per_second, max_rate=max_requests_per_second)
+			else:
+				rate_limiter = RateLimiter(requests_per_second)
+			metrics.register(f'{self.source_name}.rate_limiter', rate_limiter.metrics)
+		self.rate_limiter = rate_limiter
+		self.max_in_flight = max_in_flight
+		self.convert_workers = convert_workers
+		self.queue_size = queue_size
+		self.persist_batch_size = persist_batch_size
+		if dimension_cache is None:
+			dimension_cache = DimensionCache()
+		self.dimension_cache = dimension_cache
+		if dedup_view is None:
+			dedup_view = DedupView()
+		self.dedup_view = dedup_view
+		if near_duplicate_threshold is None:
+			near_duplicate_threshold = config('NEAR_DUPLICATE_THRESHOLD', default=0.0, cast=float)
+		self.near_duplicate_threshold = near_duplicate_threshold
+		if near_duplicate_action is None:
+			near_duplicate_action = config('NEAR_DUPLICATE_ACTION', default='tag')
+		self.near_duplicate_action = near_duplicate_action
+		self.near_duplicates = near_duplicates
+		self.checkpoint = checkpoint
+		if response_cache is None and config('SCRAPER_RESPONSE_CACHE', default=False, cast=bool):
+			response_cache = ResponseCache(
+				os.path.join(DEFAULT_CACHE_DIRECTORY, f'{self.source_name}.sqlite3'),
+				ttl=config('SCRAPER_RESPONSE_CACHE_TTL_HOURS', default=168.0, cast=float) * 3600,
+				max_bytes=int(config('SCRAPER_RESPONSE_CACHE_MAX_MB', default=1024.0, cast=float) * 1024 ** 2),
+				offline=config('SCRAPER_OFFLINE', default=False, cast=bool),
+			)
+			metrics.register(f'{self.source_name}.response_cache', response_cache.stats)
+			self._owns_response_cache = True
+		else:
+			self._owns_response_cache = False
+		self.response_cache = response_cache
+		self.connection_pool = connection_pool
+		self.prepared = False
+		self.rows_added = 0
+		self.jobs_failed = 0
+		self._jobs_failed_lock = threading.Lock()
+		self.session = build_session(pool_size=max_in_flight)  # Shared keep-alive connections for details requests
+		self.request_timeout = (5, 30)  # Connect and read timeouts for details requests, in seconds
 		self.max_wait = max_wait
 		self.wait = None
 
-	def establish_driver(self):
+	def create_driver(self):
 		"""
-		Establishes the webdriver.
-			If a webdriver already exists, closes that one first.
+		Starts a new PhantomJS webdriver.
+
+		Raises:
+			Exception: If the driver could not be started.
+
+		Returns:
+			The driver.
 		"""
 
-		MONSTER_LOG.info('Establishing webdriver...')
-		self.deestablish_driver()
+		MONSTER_LOG.info('Creating webdriver...')
+		driver = webdriver.PhantomJS(
+			executable_path=PHANTOMJSPATH,
+			service_log_path=os.path.devnull,
+		)
+		driver.set_window_size('1920', '1080')
+		MONSTER_LOG.info(f'webdriver created: {driver}')
+		return driver
 
-		try:
-			MONSTER_LOG.info('Creating webdriver...')
-			driver = webdriver.PhantomJS(
-				executable_path=PHANTOMJSPATH,
-				service_log_path=os.path.devnull,
-			)
-			driver.set_window_size('1920', '1080')
-			MONSTER_LOG.info(f'webdriver created: {driver}')
-			self.driver = driver
-			self.wait = WebDriverWait(self.driver, self.max_wait)
-		except Exception as e:
-			MONSTER_LOG.warn(f'Exception {type(e)} while creating new driver: {e}')
-			MONSTER_LOG.warn(e, exc_info=True)
-			self.driver = None
+	def get_driver_pool(self, size: Optional[int] = None) -> DriverPool:
+		"""
+		Gets the scraper's driver pool, creating it on first use.
 
-		return self.driver
+		Args:
+			size (int, optional): Drivers in a newly created pool. Defaults to the SCRAPER_DRIVER_POOL_SIZE setting, or 1.
+		"""
+
+		if self.driver_pool is None:
+			if size is None:
+				size = config('SCRAPER_DRIVER_POOL_SIZE', default=1, cast=int)
+			self.driver_pool = DriverPool(
+				self.create_driver,
+				size=size,
+				max_pages=config('SCRAPER_DRIVER_MAX_PAGES', default=200, cast=int),
+				max_rss_mb=config('SCRAPER_DRIVER_MAX_RSS_MB', default=500.0, cast=float),
+			)
+			self._owns_driver_pool = True
+			metrics.register(f'{self.source_name}.driver_pool', self.driver_pool.stats)
+		return self.driver_pool
 
 	def deestablish_driver(self):
 		"""
@@ -100,12 +283,15 @@ class MonsterScraper(DataRetriever):
 		self.driver = None
 		self.wait = None
 
-	def build_search_url(self, job_title='', job_location='', time=1):
+	def build_search_url(self, job_title='', job_location='', time=1, page=None):
 		params = {
 			'where': job_location,
 			'q': job_title,
 			'tm': time,
 		}
+		if page is not None:
+			params['stpage'] = 1
+			params['page'] = page
 		MONSTER_LOG.info(f'Building search url with base url {self.search_base_url} and params {params}')
 		query = urlencode(params)
 		search_url = f'{self.search_base_url}?{query}'
@@ -123,311 +309,144 @@ class MonsterScraper(DataRetriever):
 		return (details_url)
 
 	def add_to_db(self, db_conn, result):
-		MONSTER_LOG.info('Adding result to database...')
-		job_exists_query = """
-			WITH listings AS (
-				SELECT id
-				FROM job_listings
-				WHERE title = %(title)s
-			), descriptions AS (
-				SELECT job_id
-				FROM job_descriptions
-				WHERE description = %(description)s
-			)
-			SELECT listings.id
-			FROM listings
-			INNER JOIN descriptions
-			ON listings.id = descriptions.job_id
-			LIMIT 1;
-		"""
-
-		job_exists_query_2 = """
-			WITH listings AS (
-				SELECT id
-				FROM job_listings
-				WHERE title = %(title)s
-			), c AS (
-				SELECT id
-				FROM companies
-				WHERE name = %(name)s
-			)
-			SELECT listings.id
-			FROM listings
-			INNER JOIN job_companies
-			ON job_companies.job_id = listings.id
-			INNER JOIN c
-			ON job_companies.company_id = c.id
-			LIMIT 1
 		"""
+		Saves a single result to the database in its own transaction.
 
-		job_listings_query = """
-			INSERT INTO job_listings(title, post_date_utc)
-			VALUES (%(title)s, to_timestamp(%(post_date_utc)s))
-			RETURNING id;
+		Args:
+			db_conn: Connection to the database.
+			result (dict): Result from `self.get_details_json()`.
 		"""
 
-		job_descriptions_query = """
-			INSERT INTO job_descriptions(job_id, description)
-			VALUES (%(job_id)s, %(description)s);
+		MONSTER_LOG.info('Adding result to database...')
+		BatchPersister(
+			db_conn,
+			batch_size=1,
+			dimension_cache=self.dimension_cache,
+			dedup_view=self.dedup_view,
+			near_duplicates=self.near_duplicates,
+			near_duplicate_action=self.near_duplicate_action,
+		).save_batch([result])
+
+	def prepare(self, db_conn):
 		"""
-
-		job_links_query = """
-			INSERT INTO job_links(job_id, external_url)
-			VALUES (%(job_id)s, %(external_url)s);
+		Ensures the tables the scraper relies on exist, warms the dimension cache
+			and opens the near-duplicate index, if enabled. Only runs once per scraper.
 		"""
 
-		job_link_exists_query = """
-			SELECT job_id
-			FROM job_links
-			WHERE external_url = %(external_url)s
-			LIMIT 1;
+		if self.prepared:
+			return
+		ensure_schema(db_conn, 'job_source_ids')
+		ensure_schema(db_conn, 'job_fingerprints')
+		ensure_schema(db_conn, 'job_duplicates')
+		self.dimension_cache.warm(db_conn)
+		if self.near_duplicates is None and self.near_duplicate_threshold:
+			MONSTER_LOG.info(f'Opening near-duplicate index at {DEFAULT_INDEX_PATH}...')
+			self.near_duplicates = NearDuplicateIndex(DEFAULT_INDEX_PATH, threshold=self.near_duplicate_threshold)
+		self.prepared = True
+
+	def filter_known_jobids(self, db_conn, jobids: List[str]) -> List[str]:
 		"""
+		Drops repeated jobids and jobids whose job is already stored, with one query.
 
-		company_exists_query = """
-			SELECT id
-			FROM companies
-			WHERE name = %(name)s
-			LIMIT 1;
-		"""
+		Args:
+			db_conn: Connection to the database.
+			jobids (List[str]): Jobids from a search.
 
-		companies_query = """
-			INSERT INTO companies(name, description, logo_url)
-			VALUES (%(name)s, %(description)s, %(logo_url)s)
-			RETURNING id;
+		Returns:
+			List[str]: Jobids still to be fetched, in their original order.
 		"""
 
-		company_populated_query = """
-			SELECT id
-			FROM companies
-			WHERE name = %(name)s
-				AND description IS NOT NULL
-			LIMIT 1;
-		"""
+		unique_jobids = list(OrderedDict.fromkeys(jobid for jobid in jobids if jobid))
+		try:
+			known = BatchPersister(db_conn).find_known_source_ids(self.source_name, unique_jobids)
+		except Exception as e:
+			MONSTER_LOG.warn(f'Exception {type(e)} while checking for known jobids, fetching all: {e}')
+			MONSTER_LOG.warn(e, exc_info=True)
+			db_conn.rollback()
+			known = set()
+		new_jobids = [jobid for jobid in unique_jobids if jobid not in known]
+		MONSTER_LOG.info(f'{len(jobids)} jobids found, {len(known)} already stored, {len(new_jobids)} to fetch.')
+		return new_jobids
 
-		companies_update_query = """
-			UPDATE companies
-			SET logo_url = %(logo_url)s,
-				description = %(description)s
-			WHERE id = %(company_id)s
-			RETURNING id;
+	def get_jobids_from_page(self, content_xpath: str) -> List[str]:
 		"""
+		Gets the data-jobid of every element matching `content_xpath` on the current page.
+			Runs as a single script, so it costs one WebDriver round-trip however many results there are.
 
-		job_companies_query = """
-			INSERT INTO job_companies(job_id, company_id)
-			VALUES (%(job_id)s, %(company_id)s);
-		"""
+		Args:
+			content_xpath (str): XPath of the search result cards.
 
-		location_exists_query = """
-			SELECT id
-			FROM locations
-			WHERE city = %(city)s
-				AND state_province = %(state_province)s
-			LIMIT 1;
+		Returns:
+			List[str]: Jobids, in page order.
 		"""
 
-		locations_query = """
-			INSERT INTO locations(city, state_province, country)
-			VALUES (%(city)s, %(state_province)s, %(country)s)
-			RETURNING id;
+		script = """
+			var snapshot = document.evaluate(
+				arguments[0], document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null
+			);
+			var jobids = [];
+			for (var i = 0; i < snapshot.snapshotLength; i++) {
+				jobids.push(snapshot.snapshotItem(i).getAttribute('data-jobid'));
+			}
+			return jobids;
 		"""
+		MONSTER_LOG.info(f'Getting jobids for elements: {content_xpath}')
+		jobids = self.driver.execute_script(script, content_xpath) or []
+		return [jobid for jobid in jobids if jobid]
 
-		job_locations_query = """
-			INSERT INTO job_locations(job_id, location_id)
-			VALUES (%(job_id)s, %(location_id)s);
+	def search_jobids(self, job_title='', job_location='', checkpoint: Optional[SearchCheckpoint] = None) -> Iterator[str]:
 		"""
+		Yields the jobid of every search result, using the scraper's search backend.
 
-		try:
-			MONSTER_LOG.info('Setting isolation level to READ COMMITTED')
-			db_conn.set_isolation_level(1)
-
-			MONSTER_LOG.info('Starting transactions...')
-			curr = db_conn.cursor()
-
-			# Get the company id if it exists
-			curr.execute(
-				company_exists_query,
-				{
-					'name': result['company_name'],
-				}
-			)
-			qr = curr.fetchone()
-			if qr is not None:
-				MONSTER_LOG.info(f'Company {result["company_name"]} already exists in DB.')
-				company_id = qr[0]
-			else:
-				# Otherwise, insert the company and get the id
-				MONSTER_LOG.info(f'Company {result["company_name"]} not yet in DB, adding...')
-				curr.execute(
-					companies_query,
-					{
-						'name': result['company_name'],
-						'description': result['company_description'],
-						'logo_url': result['company_logo_url'],
-					}
-				)
-				company_id = curr.fetchone()[0]
-
-			# Get the company id if it is not fully populated
-			curr.execute(
-				company_populated_query,
-				{
-					'name': result['company_name'],
-				}
-			)
-			qr = curr.fetchone()
-			if qr is not None:
-				MONSTER_LOG.info(f'Company {result["company_name"]} fully-populated in DB.')
-				company_id = qr[0]
-			else:
-				# Otherwise, insert the company and get the id
-				MONSTER_LOG.info(f'Company {result["company_name"]} not complete in DB, populating...')
-				curr.execute(
-					companies_update_query,
-					{
-						'company_id': company_id,
-						'description': result['company_description'],
-						'logo_url': result['company_logo_url'],
-					}
-				)
-				company_id = curr.fetchone()[0]
-
-			# Get the location id if it exists
-			curr.execute(
-				location_exists_query,
-				{
-					'city': result['city'],
-					'state_province': result['state_province'],
-				}
-			)
-			qr = curr.fetchone()
-			if qr is not None:
-				MONSTER_LOG.info(f'Location {result["city"]}, {result["state_province"]} already exists in DB.')
-				location_id = qr[0]
-			else:
-				# Otherwise, insert the location and get the id
-				MONSTER_LOG.info(f'Location {result["city"]}, {result["state_province"]} not yet in DB, adding...')
-				curr.execute(
-					locations_query,
-					{
-						'city': result['city'],
-						'state_province': result['state_province'],
-						'country': result['country'],
-					}
-				)
-				location_id = curr.fetchone()[0]
-
-			# Get the job listing id if it exists
-			curr.execute(
-				job_exists_query,
-				{
-					'title': result['title'],
-					'description': result['description'],
-				}
-			)
-			qr = curr.fetchone()
-			# Get the job listing id if it exists, by company
-			curr.execute(
-				job_exists_query_2,
-				{
-					'title': result['title'],
-					'name': result['company_name'],
-				}
-			)
-			job_id = None
-			qr2 = curr.fetchone()
-
-			# Get the job listing id if it exists, by link url
-			curr.execute(
-				job_link_exists_query,
-				{
-					'external_url': result['inner_link'],
-				}
-			)
-			qr3 = curr.fetchone()
-			if qr is not None:
-				MONSTER_LOG.info(f'Job listing for {result["title"]} already exists in DB.')
-				job_id = qr[0]
-			if qr2 is not None:
-				MONSTER_LOG.info(f'Job listing for {result["title"]} at company {result["company_name"]} already exists in DB.')
-				job_id = qr2[0]
-			if qr3 is not None:
-				MONSTER_LOG.info(f'A job listing with url {result["inner_link"]} already exists in DB.')
-				job_id = qr3[0]
-			if job_id is None:
-				# Otherwise, insert the job listing and get the id
-				MONSTER_LOG.info(f'Job listing for {result["title"]} not yet in DB, adding...')
-				curr.execute(
-					job_listings_query,
-					{
-						'title': result['title'],
-						'post_date_utc': result['timestamp'],
-					}
-				)
-				job_id = curr.fetchone()[0]
-
-				# Also add the relation to companies
-				MONSTER_LOG.info(f'Adding relation job_id {job_id} to company_id {company_id}...')
-				curr.execute(
-					job_companies_query,
-					{
-						'job_id': job_id,
-						'company_id': company_id,
-					}
-				)
+		Args:
+			job_title (str, optional): Job title to search for.
+			job_location (str, optional): Location to search in.
+			checkpoint (SearchCheckpoint, optional): Checkpoint to record jobids in as they are found.
+				The 'http' backend resumes paging after the last page it recorded,
+				and only yields jobids not recorded already.
 
-				# Also add the relation to locations
-				MONSTER_LOG.info(f'Adding relation job_id {job_id} to location_id {location_id}...')
-				curr.execute(
-					job_locations_query,
-					{
-						'job_id': job_id,
-						'location_id': location_id,
-					}
-				)
+		Yields:
+			str: Jobids, in result order.
+		"""
 
-				# And the description
-				MONSTER_LOG.info('Saving description...')
-				curr.execute(
-					job_descriptions_query,
-					{
-						'job_id': job_id,
-						'description': result['description'],
-					}
-				)
+		if self.search_backend == 'http':
+			return self.search_jobids_http(job_title=job_title, job_location=job_location, checkpoint=checkpoint)
+		jobids = self.search_jobids_browser(job_title=job_title, job_location=job_location)
+		if checkpoint is not None:
+			# "Load more" can only be replayed from the first page, so the browser search is recorded whole
+			jobids = checkpoint.add_page(1, jobids)
+			checkpoint.mark_complete()
+		return iter(jobids)
 
-				# And the link to the job
-				MONSTER_LOG.info('Saving link...')
-				curr.execute(
-					job_links_query,
-					{
-						'job_id': job_id,
-						'external_url': result['inner_link'],
-					}
-				)
+	def search_jobids_browser(self, job_title='', job_location='') -> List[str]:
+		"""
+		Gets every jobid for a search by clicking "load more" in PhantomJS until it disappears.
+			The driver is borrowed from the driver pool for the length of the search.
+		"""
 
-			curr.close()
-			MONSTER_LOG.info('Committing changes...')
-			db_conn.commit()
-			MONSTER_LOG.info('Added result to database.')
+		pool = self.get_driver_pool()
+		self.use_pooled_driver(pool.acquire())
+		try:
+			return self.browse_jobids(pool, job_title=job_title, job_location=job_location)
+		finally:
+			if self.pooled_driver is not None:
+				pool.release(self.pooled_driver)
+			self.use_pooled_driver(None)
 
-		except Exception as e:
-			MONSTER_LOG.warn(f'Exception {type(e)} while executing transaction: {e}')
-			MONSTER_LOG.warn(e, exc_info=True)
+	def use_pooled_driver(self, pooled: Optional[PooledDriver]) -> None:
+		"""
+		Makes a borrowed driver the scraper's current driver, or clears the current driver if None.
+		"""
 
-			MONSTER_LOG.info('Attempting to close cursor...')
-			try:
-				curr.close()
-			except Exception as e2:
-				MONSTER_LOG.warn(f'Exception {type(e2)} while closing cursor, skipping: {e2}')
+		self.pooled_driver = pooled
+		self.driver = pooled.driver if pooled is not None else None
+		self.wait = WebDriverWait(self.driver, self.max_wait) if pooled is not None else None
 
-			MONSTER_LOG.info('Attempting to rollback transaction...')
-			try:
-				db_conn.rollback()
-			except Exception as e2:
-				MONSTER_LOG.warn(f'Exception {type(e2)} while rolling back, skipping: {e2}')
+	def browse_jobids(self, pool: DriverPool, job_title='', job_location='') -> List[str]:
+		"""
+		Runs a search in the borrowed driver, replacing it from `pool` if it fails to load the search page.
+		"""
 
-	def get_jobs(self, db_conn, job_title='', job_location=''):
-		self.establish_driver()
 		url = self.build_search_url(job_title=job_title, job_location=job_location)
 		max_tries = 3
 		tries = 0
@@ -435,14 +454,17 @@ class MonsterScraper(DataRetriever):
 		while tries < max_tries:
 			MONSTER_LOG.info(f'Getting url: {url} (try {tries + 1} of {max_tries})')
 			try:
+				self.pooled_driver.pages += 1
 				self.driver.get(url)
 				break
 			except Exception as e:
 				tries += 1
 				MONSTER_LOG.warn(f'Exception {type(e)} while getting search page: {e}')
 				MONSTER_LOG.warn(e, exc_info=True)
-				MONSTER_LOG.info('Reestablishing driver...')
-				self.establish_driver()
+				MONSTER_LOG.info('Replacing driver...')
+				self.use_pooled_driver(pool.replace(self.pooled_driver))
+				if self.pooled_driver is None:
+					raise Exception('Unable to replace driver after failing to get search page.')
 				time.sleep(wait_time)
 
 		content_xpath = '//*[@id="SearchResults"]/*[contains(@class, "card-content") and not(contains(@class, "apas-ad"))]'
@@ -458,7 +480,6 @@ class MonsterScraper(DataRetriever):
 		page_count = 1
 		tries = 0
 		max_tries = 3
-		wait_time = 0
 		while tries < max_tries:
 			MONSTER_LOG.info(f'Attempting to load more jobs (try {tries + 1} of {max_tries}) (page {page_count})')
 			try:
@@ -468,96 +489,214 @@ class MonsterScraper(DataRetriever):
 					)
 				)
 
+				# Each click requests another result page, so it is paced like any other request
+				self.rate_limiter.acquire()
+				self.pooled_driver.pages += 1
 				self.driver.execute_script("arguments[0].click();", load_button)
 
 				tries = 0
 				page_count += 1
 
-				MONSTER_LOG.info(f'Loaded jobs, waiting {wait_time} seconds...')
-				time.sleep(wait_time)
+				MONSTER_LOG.info('Loaded jobs.')
 			except Exception as e:
 				tries += 1
 				MONSTER_LOG.warn(f'Exception {type(e)} while loading more jobs: {e}')
 				MONSTER_LOG.warn(e, exc_info=True)
-				time.sleep(wait_time)
 
-		MONSTER_LOG.info(f'Getting elements: {content_xpath}')
-		result_elements = self.driver.find_elements_by_xpath(
-			content_xpath
+		MONSTER_LOG.info(f'Getting jobids, start time: {datetime.datetime.now()}')
+		jobids = self.get_jobids_from_page(content_xpath)
+		MONSTER_LOG.info(f'Got {len(jobids)} jobids, end time: {datetime.datetime.now()}')
+		return jobids
+
+	def search_jobids_http(self, job_title='', job_location='', checkpoint: Optional[SearchCheckpoint] = None) -> Iterator[str]:
+		"""
+		Yields every jobid for a search by requesting result pages over plain HTTP.
+			No browser is started. Paging stops once a page has no new jobids,
+			has no "load more" button, or `max_search_pages` is reached.
+		"""
+
+		seen = set()
+		first_page = 1
+		if checkpoint is not None:
+			seen.update(checkpoint.jobids)
+			first_page = checkpoint.last_page + 1
+			if first_page > 1:
+				MONSTER_LOG.info(f'Resuming search from page {first_page}, {len(seen)} jobids already found.')
+		for page in range(first_page, self.max_search_pages + 1):
+			url = self.build_search_url(job_title=job_title, job_location=job_location, page=page)
+			MONSTER_LOG.info(f'Getting search page {page}: {url}')
+			self.rate_limiter.acquire()
+			html = get_response(self.session, url, timeout=self.request_timeout, rate_limiter=self.rate_limiter).text
+
+			parser = MonsterSearchPageParser()
+			parser.feed(html)
+			parser.close()
+			new_jobids = [jobid for jobid in parser.jobids if jobid not in seen]
+			MONSTER_LOG.info(f'Got {len(new_jobids)} new jobids from page {page}.')
+			if not new_jobids:
+				break
+			seen.update(new_jobids)
+			if checkpoint is not None:
+				checkpoint.add_page(page, new_jobids)
+			for jobid in new_jobids:
+				yield jobid
+			if not parser.has_more:
+				break
+		if checkpoint is not None:
+			checkpoint.mark_complete()
+
+	def build_pipeline(self, persister: BatchPersister) -> Pipeline:
+		"""
+		Builds the fetch -> convert -> persist pipeline for one search.
+
+		Fetching runs on the asyncio DetailsFetcher with `max_in_flight` requests,
+			converting on `convert_workers` threads, or one per conversion process if there are more,
+			and persisting on one thread,
+			since it owns the database connection.
+
+		Args:
+			persister (BatchPersister): Persister the results are saved with.
+
+		Returns:
+			Pipeline: Pipeline taking jobids as input.
+		"""
+
+		fetch = Stage('fetch', queue_size=self.queue_size)
+		fetcher = DetailsFetcher(
+			fetch.timed(self.get_details_data),
+			max_in_flight=self.max_in_flight,
+			# With a response cache, only the requests it cannot avoid are rate limited, when they are made
+			rate_limiter=self.rate_limiter if self.response_cache is None else None,
 		)
-		result_elements_count = len(result_elements)
-		MONSTER_LOG.info(f'Got {result_elements_count} elements.')
 
-		MONSTER_LOG.info(f'Getting jobids, start time: {datetime.datetime.now()}')
-		result_element_jobids = []
-		for index, result_element in enumerate(result_elements):
-			try:
-				MONSTER_LOG.info(f'Getting jobid for element {index + 1} of {result_elements_count}')
-				result_element_jobids.append(result_element.get_attribute('data-jobid'))
-				result_elements[index] = None  # More RAM reduction
-			except Exception as e:
-				MONSTER_LOG.warn(f'Exception {type(e)} while getting jobid for element {index + 1}: {e}')
-				MONSTER_LOG.warn(e, exc_info=True)
-		MONSTER_LOG.info(f'Done getting jobids, end time: {datetime.datetime.now()}')
+		def stream_details(jobids, emit):
+			def deliver(jobid, data, exception):
+				if exception is None:
+					emit((jobid, data))
+					return
+				# The fetcher has logged the exception and the stage counted it; the job itself is lost for this run,
+				# unless another search finds it again
+				with self._jobs_failed_lock:
+					self.jobs_failed += 1
+				self.dedup_view.release_jobids(self.source_name, [jobid])
 
-		del result_elements  # Reduce RAM usage
-		self.deestablish_driver()
+			fetcher.stream(jobids, deliver)
 
-		MONSTER_LOG.info(f'Getting job info, start time: {datetime.datetime.now()}')
-		for index, result_element_jobid in enumerate(result_element_jobids):
+		def convert_details(jobid_data):
 			try:
-				MONSTER_LOG.info(f'Waiting {self.get_info_delay} seconds...')
-				time.sleep(self.get_info_delay)
-				MONSTER_LOG.info(f'Getting job info for element {index + 1} of {result_elements_count}')
-				result = self.get_details_json(result_element_jobid)
-				self.add_to_db(db_conn, result)
-			except Exception as e:
-				MONSTER_LOG.warn(f'Exception {type(e)} while getting info for element {index + 1}: {e}')
-				MONSTER_LOG.warn(e, exc_info=True)
-		MONSTER_LOG.info(f'Done getting job info, end time: {datetime.datetime.now()}.')
+				return self.parse_details(*jobid_data)
+			except Exception:
+				# The stage logs the exception and drops the job
+				with self._jobs_failed_lock:
+					self.jobs_failed += 1
+				raise
+
+		fetch.stream = stream_details
+		convert = Stage(
+			'convert',
+			func=convert_details,
+			# Each thread waits on its own conversion, so fewer threads than processes would leave processes idle
+			workers=max(self.convert_workers, self.normalizer.processes),
+			queue_size=self.queue_size,
+		)
+		persist = Stage(
+			'persist',
+			func=persister.add,
+			queue_size=self.queue_size,
+			on_finish=persister.flush,
+		)
+		return Pipeline('monster', [fetch, convert, persist])
 
-	def get_details_json(self, result_element_jobid, max_tries=5):
-		MONSTER_LOG.info(f'Getting info for jobid: {result_element_jobid}')
-		for tries in range(max_tries):
-			try:
-				details_url = self.build_details_url(result_element_jobid)
-				MONSTER_LOG.info(f'Getting url: {details_url}')
-				data = requests.get(details_url).json()
-				break
-			except Exception as e:
-				MONSTER_LOG.warn(f'Exception getting info for jobid: {result_element_jobid}: {e}')
-				MONSTER_LOG.warn(e, exc_info=True)
-				wait_time = 3
-				MONSTER_LOG.info(f'Waiting {wait_time} seconds...')
-				time.sleep(wait_time)
+	def get_jobs(self, db_conn, job_title='', job_location=''):
+		search = self.checkpoint.search(job_title) if self.checkpoint is not None else None
+		if search is not None and search.complete:
+			MONSTER_LOG.info(f'Search for {job_title} already done, resuming with {len(search.jobids)} jobids, {len(search.done)} of them done.')
 		else:
-			raise Exception('Unable to get info after 5 tries.')
+			result_element_jobids = list(self.search_jobids(job_title=job_title, job_location=job_location, checkpoint=search))
+		if search is not None:
+			result_element_jobids = search.pending()
+
+		# Claiming before filtering means a jobid another scraper has just released is seen as stored, not fetched again.
+		# Filtering happens before the pipeline starts, as the persist stage owns db_conn while it runs
+		claimed_jobids = self.dedup_view.claim_jobids(self.source_name, result_element_jobids)
+		result_element_jobids = self.filter_known_jobids(db_conn, claimed_jobids)
+		to_fetch = set(result_element_jobids)
+		if search is not None:
+			search.mark_done(jobid for jobid in claimed_jobids if jobid not in to_fetch)
+		self.dedup_view.release_jobids(self.source_name, (jobid for jobid in claimed_jobids if jobid not in to_fetch))
+		if self.near_duplicates is not None:
+			self.near_duplicates.refresh()
+
+		MONSTER_LOG.info(f'Getting job info for {len(result_element_jobids)} jobids, start time: {datetime.datetime.now()}')
+		persister = BatchPersister(
+			db_conn,
+			batch_size=self.persist_batch_size,
+			dimension_cache=self.dimension_cache,
+			dedup_view=self.dedup_view,
+			near_duplicates=self.near_duplicates,
+			near_duplicate_action=self.near_duplicate_action,
+			on_commit=(lambda results: search.mark_done(result['source_id'] for result in results)) if search is not None else None,
+		)
+		jobs_failed = self.jobs_failed
+		try:
+			self.build_pipeline(persister).run(result_element_jobids)
+		finally:
+			# Saved jobids are now filtered out as stored, and failed ones are free for a later search to retry
+			self.dedup_view.release_jobids(self.source_name, result_element_jobids)
+		self.rows_added += persister.rows_added
+		with self._jobs_failed_lock:
+			self.jobs_failed += persister.rows_failed
+		MONSTER_LOG.info(f'Added {persister.rows_added} new job listings.')
+		if self.jobs_failed > jobs_failed:
+			MONSTER_LOG.warn(f'Failed to fetch, convert or save {self.jobs_failed - jobs_failed} jobs.')
+		MONSTER_LOG.info(f'Dimension cache stats: {self.dimension_cache.stats()}')
+		MONSTER_LOG.info(f'Normalizer stats: {self.normalizer.stats()}')
+		if self.near_duplicates is not None:
+			MONSTER_LOG.info(f'Near-duplicate index stats: {self.near_duplicates.stats()}')
+		MONSTER_LOG.info(f'Done getting job info, end time: {datetime.datetime.now()}.')
 
-		MONSTER_LOG.info('Converting description to text...')
-		description_text = re.sub(
-			r'\n\n(\s+\n)+',
-			'\n\n',
-			re.sub(
-				r'\n+',
-				'\n\n',
-				self.html_converter.handle(
-					data['jobDescription'].replace('\n', '<br />')
-				)
+	def get_details_data(self, result_element_jobid, max_tries=5) -> dict:
+		"""
+		Gets the raw details document for a jobid, through the response cache if there is one.
+		"""
+
+		MONSTER_LOG.info(f'Getting info for jobid: {result_element_jobid}')
+		details_url = self.build_details_url(result_element_jobid)
+		MONSTER_LOG.info(f'Getting url: {details_url}')
+		if self.response_cache is not None:
+			return self.response_cache.get_json(
+				self.session,
+				str(result_element_jobid),
+				details_url,
+				max_tries=max_tries,
+				timeout=self.request_timeout,
+				rate_limiter=self.rate_limiter,
 			)
+		return get_json(
+			self.session,
+			details_url,
+			max_tries=max_tries,
+			timeout=self.request_timeout,
+			rate_limiter=self.rate_limiter,
 		)
 
+	def get_details_json(self, result_element_jobid, max_tries=5) -> dict:
+		"""
+		Gets the details for a jobid and converts them to a result dict.
+		"""
+
+		return self.parse_details(result_element_jobid, self.get_details_data(result_element_jobid, max_tries=max_tries))
+
+	def parse_details(self, result_element_jobid, data: dict) -> dict:
+		"""
+		Converts a raw details document to a result dict, as saved by BatchPersister.
+		"""
+
+		MONSTER_LOG.info('Converting description to text...')
+		description_text = self.normalizer.normalize(data['jobDescription'])
+
 		MONSTER_LOG.info('Converting company description to text...')
-		company_description = re.sub(
-			r'\n\n(\s+\n)+',
-			'\n\n',
-			re.sub(
-				r'\n+',
-				'\n\n',
-				self.html_converter.handle(
-					data['companyInfo'].get('description', '').replace('\n', '<br />')
-				)
-			)
-		)
+		company_description = self.normalizer.normalize_company(data['companyInfo'].get('description', ''))
 
 		MONSTER_LOG.info(f'Getting info...')
 		title = data['companyInfo']['companyHeader'].replace(f' at {data["companyInfo"].get("name", "")}', '').strip()
@@ -566,16 +705,18 @@ class MonsterScraper(DataRetriever):
 		else:
 			link = data['submitButtonUrl']
 		result = {
-			'description': description_text.strip(),
+			'description': description_text,
 			'company_name': data['companyInfo'].get('name', ''),
 			'company_logo_url': data['companyInfo'].get('logo', {}).get('src', ''),
-			'company_description': company_description.strip(),
+			'company_description': company_description,
 			'title': title,
 			'inner_link': link,
 			'country': data.get('jobLocationCountry', ''),
 			'state_province': titlecase(data.get('jobLocationRegion', '')),
 			'city': titlecase(data.get('jobLocationCity', '')),
 			'timestamp': int(time.time()),
+			'source': self.source_name,
+			'source_id': result_element_jobid,
 		}
 		MONSTER_LOG.info('Got details.')
 		MONSTER_LOG.info(f'Result: {result}')
@@ -586,17 +727,134 @@ class MonsterScraper(DataRetriever):
 			self,
 			db_connection,
 			title_list: Optional[List[str]] = None,
+			workers: Optional[int] = None,
 			**kwargs
 	) -> None:
+		"""
+		Scrapes every title in `title_list` and saves the results.
+
+		Unless checkpoints are disabled, progress is checkpointed as the sweep goes,
+			and if the last sweep was interrupted, its remaining titles are scraped instead of `title_list`,
+			skipping searches and jobids that were already finished.
+
+		Args:
+			db_connection: Connection to the database.
+			title_list (List[str], optional): Titles to search for. Defaults to default_title_list, shuffled.
+			workers (int, optional): Number of titles scraped at once.
+				Defaults to the SCRAPER_TITLE_WORKERS setting, or 1.
+		"""
+
 		if title_list is None:
 			title_list = self.default_title_list
 			random.shuffle(title_list)
+		if workers is None:
+			workers = config('SCRAPER_TITLE_WORKERS', default=1, cast=int)
+
+		self.prepare(db_connection)
+		if self.checkpoint is None and config('SCRAPER_CHECKPOINTS', default=True, cast=bool):
+			self.checkpoint = ScrapeCheckpoint(self.source_name)
+		if self.checkpoint is not None:
+			title_list = self.checkpoint.start_sweep(title_list)
+		if self.search_backend == 'browser' and title_list:
+			# Every title worker needs a driver, and starting them ahead of time hides their start-up cost
+			self.get_driver_pool(size=max(workers, config('SCRAPER_DRIVER_POOL_SIZE', default=1, cast=int))).warm()
+
+		if workers > 1:
+			self.get_jobs_parallel(title_list, workers)
+		else:
+			for job in title_list:
+				self.get_jobs_for_title(db_connection, job)
+
+		if self.checkpoint is not None:
+			self.checkpoint.finish_sweep()
+
+	def get_jobs_for_title(self, db_conn, job_title: str) -> None:
+		"""
+		Scrapes one title of a sweep, logging failures rather than raising them,
+			and records the outcome in the checkpoint.
+		"""
+
+		try:
+			self.get_jobs(db_conn, job_title=job_title)
+		except Exception as e:
+			MONSTER_LOG.warning(f'Failure while getting jobs for title {job_title}: {e}')
+			MONSTER_LOG.warn(e, exc_info=True)
+			if self.checkpoint is not None:
+				self.checkpoint.fail_title(job_title)
+			return
+		if self.checkpoint is not None:
+			self.checkpoint.complete_title(job_title)
+
+	def make_worker(self) -> 'MonsterScraper':
+		"""
+		Creates a scraper for a title worker.
+			It has its own HTTP session, but shares this scraper's rate limiter,
+			driver pool, response cache, dimension cache, dedup view, near-duplicate index and checkpoint.
+		"""
+
+		worker = type(self)(
+			max_wait=self.max_wait,
+			max_in_flight=self.max_in_flight,
+			rate_limiter=self.rate_limiter,
+			persist_batch_size=self.persist_batch_size,
+			dimension_cache=self.dimension_cache,
+			search_backend=self.search_backend,
+			search_base_url=self.search_base_url,
+			details_base_url=self.details_base_url,
+			max_search_pages=self.max_search_pages,
+			dedup_view=self.dedup_view,
+			convert_workers=self.convert_workers,
+			queue_size=self.queue_size,
+			normalizer=self.normalizer,
+			near_duplicates=self.near_duplicates,
+			near_duplicate_threshold=self.near_duplicate_threshold,
+			near_duplicate_action=self.near_duplicate_action,
+			checkpoint=self.checkpoint,
+			driver_pool=self.driver_pool,
+			response_cache=self.response_cache,
+			connection_pool=self.connection_pool,
+		)
+		worker.prepared = self.prepared
+		return worker
+
+	def get_jobs_parallel(self, title_list: List[str], workers: int) -> None:
+		"""
+		Scrapes titles on a pool of workers, each with its own scraper and a database connection borrowed from the pool.
+
+		Args:
+			title_list (List[str]): Titles to search for.
+			workers (int): Number of worker threads.
+		"""
 
-		for job in title_list:
+		titles = queue.Queue()
+		for title in title_list:
+			titles.put(title)
+		rows_added_lock = threading.Lock()
+		pool = self.connection_pool if self.connection_pool is not None else get_pool()
+
+		def work(worker_number):
+			MONSTER_LOG.info(f'Title worker {worker_number} starting...')
+			with pool.connection() as db_conn, self.make_worker() as worker:
+				while True:
+					try:
+						job = titles.get_nowait()
+					except queue.Empty:
+						break
+					MONSTER_LOG.info(f'Title worker {worker_number} getting jobs for title {job}')
+					worker.get_jobs_for_title(db_conn, job)
+				with rows_added_lock:
+					self.rows_added += worker.rows_added
+					self.jobs_failed += worker.jobs_failed
+			MONSTER_LOG.info(f'Title worker {worker_number} done.')
+
+		MONSTER_LOG.info(f'Getting jobs for {len(title_list)} titles with {workers} workers...')
+		with ThreadPoolExecutor(max_workers=workers) as executor:
+			futures = [executor.submit(work, worker_number) for worker_number in range(workers)]
+		for future in futures:
 			try:
-				self.get_jobs(db_connection, job_title=job)
+				future.result()
 			except Exception as e:
-				MONSTER_LOG.warning(f'Failure while getting jobs for title {job}: {e}')
+				MONSTER_LOG.warning(f'Title worker failed: {e}')
 				MONSTER_LOG.warn(e, exc_info=True)
 
 	def __enter__(self):
@@ -606,5 +864,12 @@ class MonsterScraper(DataRetriever):
 		MONSTER_LOG.info(f'__exit__ called, cleaning up...')
 		MONSTER_LOG.info(f'exc_type: {exc_type}')
 		self.deestablish_driver()
+		if self._owns_driver_pool:
+			self.driver_pool.close()
+		self.session.close()
+		if self._owns_response_cache:
+			self.response_cache.close()
+		if self._owns_normalizer:
+			self.normalizer.close()
 
 
@@ -0,0 +1,154 @@
+"""
+Pooled HTTP sessions and retry handling.
+"""
+
+import logging
+import random
+import time
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from typing import Optional, Tuple, Union
+
+from datafunctions.retrieve.ratelimit import RateLimiter
+
+SESSION_LOG = logging.getLogger(__name__)
+
+# Statuses worth retrying: the server is throttling us or briefly unavailable
+RETRY_STATUSES = frozenset([408, 429, 500, 502, 503, 504])
+
+
+def build_session(pool_size: int = 10) -> requests.Session:
+	"""
+	Builds a keep-alive session whose connection pool fits `pool_size` concurrent requests.
+
+	Args:
+		pool_size (int, optional): Connections kept open per host. Defaults to 10.
+
+	Returns:
+		requests.Session: The session.
+	"""
+
+	session = requests.Session()
+	adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+	session.mount('https://', adapter)
+	session.mount('http://', adapter)
+	return session
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+	"""
+	Exponential backoff with full jitter.
+
+	Args:
+		attempt (int): Zero-indexed number of the failed attempt.
+		base (float, optional): Delay ceiling for the first retry, in seconds. Defaults to 1.0.
+		cap (float, optional): Maximum delay ceiling, in seconds. Defaults to 60.0.
+
+	Returns:
+		float: Seconds to wait before the next attempt.
+	"""
+
+	return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def retry_after_seconds(response: requests.Response) -> Optional[float]:
+	"""
+	Reads a numeric Retry-After header, if the server sent one.
+	"""
+
+	try:
+		return float(response.headers.get('Retry-After'))
+	except (TypeError, ValueError):
+		return None
+
+
+def get_response(
+		session: requests.Session,
+		url: str,
+		max_tries: int = 5,
+		timeout: Union[float, Tuple[float, float]] = (5, 30),
+		backoff_base: float = 1.0,
+		backoff_cap: float = 60.0,
+		rate_limiter: Optional[RateLimiter] = None,
+		headers: Optional[dict] = None,
+) -> requests.Response:
+	"""
+	Gets a URL, retrying transient failures.
+
+	Connection errors, timeouts and RETRY_STATUSES are retried with exponential backoff,
+		honouring Retry-After when present. Any other error status is not going to improve
+		by retrying and is raised immediately.
+
+	Args:
+		session (requests.Session): Session to send the request with.
+		url (str): URL to get.
+		max_tries (int, optional): Maximum number of attempts. Defaults to 5.
+		timeout (float or (float, float), optional): Connect and read timeouts. Defaults to (5, 30).
+		backoff_base (float, optional): See `backoff_delay`. Defaults to 1.0.
+		backoff_cap (float, optional): See `backoff_delay`. Defaults to 60.0.
+		rate_limiter (RateLimiter, optional): Limiter the outcome of every attempt is recorded in,
+			and retries are paced by. The first attempt is left for the caller to pace.
+		headers (dict, optional): Extra request headers, e.g. for a conditional request.
+
+	Raises:
+		requests.HTTPError: On a non-retryable error status.
+		Exception: If every attempt failed.
+
+	Returns:
+		requests.Response: The successful response.
+	"""
+
+	for attempt in range(max_tries):
+		wait_time = backoff_delay(attempt, backoff_base, backoff_cap)
+		if attempt > 0 and rate_limiter is not None:
+			rate_limiter.acquire()
+		start = time.monotonic()
+		try:
+			response = session.get(url, timeout=timeout, headers=headers)
+		except (requests.ConnectionError, requests.Timeout) as e:
+			SESSION_LOG.warn(f'Exception {type(e)} getting {url} (try {attempt + 1} of {max_tries}): {e}')
+			if rate_limiter is not None:
+				rate_limiter.record(latency=time.monotonic() - start, error=True)
+		else:
+			retry_after = retry_after_seconds(response)
+			if rate_limiter is not None:
+				rate_limiter.record(latency=time.monotonic() - start, status=response.status_code, retry_after=retry_after)
+			if response.status_code not in RETRY_STATUSES:
+				response.raise_for_status()
+				return response
+			SESSION_LOG.warn(f'Status {response.status_code} getting {url} (try {attempt + 1} of {max_tries})')
+			if retry_after is not None:
+				wait_time = max(wait_time, retry_after)
+
+		if attempt + 1 < max_tries:
+			SESSION_LOG.info(f'Waiting {wait_time:.2f} seconds...')
+			time.sleep(wait_time)
+
+	raise Exception(f'Unable to get {url} after {max_tries} tries.')
+
+
+def get_json(session: requests.Session, url: str, **kwargs) -> dict:
+	"""
+	Gets and decodes a JSON document, retrying transient failures as `get_response` does.
+		A body that is not JSON is raised immediately rather than retried.
+
+	Args:
+		session (requests.Session): Session to send the request with.
+		url (str): URL to get.
+		**kwargs: Passed to `get_response`.
+
+	Raises:
+		ValueError: If the response body is not valid JSON.
+
+	Returns:
+		dict: The decoded document.
+	"""
+
+	response = get_response(session, url, **kwargs)
+	try:
+		return response.json()
+	except ValueError as e:
+		SESSION_LOG.warn(f'Invalid JSON from {url}, not retrying: {e}')
+		raise
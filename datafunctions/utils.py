@@ -2,6 +2,7 @@
 Common utility functions.
 """
 
+import hashlib
 import re
 
 
@@ -45,3 +46,22 @@ def titlecase(s: str) -> str:
 			)
 		)
 	)
+
+
+def content_fingerprint(title: str, description: str) -> str:
+	"""
+	Hashes a job's title and description, ignoring case and whitespace differences.
+
+	Args:
+		title (str): Job title
+		description (str): Job description text
+
+	Returns:
+		str: 40 character hex digest
+	"""
+
+	normalized = '\n'.join(
+		' '.join((text or '').split()).lower()
+		for text in (title, description)
+	)
+	return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
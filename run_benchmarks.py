@@ -0,0 +1,841 @@
+import argparse
+import json
+import logging
+import os
+import pickle
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import gensim
+import numpy as np
+import psycopg2
+import psycopg2.extensions
+import requests
+
+from decouple import config
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from sklearn.neighbors import KNeighborsClassifier
+from typing import List, Optional
+
+from datafunctions.database import ConnectionPool, connect
+from datafunctions.model.models.lda17 import LDA17Model, LDA17Scorer, infer_topic_distributions
+from datafunctions.model.neighbors import NeighborIndex
+from datafunctions.model.similar import LDA17_FILES_DIRECTORY, SimilarJobs
+from datafunctions.retrieve.checkpoint import ScrapeCheckpoint
+from datafunctions.retrieve.fetcher import DetailsFetcher
+from datafunctions.retrieve.neardup import NearDuplicateIndex, similarity
+from datafunctions.retrieve.ratelimit import AdaptiveRateLimiter, RateLimiter
+from datafunctions.retrieve.replay import ReplayFixtures, ReplayServer, generate_fixtures, record_fixtures
+from datafunctions.retrieve.retrievers.monster import MonsterScraper
+from datafunctions.retrieve.session import build_session, get_json
+
+
+def synthetic_description(generator: random.Random, vocabulary: list, length: int) -> str:
+	return ' '.join(generator.choice(vocabulary) for _ in range(length))
+
+
+def perturb(generator: random.Random, vocabulary: list, text: str, fraction: float) -> str:
+	"""
+	Replaces `fraction` of a text's words, mimicking a repost with small wording changes.
+	"""
+
+	words = text.split()
+	for position in generator.sample(range(len(words)), int(len(words) * fraction)):
+		words[position] = generator.choice(vocabulary)
+	return ' '.join(words)
+
+
+def benchmark_neardup(sizes: list, queries: int, threshold: float, edit_fraction: float, seed: int) -> None:
+	"""
+	Grows a near-duplicate index through `sizes` and times lookups at each size,
+		next to a brute-force comparison against every stored signature.
+	"""
+
+	generator = random.Random(seed)
+	vocabulary = [f'word{n}' for n in range(20000)]
+	index = NearDuplicateIndex(threshold=threshold)
+
+	documents = []
+	signatures = []
+	print(f'Near-duplicate lookup, threshold {threshold}, {queries} queries per size, bands x rows {index.bands} x {index.rows}')
+	print(f'{"indexed":>10} {"lsh us/query":>14} {"scan us/query":>14} {"recall":>8} {"false pos":>10} {"mean bucket":>12}')
+	for size in sizes:
+		while len(documents) < size:
+			text = synthetic_description(generator, vocabulary, generator.randint(150, 600))
+			documents.append(text)
+			signatures.append(index.signature(text))
+		index.add_many((job_id, signatures[job_id]) for job_id in range(len(index), size))
+		stacked = np.stack(signatures)
+
+		targets = generator.sample(range(size), queries)
+		query_signatures = [index.signature(perturb(generator, vocabulary, documents[target], edit_fraction)) for target in targets]
+
+		start = time.perf_counter()
+		results = [index.query(signature) for signature in query_signatures]
+		lsh_seconds = time.perf_counter() - start
+
+		start = time.perf_counter()
+		for signature in query_signatures:
+			scores = (stacked == signature).mean(axis=1)
+			np.flatnonzero(scores >= threshold)
+		scan_seconds = time.perf_counter() - start
+
+		found = sum(1 for target, matches in zip(targets, results) if any(job_id == target for job_id, _ in matches))
+		false_positives = sum(1 for target, matches in zip(targets, results) for job_id, _ in matches if job_id != target)
+		print(
+			f'{size:>10} {lsh_seconds / queries * 1e6:>14.1f} {scan_seconds / queries * 1e6:>14.1f}'
+			f' {found / queries:>8.3f} {false_positives:>10} {index.stats()["mean_bucket_size"]:>12}'
+		)
+
+	start = time.perf_counter()
+	for text in documents[:queries]:
+		index.signature(text)
+	print(f'Signature computation: {(time.perf_counter() - start) / queries * 1e6:.1f} us per description')
+
+	with tempfile.TemporaryDirectory() as directory:
+		path = os.path.join(directory, 'descriptions.minhash')
+		NearDuplicateIndex(path, threshold=threshold).add_many(enumerate(signatures))
+		start = time.perf_counter()
+		loaded = NearDuplicateIndex(path, threshold=threshold)
+		load_seconds = time.perf_counter() - start
+		appended = NearDuplicateIndex(path, threshold=threshold)
+		appended.add_many([(len(signatures), signatures[0])])
+		start = time.perf_counter()
+		refreshed = loaded.refresh()
+		refresh_seconds = time.perf_counter() - start
+		print(f'Loading {len(loaded)} signatures from disk: {load_seconds:.3f} s, loading {refreshed} appended: {refresh_seconds * 1e3:.3f} ms')
+		print(f'Similarity of stored and reloaded signature: {similarity(loaded.signatures[0], signatures[0]):.3f}')
+
+
+def private_memory_mb(pid: int) -> Optional[float]:
+	"""
+	Gets the memory a process does not share with any other, from /proc.
+
+	Returns:
+		float: Private memory in megabytes, or None if it cannot be read.
+	"""
+
+	try:
+		with open(f'/proc/{pid}/smaps_rollup') as f:
+			return sum(int(line.split()[1]) for line in f if line.startswith(('Private_Clean:', 'Private_Dirty:'))) / 1024
+	except (OSError, ValueError, IndexError):
+		return None
+
+
+def benchmark_lda(documents: int, words: int, processes: int, seed: int) -> None:
+	"""
+	Times lda17 topic inference one document at a time, as scoring used to,
+		against batched inference, on synthetic descriptions drawn from the model's vocabulary.
+		With `processes`, also times tokenizing and scoring across that many processes.
+	"""
+
+	files_directory = os.path.join(os.path.dirname(sys.modules[LDA17Model.__module__].__file__), LDA17Model.FILES_DIRECTORY)
+	model = gensim.models.LdaModel.load(os.path.join(files_directory, 'model'))
+	id2word = gensim.corpora.Dictionary.load(os.path.join(files_directory, 'id2word'))
+	generator = random.Random(seed)
+	vocabulary = list(id2word.token2id)
+	# Each description repeats words from its own small part of the vocabulary, so it leans towards some topics
+	texts = [synthetic_description(generator, generator.sample(vocabulary, 300), generator.randint(words // 2, words * 3 // 2)) for _ in range(documents)]
+
+	start = time.perf_counter()
+	bows = [id2word.doc2bow(tokens) for tokens in LDA17Model.sentence_to_words(texts)]
+	preprocess_seconds = time.perf_counter() - start
+
+	start = time.perf_counter()
+	single = np.zeros((documents, model.num_topics), dtype=np.float32)
+	for row, bow in enumerate(bows):
+		for topic, probability in model.get_document_topics(bow, minimum_probability=0, minimum_phi_value=0):
+			single[row, topic] = probability
+	single_seconds = time.perf_counter() - start
+
+	start = time.perf_counter()
+	batched = infer_topic_distributions(model, bows)
+	batched_seconds = time.perf_counter() - start
+
+	# Inference starts from a random point, so two runs of gensim differ by about as much
+	print(f'lda17 inference of {documents} descriptions, about {words} words each')
+	print(f'Tokenizing: {documents / preprocess_seconds:.0f} descriptions per second')
+	print(f'One at a time: {documents / single_seconds:.0f} descriptions per second')
+	print(f'Batched: {documents / batched_seconds:.0f} descriptions per second, {single_seconds / batched_seconds:.1f}x')
+	print(f'Mean absolute difference: {np.abs(single - batched).mean():.4f}, same top topic: {(single.argmax(axis=1) == batched.argmax(axis=1)).mean():.3f}')
+
+	if processes > 1:
+		scorer = LDA17Scorer(files_directory, processes=processes)
+		try:
+			# The first batch starts the processes and loads the model in each
+			scorer.score(texts[:processes * scorer.slices_per_process])
+			start = time.perf_counter()
+			scorer.score(texts)
+			parallel_seconds = time.perf_counter() - start
+			serial_scorer = LDA17Scorer(files_directory)
+			start = time.perf_counter()
+			serial_scorer.score(texts)
+			serial_seconds = time.perf_counter() - start
+			private = [private_memory_mb(pid) for pid in scorer.pool._processes]
+		finally:
+			scorer.close()
+		print(f'Tokenizing and scoring, 1 process: {documents / serial_seconds:.0f} descriptions per second')
+		print(f'Tokenizing and scoring, {processes} processes: {documents / parallel_seconds:.0f} descriptions per second, {serial_seconds / parallel_seconds:.1f}x')
+		if None not in private:
+			print(f'Private memory per process: {", ".join(f"{mb:.1f}" for mb in private)} MB')
+
+
+def benchmark_neighbors(sizes: list, batch: int, queries: int, k: int, refit_max: int, seed: int) -> None:
+	"""
+	Grows a nearest-neighbour index of topic vectors through `sizes`, `batch` jobs per update round,
+		and times its update rounds, queries and reopening at each size, next to refitting and pickling
+		a KNeighborsClassifier on every vector so far, as each round used to.
+	"""
+
+	generator = np.random.RandomState(seed)
+	query_vectors = generator.dirichlet([0.1] * 17, size=queries).astype(np.float32)
+	print(f'Nearest-neighbour index, {batch} jobs per update round, k={k}, {queries} queries per size')
+	print(f'{"indexed":>10} {"round ms":>10} {"refit s":>10} {"batched us/query":>17} {"single ms":>10} {"reopen ms":>10}')
+	with tempfile.TemporaryDirectory() as directory:
+		path = os.path.join(directory, 'topics')
+		index = NeighborIndex(path)
+		vectors = []
+		for size in sizes:
+			round_seconds = 0.0
+			while len(index) < size:
+				new = generator.dirichlet([0.1] * 17, size=min(batch, size - len(index))).astype(np.float32)
+				vectors.append(new)
+				start = time.perf_counter()
+				index.add_many(range(len(index), len(index) + len(new)), new)
+				round_seconds = time.perf_counter() - start
+
+			refit = ''
+			if size <= refit_max:
+				stacked = np.vstack(vectors)
+				start = time.perf_counter()
+				classifier = KNeighborsClassifier(n_neighbors=k).fit(stacked, np.arange(len(stacked)))
+				pickle.dumps(classifier)
+				refit = f'{time.perf_counter() - start:.2f}'
+				del stacked, classifier
+
+			start = time.perf_counter()
+			index.query(query_vectors, k=k)
+			batched_seconds = time.perf_counter() - start
+			start = time.perf_counter()
+			for vector in query_vectors[:20]:
+				index.query(vector, k=k)
+			single_seconds = (time.perf_counter() - start) / 20
+
+			# Opening only maps the store's files, so it should not grow with the index
+			start = time.perf_counter()
+			reopened = NeighborIndex(path, writable=False)
+			reopen_seconds = time.perf_counter() - start
+			del reopened
+			print(
+				f'{size:>10} {round_seconds * 1e3:>10.1f} {refit:>10} {batched_seconds / queries * 1e6:>17.1f}'
+				f' {single_seconds * 1e3:>10.2f} {reopen_seconds * 1e3:>10.2f}'
+			)
+
+		# The index is exact, so it must agree with a brute-force search
+		stacked = np.vstack(vectors)
+		sample = query_vectors[:10]
+		expected = np.sort(np.sqrt(((sample[:, None, :] - stacked[None, :, :]) ** 2).sum(axis=2)), axis=1)[:, :k]
+		_, distances = index.query(sample, k=k)
+		print(f'Largest distance error against brute force: {np.abs(distances - expected).max():.2e}')
+
+
+def run_similar_clients(lookup, clients: int, requests_per_client: int) -> dict:
+	"""
+	Runs `clients` threads, each calling `lookup(client, n)` `requests_per_client` times in turn,
+		and gathers the latency of every call that did not raise.
+	"""
+
+	latencies = []
+	failures = []
+	lock = threading.Lock()
+
+	def client(number: int) -> None:
+		for n in range(requests_per_client):
+			start = time.perf_counter()
+			try:
+				lookup(number, n)
+			except Exception as e:
+				with lock:
+					failures.append(f'{type(e).__name__}: {e}')
+				continue
+			with lock:
+				latencies.append(time.perf_counter() - start)
+
+	threads = [threading.Thread(target=client, args=(number,)) for number in range(clients)]
+	start = time.perf_counter()
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	seconds = time.perf_counter() - start
+	milliseconds = np.array(latencies) * 1e3 if latencies else np.zeros(1)
+	return {
+		'requests_per_second': len(latencies) / seconds,
+		'p50_ms': float(np.percentile(milliseconds, 50)),
+		'p95_ms': float(np.percentile(milliseconds, 95)),
+		'p99_ms': float(np.percentile(milliseconds, 99)),
+		'failures': len(failures),
+		'first_failure': failures[0] if failures else None,
+	}
+
+
+def benchmark_similar(
+		jobs: int,
+		max_batches: list,
+		max_wait_ms: float,
+		concurrency: list,
+		requests_per_client: int,
+		description_fraction: float,
+		k: int,
+		budget_ms: float,
+		url: Optional[str],
+		seed: int,
+) -> bool:
+	"""
+	Load-tests similar-jobs lookups. Each of `concurrency` clients sends `requests_per_client` lookups one after another,
+		`description_fraction` of them by description and the rest by job id, and latency percentiles are compared with `budget_ms`.
+		Lookups go to a SimilarJobs over a synthetic index of `jobs` jobs, once for each of `max_batches`,
+		or, with `url`, to a running app's /similar endpoint, by description only.
+
+	Returns:
+		bool: Whether the p99 latency of every run was within the budget.
+	"""
+
+	generator = random.Random(seed)
+	id2word = gensim.corpora.Dictionary.load(os.path.join(LDA17_FILES_DIRECTORY, 'id2word'))
+	vocabulary = list(id2word.token2id)
+	descriptions = [synthetic_description(generator, generator.sample(vocabulary, 300), generator.randint(150, 450)) for _ in range(200)]
+
+	header = f'{"max batch":>10} {"clients":>8} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"mean batch":>11} {"failures":>9}'
+	within_budget = True
+
+	def report(max_batch, clients: int, results: dict, mean_batch) -> None:
+		nonlocal within_budget
+		within_budget = within_budget and results['p99_ms'] <= budget_ms and not results['failures']
+		print(
+			f'{max_batch:>10} {clients:>8} {results["requests_per_second"]:>8.0f} {results["p50_ms"]:>8.2f} {results["p95_ms"]:>8.2f}'
+			f' {results["p99_ms"]:>8.2f} {mean_batch:>11} {results["failures"]:>9}'
+		)
+		if results['first_failure']:
+			print(f'First failure: {results["first_failure"]}')
+
+	if url is not None:
+		sessions = [requests.Session() for _ in range(max(concurrency))]
+
+		def lookup(client: int, n: int) -> None:
+			response = sessions[client].get(url, params={'description': descriptions[(client + n) % len(descriptions)], 'k': k}, timeout=30)
+			response.raise_for_status()
+
+		print(f'Similar jobs from {url}, k={k}, latency budget {budget_ms} ms')
+		print(header)
+		for clients in concurrency:
+			report('-', clients, run_similar_clients(lookup, clients, requests_per_client), '-')
+		return within_budget
+
+	with tempfile.TemporaryDirectory() as directory:
+		index_directory = os.path.join(directory, 'lda17')
+		vectors = np.random.RandomState(seed).dirichlet([0.1] * 17, size=jobs).astype(np.float32)
+		NeighborIndex(index_directory).add_many(range(jobs), vectors)
+		print(f'Similar jobs among {jobs} indexed, k={k}, {description_fraction:.0%} by description, latency budget {budget_ms} ms')
+		print(header)
+		for max_batch in max_batches:
+			# A generous timeout, so slow lookups are measured rather than failed
+			service = SimilarJobs(index_directory=index_directory, max_batch=max_batch, max_wait=max_wait_ms / 1000, timeout=60)
+			try:
+				def lookup(client: int, n: int) -> None:
+					if (client * requests_per_client + n) % 100 < description_fraction * 100:
+						service.similar(description=descriptions[(client + n) % len(descriptions)], k=k)
+					else:
+						service.similar(job_id=generator.randrange(jobs), k=k)
+
+				for clients in concurrency:
+					before = service.stats()
+					results = run_similar_clients(lookup, clients, requests_per_client)
+					after = service.stats()
+					batches = after['batches'] - before['batches']
+					report(max_batch, clients, results, f'{(after["requests"] - before["requests"]) / batches:.1f}' if batches else '-')
+			finally:
+				service.close()
+	return within_budget
+
+
+class ThrottlingServer(ThreadingMixIn, HTTPServer):
+	"""
+	Local HTTP server that answers like a site tolerating `capacity` requests per second:
+		requests beyond that get a 429 with a Retry-After, and the rest a small JSON document after `latency` seconds.
+	"""
+
+	daemon_threads = True
+
+	def __init__(self, capacity: float, latency: float = 0.05, retry_after: float = 1.0):
+		super().__init__(('127.0.0.1', 0), ThrottlingHandler)
+		self.limiter = RateLimiter(capacity, burst=max(1, int(capacity)))
+		self.latency = latency
+		self.retry_after = retry_after
+		self.served = 0
+		self.throttled = 0
+		self.lock = threading.Lock()
+
+	@property
+	def url(self) -> str:
+		return f'http://127.0.0.1:{self.server_port}/'
+
+
+class ThrottlingHandler(BaseHTTPRequestHandler):
+	def do_GET(self):
+		# A request that would have to wait for a slot is over the server's capacity
+		if self.server.limiter.reserve() > 0:
+			with self.server.lock:
+				self.server.throttled += 1
+			self.send_response(429)
+			self.send_header('Retry-After', str(self.server.retry_after))
+			self.end_headers()
+			return
+		time.sleep(self.server.latency)
+		with self.server.lock:
+			self.server.served += 1
+		body = b'{"ok": true}'
+		self.send_response(200)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+
+def benchmark_ratelimit(capacity: float, start_rate: float, max_rate: float, duration: float, max_in_flight: int) -> None:
+	"""
+	Fetches from a ThrottlingServer through an AdaptiveRateLimiter for `duration` seconds,
+		printing the limiter's rate as it converges on the server's capacity.
+	"""
+
+	server = ThrottlingServer(capacity)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	limiter = AdaptiveRateLimiter(start_rate, max_rate=max_rate)
+	session = build_session(pool_size=max_in_flight)
+	fetcher = DetailsFetcher(
+		lambda _: get_json(session, server.url, max_tries=3, backoff_base=0.1, rate_limiter=limiter),
+		max_in_flight=max_in_flight,
+		rate_limiter=limiter,
+	)
+
+	stop_time = time.monotonic() + duration
+
+	def request_stream():
+		while time.monotonic() < stop_time:
+			yield None
+
+	def report():
+		last_served = 0
+		while time.monotonic() < stop_time:
+			time.sleep(1)
+			with server.lock:
+				served, throttled = server.served, server.throttled
+			print(f'{limiter.metrics()["rate"]:>10.2f} {served - last_served:>10} {throttled:>10} {limiter.backoffs:>10}')
+			last_served = served
+
+	print(f'Adaptive rate against a server allowing {capacity} requests per second, starting at {start_rate}')
+	print(f'{"rate":>10} {"served/s":>10} {"throttled":>10} {"backoffs":>10}')
+	reporter = threading.Thread(target=report, daemon=True)
+	reporter.start()
+	fetcher.stream(request_stream(), lambda *_: None)
+	reporter.join()
+	server.shutdown()
+
+	final = limiter.metrics()
+	print(f'Served {server.served} requests in {duration:.0f} s ({server.served / duration:.2f} per second), {server.throttled} throttled')
+	print(f'Final rate {final["rate"]}, {final["backoffs"]} backoffs, {final["pauses"]} Retry-After pauses')
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+	def execute(self, query, vars=None):
+		CountingConnection.count()
+		return super().execute(query, vars)
+
+	def executemany(self, query, vars_list):
+		# psycopg2 sends each parameter set as its own statement
+		vars_list = list(vars_list)
+		CountingConnection.count(len(vars_list))
+		return super().executemany(query, vars_list)
+
+
+class CountingConnection(psycopg2.extensions.connection):
+	"""
+	Connection counting its round trips to the server, i.e. statements, commits and rollbacks,
+		in a total shared by every CountingConnection.
+	"""
+
+	round_trips = 0
+	lock = threading.Lock()
+
+	@classmethod
+	def count(cls, round_trips: int = 1) -> None:
+		with cls.lock:
+			cls.round_trips += round_trips
+
+	def cursor(self, *args, **kwargs):
+		kwargs.setdefault('cursor_factory', CountingCursor)
+		return super().cursor(*args, **kwargs)
+
+	def commit(self):
+		CountingConnection.count()
+		return super().commit()
+
+	def rollback(self):
+		CountingConnection.count()
+		return super().rollback()
+
+
+class BenchmarkScraper(MonsterScraper):
+	"""
+	MonsterScraper that keeps every pipeline it runs, for their stage latencies.
+	"""
+
+	pipelines = []
+
+	def build_pipeline(self, persister):
+		pipeline = super().build_pipeline(persister)
+		BenchmarkScraper.pipelines.append(pipeline)
+		return pipeline
+
+
+def dump_schema(pg_dump: str) -> str:
+	"""
+	Dumps the configured database's schema, without any data.
+	"""
+
+	command = [
+		pg_dump, '--schema-only', '--no-owner', '--no-privileges',
+		'--host', config('DB_HOST'), '--port', str(config('DB_PORT')), '--username', config('DB_USER'), config('DB_DB'),
+	]
+	env = dict(os.environ, PGPASSWORD=config('DB_PASSWORD'))
+	dump = subprocess.run(command, stdout=subprocess.PIPE, env=env, check=True).stdout.decode('utf-8')
+	# Newer versions of pg_dump emit psql meta-commands, which are not SQL
+	return '\n'.join(line for line in dump.splitlines() if not line.startswith('\\'))
+
+
+def create_scratch_database(schema: str) -> str:
+	"""
+	Creates an empty database with `schema` on the configured server.
+
+	Returns:
+		str: The database's name.
+	"""
+
+	name = f'jobfunnel_benchmark_{os.getpid()}'
+	admin_conn = connect()
+	admin_conn.autocommit = True
+	try:
+		admin_conn.cursor().execute(f'CREATE DATABASE {name};')
+	finally:
+		admin_conn.close()
+	db_conn = connect(dbname=name)
+	try:
+		db_conn.cursor().execute(schema)
+		db_conn.commit()
+	finally:
+		db_conn.close()
+	return name
+
+
+def drop_scratch_database(name: str) -> None:
+	admin_conn = connect()
+	admin_conn.autocommit = True
+	try:
+		admin_conn.cursor().execute(f'DROP DATABASE IF EXISTS {name};')
+	finally:
+		admin_conn.close()
+
+
+def stage_percentiles(pipelines: list) -> dict:
+	"""
+	Latency percentiles of each stage, in milliseconds, over every pipeline run.
+	"""
+
+	latencies = {}
+	for pipeline in pipelines:
+		for stage in pipeline.stages:
+			latencies.setdefault(stage.name, []).extend(stage.latencies)
+	return {
+		name: {
+			'count': len(values),
+			'p50_ms': float(np.percentile(values, 50) * 1e3) if values else 0.0,
+			'p90_ms': float(np.percentile(values, 90) * 1e3) if values else 0.0,
+			'p99_ms': float(np.percentile(values, 99) * 1e3) if values else 0.0,
+		}
+		for name, values in latencies.items()
+	}
+
+
+def flatten_results(results: dict) -> dict:
+	"""
+	Comparable metrics of a scraper benchmark run, as name: (value, whether higher is better).
+	"""
+
+	flat = {
+		'jobs_per_second': (results['jobs_per_second'], True),
+		'round_trips_per_job': (results['round_trips_per_job'], False),
+		'peak_rss_mb': (results['peak_rss_mb'], False),
+	}
+	for name, percentiles in results['stages'].items():
+		for percentile in ('p50_ms', 'p90_ms', 'p99_ms'):
+			flat[f'{name}.{percentile}'] = (percentiles[percentile], False)
+	return flat
+
+
+def compare_results(results: dict, baseline: dict, tolerance: float) -> List[str]:
+	"""
+	Prints a run's metrics next to a baseline's.
+
+	Returns:
+		List[str]: Metrics that are worse than the baseline by more than `tolerance`, a fraction.
+			Latencies must also be at least a millisecond worse, so noise in tiny ones is not flagged.
+	"""
+
+	current = flatten_results(results)
+	previous = flatten_results(baseline)
+	regressions = []
+	print(f'{"metric":<24} {"baseline":>12} {"current":>12} {"change":>9}')
+	for name, (value, higher_is_better) in current.items():
+		if name not in previous:
+			continue
+		old = previous[name][0]
+		change = (value - old) / old if old else 0.0
+		worse = -change if higher_is_better else change
+		flag = ''
+		if worse > tolerance and not (name.endswith('_ms') and abs(value - old) < 1):
+			regressions.append(name)
+			flag = '  worse'
+		print(f'{name:<24} {old:>12.3f} {value:>12.3f} {change:>+8.1%}{flag}')
+	return regressions
+
+
+def benchmark_scraper(
+		fixtures_directory: Optional[str],
+		titles: int,
+		jobs_per_title: int,
+		latency: float,
+		jitter: float,
+		error_rate: float,
+		workers: int,
+		max_in_flight: int,
+		requests_per_second: float,
+		convert_processes: int,
+		schema_file: Optional[str],
+		pg_dump: str,
+		seed: int,
+) -> dict:
+	"""
+	Runs `get_and_store_data` against a ReplayServer and a scratch database,
+		and measures throughput, stage latencies, database round trips and memory.
+		Without a fixtures directory, synthetic fixtures are generated.
+
+	Returns:
+		dict: The run's results.
+	"""
+
+	temp_directory = tempfile.mkdtemp(prefix='jobfunnel-benchmark-')
+	if fixtures_directory is None:
+		fixtures = ReplayFixtures(os.path.join(temp_directory, 'fixtures'))
+		generate_fixtures(fixtures, MonsterScraper.default_title_list[:titles], jobs_per_title=jobs_per_title, seed=seed)
+	else:
+		fixtures = ReplayFixtures(fixtures_directory)
+	title_list = fixtures.titles()[:titles]
+
+	if schema_file is not None:
+		with open(schema_file) as f:
+			schema = f.read()
+	else:
+		schema = dump_schema(pg_dump)
+	database = create_scratch_database(schema)
+	configured_database = os.environ.get('DB_DB')
+	# Settings are read from the environment first, so anything connecting on its own uses the scratch database too
+	os.environ['DB_DB'] = database
+	os.environ['SCRAPER_RESPONSE_CACHE'] = 'False'
+	server = ReplayServer(fixtures, latency=latency, jitter=jitter, error_rate=error_rate, seed=seed)
+	server.start()
+	pool = ConnectionPool(max_size=max(1, workers) + 1, dbname=database, connection_factory=CountingConnection)
+	db_conn = None
+	try:
+		db_conn = pool.getconn()
+		BenchmarkScraper.pipelines = []
+		CountingConnection.round_trips = 0
+		with BenchmarkScraper(
+				search_backend='http',
+				search_base_url=server.search_base_url,
+				details_base_url=server.details_base_url,
+				max_in_flight=max_in_flight,
+				requests_per_second=requests_per_second,
+				convert_processes=convert_processes,
+				near_duplicate_threshold=0,
+				checkpoint=ScrapeCheckpoint('monster', directory=os.path.join(temp_directory, 'checkpoints')),
+				connection_pool=pool,
+		) as scraper:
+			start = time.perf_counter()
+			scraper.get_and_store_data(db_conn, title_list=list(title_list), workers=workers)
+			seconds = time.perf_counter() - start
+		round_trips = CountingConnection.round_trips
+
+		curr = db_conn.cursor()
+		curr.execute('SELECT COUNT(*) FROM job_listings;')
+		jobs = curr.fetchone()[0]
+		curr.close()
+	finally:
+		if db_conn is not None:
+			pool.putconn(db_conn)
+		pool.close()
+		server.stop()
+		if configured_database is None:
+			del os.environ['DB_DB']
+		else:
+			os.environ['DB_DB'] = configured_database
+		drop_scratch_database(database)
+		shutil.rmtree(temp_directory, ignore_errors=True)
+
+	# ru_maxrss is in kilobytes on Linux
+	return {
+		'titles': len(title_list),
+		'jobs': jobs,
+		'seconds': seconds,
+		'jobs_per_second': jobs / seconds if seconds > 0 else 0.0,
+		'round_trips': round_trips,
+		'round_trips_per_job': round_trips / jobs if jobs else 0.0,
+		'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+		'peak_child_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+		'requests': dict(server.counts),
+		'stages': stage_percentiles(BenchmarkScraper.pipelines),
+		'settings': {
+			'latency': latency,
+			'jitter': jitter,
+			'error_rate': error_rate,
+			'workers': workers,
+			'max_in_flight': max_in_flight,
+			'requests_per_second': requests_per_second,
+			'convert_processes': convert_processes,
+		},
+	}
+
+
+def print_scraper_results(results: dict) -> None:
+	print(f'Scraped {results["jobs"]} jobs for {results["titles"]} titles in {results["seconds"]:.2f} s: {results["jobs_per_second"]:.1f} jobs per second')
+	print(f'Requests served: {results["requests"]}')
+	print(f'Database round trips: {results["round_trips"]}, {results["round_trips_per_job"]:.2f} per job')
+	print(f'Peak RSS: {results["peak_rss_mb"]:.1f} MB, largest child process {results["peak_child_rss_mb"]:.1f} MB')
+	print(f'{"stage":<10} {"items":>8} {"p50 ms":>10} {"p90 ms":>10} {"p99 ms":>10}')
+	for name, percentiles in results['stages'].items():
+		print(f'{name:<10} {percentiles["count"]:>8} {percentiles["p50_ms"]:>10.2f} {percentiles["p90_ms"]:>10.2f} {percentiles["p99_ms"]:>10.2f}')
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Performance benchmarks.')
+	subparsers = parser.add_subparsers(dest='command')
+	neardup_parser = subparsers.add_parser('neardup', help='Near-duplicate index lookup cost as the corpus grows.')
+	neardup_parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 2000, 4000, 8000, 16000, 32000])
+	neardup_parser.add_argument('--queries', type=int, default=500)
+	neardup_parser.add_argument('--threshold', type=float, default=0.8)
+	neardup_parser.add_argument('--edit-fraction', type=float, default=0.01)
+	neardup_parser.add_argument('--seed', type=int, default=0)
+	ratelimit_parser = subparsers.add_parser('ratelimit', help='Adaptive request rate against a local server that throttles.')
+	ratelimit_parser.add_argument('--capacity', type=float, default=20.0)
+	ratelimit_parser.add_argument('--start-rate', type=float, default=2.0)
+	ratelimit_parser.add_argument('--max-rate', type=float, default=100.0)
+	ratelimit_parser.add_argument('--duration', type=float, default=30.0)
+	ratelimit_parser.add_argument('--max-in-flight', type=int, default=8)
+	lda_parser = subparsers.add_parser('lda', help='lda17 topic inference, one description at a time and batched.')
+	lda_parser.add_argument('--documents', type=int, default=2000)
+	lda_parser.add_argument('--words', type=int, default=300)
+	lda_parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+	lda_parser.add_argument('--seed', type=int, default=0)
+	neighbors_parser = subparsers.add_parser('neighbors', help='Nearest-neighbour index update and query cost as the number of jobs grows.')
+	neighbors_parser.add_argument('--sizes', type=int, nargs='+', default=[100000, 250000, 500000, 1000000, 2000000])
+	neighbors_parser.add_argument('--batch', type=int, default=10000)
+	neighbors_parser.add_argument('--queries', type=int, default=1000)
+	neighbors_parser.add_argument('--k', type=int, default=20)
+	neighbors_parser.add_argument('--refit-max', type=int, default=1000000, help='Largest size the old refit is timed at.')
+	neighbors_parser.add_argument('--seed', type=int, default=0)
+	similar_parser = subparsers.add_parser('similar', help='Similar-jobs lookup latency and throughput under concurrent load.')
+	similar_parser.add_argument('--jobs', type=int, default=500000)
+	similar_parser.add_argument('--max-batches', type=int, nargs='+', default=[64], help='Batch sizes to run with, e.g. 1 64 to compare with answering lookups one at a time.')
+	similar_parser.add_argument('--max-wait-ms', type=float, default=2.0)
+	similar_parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+	similar_parser.add_argument('--requests', type=int, default=200, help='Lookups per client.')
+	similar_parser.add_argument('--description-fraction', type=float, default=0.2)
+	similar_parser.add_argument('--k', type=int, default=10)
+	similar_parser.add_argument('--budget-ms', type=float, default=100.0, help='p99 latency above which the run fails.')
+	similar_parser.add_argument('--url', help='A running app\'s /similar URL to load-test instead, with lookups by description.')
+	similar_parser.add_argument('--seed', type=int, default=0)
+	scraper_parser = subparsers.add_parser('scraper', help='Scraper throughput against recorded responses and a scratch database.')
+	scraper_parser.add_argument('--fixtures', help='Directory of recorded responses. Defaults to generating synthetic ones.')
+	scraper_parser.add_argument('--titles', type=int, default=4)
+	scraper_parser.add_argument('--jobs-per-title', type=int, default=100)
+	scraper_parser.add_argument('--latency', type=float, default=0.05)
+	scraper_parser.add_argument('--jitter', type=float, default=0.05)
+	scraper_parser.add_argument('--error-rate', type=float, default=0.0)
+	scraper_parser.add_argument('--workers', type=int, default=1)
+	scraper_parser.add_argument('--max-in-flight', type=int, default=8)
+	scraper_parser.add_argument('--requests-per-second', type=float, default=0.0, help='0 for no rate limit.')
+	scraper_parser.add_argument('--convert-processes', type=int, default=0)
+	scraper_parser.add_argument('--schema-file', help='SQL creating the tables. Defaults to dumping the configured database\'s schema.')
+	scraper_parser.add_argument('--pg-dump', default='pg_dump', help='pg_dump executable used to dump the schema.')
+	scraper_parser.add_argument('--seed', type=int, default=0)
+	scraper_parser.add_argument('--save-baseline', help='File to save the results to.')
+	scraper_parser.add_argument('--baseline', help='File of saved results to compare against.')
+	scraper_parser.add_argument('--tolerance', type=float, default=0.1, help='Change counted as a regression, as a fraction.')
+	record_parser = subparsers.add_parser('record', help='Record real Monster responses for the scraper benchmark.')
+	record_parser.add_argument('fixtures', help='Directory to save the responses to.')
+	record_parser.add_argument('--titles', nargs='+', default=MonsterScraper.default_title_list[:4])
+	record_parser.add_argument('--max-pages', type=int, default=2)
+	record_parser.add_argument('--requests-per-second', type=float, default=1.0)
+	args = parser.parse_args()
+	if args.command is None:
+		parser.error('a command is required')
+
+	# Results are printed; only problems are logged, to the console
+	logging.basicConfig(level=logging.WARNING)
+	if args.command == 'neardup':
+		benchmark_neardup(args.sizes, args.queries, args.threshold, args.edit_fraction, args.seed)
+	elif args.command == 'ratelimit':
+		benchmark_ratelimit(args.capacity, args.start_rate, args.max_rate, args.duration, args.max_in_flight)
+	elif args.command == 'lda':
+		benchmark_lda(args.documents, args.words, args.processes, args.seed)
+	elif args.command == 'neighbors':
+		benchmark_neighbors(args.sizes, args.batch, args.queries, args.k, args.refit_max, args.seed)
+	elif args.command == 'similar':
+		within_budget = benchmark_similar(
+			args.jobs, args.max_batches, args.max_wait_ms, args.concurrency, args.requests, args.description_fraction,
+			args.k, args.budget_ms, args.url, args.seed,
+		)
+		if not within_budget:
+			print(f'p99 latency over the {args.budget_ms} ms budget, or lookups failed')
+			sys.exit(1)
+	elif args.command == 'scraper':
+		results = benchmark_scraper(
+			args.fixtures, args.titles, args.jobs_per_title, args.latency, args.jitter, args.error_rate,
+			args.workers, args.max_in_flight, args.requests_per_second, args.convert_processes,
+			args.schema_file, args.pg_dump, args.seed,
+		)
+		print_scraper_results(results)
+		regressions = []
+		if args.baseline:
+			with open(args.baseline) as f:
+				regressions = compare_results(results, json.load(f), args.tolerance)
+		if args.save_baseline:
+			with open(args.save_baseline, 'w') as f:
+				json.dump(results, f, indent=2)
+			print(f'Saved results to {args.save_baseline}')
+		if regressions:
+			print(f'Worse than baseline: {", ".join(regressions)}')
+			sys.exit(1)
+	elif args.command == 'record':
+		with MonsterScraper(search_backend='http', requests_per_second=args.requests_per_second, adaptive_rate=False) as scraper:
+			recorded = record_fixtures(ReplayFixtures(args.fixtures), scraper, args.titles, max_pages=args.max_pages)
+		print(f'Recorded {recorded} details documents to {args.fixtures}')
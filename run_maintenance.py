@@ -0,0 +1,44 @@
+import argparse
+import logging
+import os
+
+from datafunctions.database import connect
+from datafunctions.log.log import startLog, getLogFile
+from datafunctions import maintenance
+from datafunctions.retrieve.responsecache import DEFAULT_CACHE_DIRECTORY, ResponseCache
+from datafunctions.retrieve.retrievers.monster import MonsterScraper
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Database maintenance tasks.')
+	subparsers = parser.add_subparsers(dest='command')
+	backfill_parser = subparsers.add_parser('backfill-fingerprints', help='Fill in missing job description fingerprints.')
+	backfill_parser.add_argument('--batch-size', type=int, default=1000)
+	index_parser = subparsers.add_parser('index-near-duplicates', help='Add stored descriptions missing from the near-duplicate index.')
+	index_parser.add_argument('--batch-size', type=int, default=1000)
+	rebuild_parser = subparsers.add_parser('rebuild-from-cache', help='Save jobs from cached details responses, without any requests.')
+	rebuild_parser.add_argument('--batch-size', type=int, default=50)
+	args = parser.parse_args()
+	if args.command is None:
+		parser.error('a command is required')
+
+	ROOT_LOG = startLog(getLogFile(__file__))
+	RUN_LOG = logging.getLogger(__name__)
+	RUN_LOG.info('Establishing database connection...')
+	try:
+		with connect() as psql_conn:
+			RUN_LOG.info(f'Running {args.command}...')
+			if args.command == 'backfill-fingerprints':
+				maintenance.backfill_fingerprints(psql_conn, batch_size=args.batch_size)
+			elif args.command == 'index-near-duplicates':
+				maintenance.index_near_duplicates(psql_conn, batch_size=args.batch_size)
+			elif args.command == 'rebuild-from-cache':
+				cache = ResponseCache(os.path.join(DEFAULT_CACHE_DIRECTORY, f'{MonsterScraper.source_name}.sqlite3'), offline=True)
+				with MonsterScraper(response_cache=cache) as scraper:
+					maintenance.rebuild_from_cache(psql_conn, scraper, batch_size=args.batch_size)
+				cache.close()
+	except Exception as e:
+		RUN_LOG.warning(f'Failure while connecting or running {args.command}: {e}')
+		RUN_LOG.warning(e, exc_info=True)
+
+	RUN_LOG.info('Done, exiting.')
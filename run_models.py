@@ -1,7 +1,6 @@
-import psycopg2
 import logging
 
-from decouple import config
+from datafunctions.database import get_pool
 from datafunctions.populate import Populator
 from datafunctions.log.log import startLog, getLogFile
 
@@ -9,15 +8,9 @@ from datafunctions.log.log import startLog, getLogFile
 if __name__ == "__main__":
 	ROOT_LOG = startLog(getLogFile(__file__))
 	RUN_LOG = logging.getLogger(__name__)
-	RUN_LOG.info('Establishing database connection...')
+	RUN_LOG.info('Borrowing database connection...')
 	try:
-		with psycopg2.connect(
-				dbname=config("DB_DB"),
-				user=config("DB_USER"),
-				password=config("DB_PASSWORD"),
-				host=config("DB_HOST"),
-				port=config("DB_PORT")
-		) as psql_conn:
+		with get_pool().connection(commit=True) as psql_conn:
 			RUN_LOG.info('Running models...')
 			Populator().model_and_save_topics(psql_conn)
 	except Exception as e: